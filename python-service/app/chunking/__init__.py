@@ -1,6 +1,7 @@
 """Chunking utilities"""
 from .smart_chunker import SmartChunker
+from .records import ChunkRecord, ChunkSet, vectors_json
 
-__all__ = ['SmartChunker']
+__all__ = ['SmartChunker', 'ChunkRecord', 'ChunkSet', 'vectors_json']
 
 
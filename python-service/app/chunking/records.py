@@ -0,0 +1,160 @@
+"""Compact chunk representation used between chunking and storage"""
+import io
+from typing import Iterator, List, Optional, Sequence
+import numpy as np
+
+
+class ChunkRecord:
+    """
+    Metadata of one chunk
+
+    The text is not copied: a record keeps a reference to its chapter's text
+    and the chunk's offsets into it. The embedding lives in the owning
+    ChunkSet's matrix, at `row`.
+    """
+
+    __slots__ = (
+        'source',
+        'start',
+        'end',
+        'chapter_number',
+        'chapter_title',
+        'page_start',
+        'page_end',
+        'chunk_index',
+        'token_count',
+        'row',
+    )
+
+    def __init__(
+        self,
+        source: str,
+        start: int,
+        end: int,
+        chapter_number: Optional[int],
+        chapter_title: str,
+        page_start: Optional[int],
+        page_end: Optional[int],
+        chunk_index: int,
+        token_count: int,
+    ):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.chapter_number = chapter_number
+        self.chapter_title = chapter_title
+        self.page_start = page_start
+        self.page_end = page_end
+        self.chunk_index = chunk_index
+        self.token_count = token_count
+        self.row = -1  # Embedding row in the owning ChunkSet (-1 = not embedded)
+
+    @property
+    def content(self) -> str:
+        return self.source[self.start:self.end]
+
+    @property
+    def content_length(self) -> int:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        """Legacy dict form (without the embedding)"""
+        return {
+            'content': self.content,
+            'chapter_number': self.chapter_number,
+            'chapter_title': self.chapter_title,
+            'page_start': self.page_start,
+            'page_end': self.page_end,
+            'chunk_index': self.chunk_index,
+            'content_length': self.content_length,
+            'token_count': self.token_count,
+        }
+
+
+class ChunkSet:
+    """
+    A document's chunks: records plus one contiguous float32 embedding matrix
+
+    Batch operations (normalization, similarity, serialization) work on the
+    whole matrix instead of per-chunk Python float lists.
+    """
+
+    def __init__(self, records: Optional[List[ChunkRecord]] = None):
+        self.records: List[ChunkRecord] = records or []
+        self.embeddings: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[ChunkRecord]:
+        return iter(self.records)
+
+    def extend(self, records: Sequence[ChunkRecord]):
+        self.records.extend(records)
+
+    def truncate(self, limit: int):
+        """Keep the first `limit` chunks"""
+        del self.records[limit:]
+        if self.embeddings is not None:
+            self.embeddings = self.embeddings[:limit]
+
+    def texts(self) -> List[str]:
+        return [record.content for record in self.records]
+
+    def set_embeddings(self, vectors: Sequence):
+        """
+        Store one embedding per record (in record order) as a single matrix
+
+        Args:
+            vectors: Sequence of vectors (arrays or float lists), or a 2D array
+        """
+        if len(vectors) != len(self.records):
+            raise ValueError(f"Got {len(vectors)} embeddings for {len(self.records)} chunks")
+        self.embeddings = np.ascontiguousarray(
+            np.vstack(vectors) if len(vectors) else np.zeros((0, 0)), dtype=np.float32
+        )
+        for row, record in enumerate(self.records):
+            record.row = row
+
+    def embedding(self, record: ChunkRecord) -> Optional[np.ndarray]:
+        if self.embeddings is None or record.row < 0:
+            return None
+        return self.embeddings[record.row]
+
+    def normalized(self) -> np.ndarray:
+        """L2-normalized copy of the embedding matrix"""
+        norms = np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return self.embeddings / norms
+
+    def similarity(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every chunk to a query vector"""
+        query = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        return self.normalized() @ (query / norm if norm else query)
+
+    def embeddings_json(self) -> List[str]:
+        """
+        JSON array text of every embedding (see vectors_json)
+        """
+        if self.embeddings is None:
+            return []
+        return vectors_json(self.embeddings)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the embedding matrix"""
+        return self.embeddings.nbytes if self.embeddings is not None else 0
+
+
+def vectors_json(matrix: np.ndarray) -> List[str]:
+    """
+    JSON array text of every row of a float matrix, formatted row by row in C
+
+    '%.9g' round-trips float32 exactly.
+    """
+    if not len(matrix):
+        return []
+    buffer = io.StringIO()
+    np.savetxt(buffer, matrix, fmt='%.9g', delimiter=',')
+    return ['[' + line + ']' for line in buffer.getvalue().splitlines()]
@@ -1,7 +1,8 @@
 """Smart chunking with context preservation"""
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from loguru import logger
 import re
+from .records import ChunkRecord
 
 
 class SmartChunker:
@@ -21,73 +22,84 @@ class SmartChunker:
         """
         Recursive text splitting similar to LangChain's RecursiveCharacterTextSplitter
         """
-        chunks = []
+        return [text[start:end] for start, end in self._split_spans(text)]
+    
+    def _split_spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Same splitting as `_split_text`, as (start, end) offsets into `text`
+        
+        Every chunk (overlap included) is a contiguous slice of the input, so
+        only offsets need to be kept.
+        """
+        spans = []
         
         # Try splitting by each separator
         for separator in self.separators:
             if separator == "":
                 # Last resort: split by character
                 if len(text) <= self.chunk_size:
-                    chunks.append(text)
-                    return chunks
+                    spans.append((0, len(text)))
+                    return spans
                 
                 # Split into chunks with overlap
-                start = 0
-                while start < len(text):
-                    end = min(start + self.chunk_size, len(text))
-                    chunk = text[start:end]
-                    if chunk.strip():
-                        chunks.append(chunk)
-                    start = end - self.chunk_overlap
-                    if start >= end:
-                        break
-                return chunks
+                spans.extend(self._split_fixed(text))
+                return spans
             
             # Try splitting by this separator
             parts = text.split(separator)
             
             # If splitting produces reasonable chunks, use them
             if len(parts) > 1:
-                current_chunk = ""
-                for part in parts:
-                    part_with_sep = part + separator if part != parts[-1] else part
+                current_start = current_end = 0
+                position = 0
+                for idx, part in enumerate(parts):
+                    part_start = position
+                    part_end = part_start + len(part) + (len(separator) if idx < len(parts) - 1 else 0)
+                    position += len(part) + len(separator)
                     
                     # If adding this part would exceed chunk size
-                    if len(current_chunk) + len(part_with_sep) > self.chunk_size and current_chunk:
+                    current_length = current_end - current_start
+                    if current_length + (part_end - part_start) > self.chunk_size and current_length:
                         # Save current chunk
-                        chunks.append(current_chunk)
-                        # Start new chunk with overlap
-                        if self.chunk_overlap > 0 and len(current_chunk) > self.chunk_overlap:
-                            overlap_text = current_chunk[-self.chunk_overlap:]
-                            current_chunk = overlap_text + part_with_sep
+                        spans.append((current_start, current_end))
+                        # Start new chunk with overlap (the overlap precedes the part in the text)
+                        if self.chunk_overlap > 0 and current_length > self.chunk_overlap:
+                            current_start = current_end - self.chunk_overlap
                         else:
-                            current_chunk = part_with_sep
-                    else:
-                        current_chunk += part_with_sep
+                            current_start = part_start
+                    current_end = part_end
                 
                 # Add remaining chunk
-                if current_chunk.strip():
-                    chunks.append(current_chunk)
+                if text[current_start:current_end].strip():
+                    spans.append((current_start, current_end))
                 
                 # If we got reasonable chunks, return them
-                if chunks and all(len(c) <= self.chunk_size * 1.5 for c in chunks):
-                    return chunks
+                if spans and all(end - start <= self.chunk_size * 1.5 for start, end in spans):
+                    return spans
         
         # Fallback: simple splitting
-        if not chunks:
-            start = 0
-            while start < len(text):
-                end = min(start + self.chunk_size, len(text))
-                chunk = text[start:end]
-                if chunk.strip():
-                    chunks.append(chunk)
-                start = end - self.chunk_overlap
-                if start >= end:
-                    break
+        if not spans:
+            spans = self._split_fixed(text)
         
-        return chunks
+        return spans
+    
+    def _split_fixed(self, text: str) -> List[Tuple[int, int]]:
+        """Fixed-size windows with overlap"""
+        spans = []
+        start = 0
+        while start < len(text):
+            end = min(start + self.chunk_size, len(text))
+            if text[start:end].strip():
+                spans.append((start, end))
+            if end == len(text):
+                # Without this, a positive overlap re-emits the tail forever
+                break
+            start = end - self.chunk_overlap
+            if start >= end:
+                break
+        return spans
     
-    def chunk_chapter(self, chapter: Dict) -> List[Dict]:
+    def chunk_chapter(self, chapter: Dict) -> List[ChunkRecord]:
         """
         Chunk a chapter into smaller pieces with metadata
         
@@ -95,7 +107,7 @@ class SmartChunker:
             chapter: Dict with 'content', 'number', 'title', 'start_page', 'end_page'
         
         Returns:
-            List of chunk dicts with metadata
+            List of chunk records referencing the chapter text by offset
         """
         content = chapter.get('content', '')
         if not content or len(content.strip()) < 100:
@@ -103,49 +115,47 @@ class SmartChunker:
             return []
         
         # Split into chunks using our custom splitter
-        chunks = self._split_text(content)
+        spans = self._split_spans(content)
         
-        logger.info(
-            f"Chunked chapter {chapter.get('number')} into {len(chunks)} chunks "
-            f"(avg {sum(len(c) for c in chunks) / len(chunks) if chunks else 0:.0f} chars)"
+        logger.opt(lazy=True).debug(
+            "Chunked chapter {} into {} chunks (avg {:.0f} chars)",
+            lambda: chapter.get('number'),
+            lambda: len(spans),
+            lambda: sum(end - start for start, end in spans) / len(spans) if spans else 0,
         )
         
+        # Truncate chapter title to max 255 chars (MySQL VARCHAR limit)
+        chapter_title = chapter.get('title', '') or ''
+        if len(chapter_title) > 255:
+            chapter_title = chapter_title[:252] + '...'
+        
+        # Estimate pages (assuming ~2000 chars per page)
+        chars_per_page = 2000
+        start_page = chapter.get('start_page', 1)
+        
         # Add metadata to each chunk
-        chunked_data = []
-        for idx, chunk_text in enumerate(chunks):
-            if not chunk_text.strip():
+        records = []
+        for idx, (chunk_start, chunk_end) in enumerate(spans):
+            if not content[chunk_start:chunk_end].strip():
                 continue
             
             # Estimate page range for this chunk
-            total_chars = len(content)
-            chunk_start_char = content.find(chunk_text)
-            chunk_end_char = chunk_start_char + len(chunk_text)
-            
-            # Estimate pages (assuming ~2000 chars per page)
-            chars_per_page = 2000
-            start_page = chapter.get('start_page', 1)
-            estimated_start = start_page + (chunk_start_char // chars_per_page)
-            estimated_end = start_page + (chunk_end_char // chars_per_page)
-            
-            # Truncate chapter title to max 255 chars (MySQL VARCHAR limit)
-            chapter_title = chapter.get('title', '') or ''
-            if len(chapter_title) > 255:
-                chapter_title = chapter_title[:252] + '...'
-            
-            chunk_data = {
-                'content': chunk_text,
-                'chapter_number': chapter.get('number'),
-                'chapter_title': chapter_title,  # Use truncated version
-                'page_start': max(estimated_start, chapter.get('start_page', 1)),
-                'page_end': min(estimated_end, chapter.get('end_page', 1)),
-                'chunk_index': idx,
-                'content_length': len(chunk_text),
-                'token_count': self._estimate_tokens(chunk_text),
-            }
+            estimated_start = start_page + (chunk_start // chars_per_page)
+            estimated_end = start_page + (chunk_end // chars_per_page)
             
-            chunked_data.append(chunk_data)
+            records.append(ChunkRecord(
+                source=content,
+                start=chunk_start,
+                end=chunk_end,
+                chapter_number=chapter.get('number'),
+                chapter_title=chapter_title,
+                page_start=max(estimated_start, chapter.get('start_page', 1)),
+                page_end=min(estimated_end, chapter.get('end_page', 1)),
+                chunk_index=idx,
+                token_count=self._estimate_tokens(content[chunk_start:chunk_end]),
+            ))
         
-        return chunked_data
+        return records
     
     def _estimate_tokens(self, text: str) -> int:
         """Rough token estimation: ~4 chars per token"""
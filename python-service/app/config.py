@@ -1,6 +1,6 @@
 """Configuration settings"""
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, Tuple
 
 
 class Settings(BaseSettings):
@@ -10,30 +10,97 @@ class Settings(BaseSettings):
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
     API_PREFIX: str = "/api/v1"
+    LAZY_INIT: bool = True  # Import parsers/clients on first use (False: warm up at startup)
+    WORKERS: int = 0  # Worker processes for `python -m app.serve` (0 = one per CPU)
     
     # OpenAI
     OPENAI_API_KEY: str
     OPENAI_EMBEDDING_MODEL: str = "text-embedding-3-large"
-    OPENAI_EMBEDDING_DIMENSIONS: int = 3072
+    OPENAI_EMBEDDING_DIMENSIONS: int = 3072  # Shortened vectors below the model's native size (text-embedding-3-*)
+    OPENAI_BASE_URL: Optional[str] = None  # Alternative endpoint (e.g. the load-test stub)
+    
+    # Embedding rate limits (for the whole service: split evenly across WORKERS)
+    EMBEDDING_REQUESTS_PER_MINUTE: int = 3000
+    EMBEDDING_TOKENS_PER_MINUTE: int = 1_000_000
+    EMBEDDING_MAX_CONCURRENCY: int = 8
+    EMBEDDING_MIN_CONCURRENCY: int = 1
+    EMBEDDING_REQUEST_TIMEOUT: float = 60.0  # seconds per API call
+    EMBEDDING_RETRY_BASE_DELAY: float = 1.0  # seconds, doubled per attempt
+    EMBEDDING_RETRY_MAX_DELAY: float = 60.0
+    EMBEDDING_BATCH_SIZE: int = 100  # Max texts per API call (merged across jobs)
+    EMBEDDING_BATCH_MAX_TOKENS: int = 250_000  # Max estimated tokens per API call
+    EMBEDDING_BATCH_MAX_WAIT_MS: int = 20  # Max time a text waits for a batch to fill
+    
+    # Re-embedding backfill (python -m app.services.reembed, /api/v1/backfills): its own budget,
+    # taken out of the account's limits on top of the live service's
+    EMBEDDING_BACKFILL_REQUESTS_PER_MINUTE: int = 500
+    EMBEDDING_BACKFILL_TOKENS_PER_MINUTE: int = 200_000
+    EMBEDDING_BACKFILL_CONCURRENCY: int = 4  # API calls in flight
+    EMBEDDING_BACKFILL_PAGE_SIZE: int = 500  # Chunks read per keyset page
+    EMBEDDING_BACKFILL_DIR: str = "./backfills"  # Progress and lock of each backfill (local to the host)
+    
+    # Query embedding cache (/api/v1/embed-query)
+    QUERY_CACHE_MAX_ENTRIES: int = 10_000
+    QUERY_CACHE_MAX_BYTES: int = 128 * 1024 * 1024  # 128MB of float32 vectors
+    QUERY_CACHE_TTL_SECONDS: int = 24 * 3600
+    QUERY_EMBED_MAX_BATCH: int = 64  # Max queries per request
+    
+    # Retrieval (/api/v1/search)
+    RETRIEVAL_MAX_K: int = 100
+    RETRIEVAL_MAX_BATCH: int = 64  # Max queries per /api/v1/search/batch request
+    RETRIEVAL_MMR_FETCH_K: int = 200  # Candidates diversified by mode="mmr" (default fetch_k)
+    RETRIEVAL_MMR_MAX_FETCH_K: int = 5000
+    CHUNK_STREAM_PAGE_SIZE: int = 500  # Rows per query when streaming chunks as NDJSON
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 5000
+    RETRIEVAL_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 3600
+    INDEX_DIR: str = "./index"  # Memory-mapped subject indexes and topic clusters, shared by workers
+    INDEX_COMPACTION_THRESHOLD: float = 0.2  # Rewrite a subject index once this share of its rows is tombstoned
+    CLUSTER_MAX_K: int = 64  # Max topic clusters per subject (k ~ sqrt(chunks / 2))
+    CLUSTER_ITERATIONS: int = 20
+    CLUSTER_REBUILD_GROWTH: float = 1.5  # Full rebuild once a subject grows by this factor
     
     # Database (MySQL)
     DATABASE_URL: str
     DATABASE_POOL_SIZE: int = 10
     DATABASE_MAX_OVERFLOW: int = 20
+    DATABASE_STATEMENT_TIMEOUT: int = 60  # seconds per statement read/write and lock wait (0 = no limit)
     
     # File Processing
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
     UPLOAD_DIR: str = "./uploads"
-    TEMP_DIR: str = "./temp"
+    TEMP_DIR: str = "./temp"  # Spill directory for large uploads
+    BUNDLE_MAX_SIZE: int = 1024 * 1024 * 1024  # 1GB, for /api/v1/bundles/import
+    UPLOAD_SPOOL_MAX_MEMORY: int = 4 * 1024 * 1024  # Uploads up to 4MB are parsed from memory
+    DOCX_STREAMING: bool = True  # Stream word/document.xml (tables, page breaks)
+    EXCEL_STREAMING: bool = True  # Read-only workbooks, rows iterated lazily
+    EXCEL_ROWS_PER_CHAPTER: int = 0  # Split sheets into row ranges (0 = one chapter per sheet)
+    TEXT_NORMALIZATION: bool = True  # PDF: NFC, drop running headers/footers, rejoin wrapped lines
+    BOILERPLATE_MIN_PAGE_RATIO: float = 0.5  # Share of pages a top/bottom line must repeat on to be dropped
     
     # Chunking
     CHUNK_SIZE: int = 1000  # tokens (~3000 chars)
     CHUNK_OVERLAP: int = 200  # tokens (~600 chars)
     MAX_CHUNKS_PER_DOCUMENT: int = 100
     
+    # Admission control for /process and /process-sync (for the whole service: split evenly across WORKERS)
+    ADMISSION_MAX_RUNNING: int = 8  # Documents processed at once
+    ADMISSION_PRIORITY_SLOTS: int = 2  # Of those, slots bulk jobs may not take
+    ADMISSION_MAX_QUEUED: int = 200  # Bulk jobs waiting for a slot (more: 429 + Retry-After)
+    ADMISSION_MAX_QUEUED_PRIORITY: int = 50  # Priority jobs waiting for a slot
+    ADMISSION_MAX_PER_USER: int = 20  # Bulk jobs queued or running per user (each worker allows its share)
+    ADMISSION_MAX_PER_SUBJECT: int = 50  # Bulk jobs queued or running per subject (each worker allows its share)
+    ADMISSION_SMALL_FILE_SIZE: int = 512 * 1024  # Uploads up to this size take the priority lane
+    
     # Processing
-    PROCESSING_TIMEOUT: int = 300  # seconds
-    MAX_RETRIES: int = 3
+    PROCESSING_TIMEOUT: int = 300  # seconds per job, from getting a slot to the commit
+    PROCESSING_CANCEL_GRACE: int = 30  # seconds a job past its deadline keeps its slot before it is reclaimed
+    PARSE_IN_SUBPROCESS: bool = True  # Parse in a child process that is killed on timeout/cancel
+    CHECKPOINT_ENABLED: bool = True  # Checkpoint background jobs to disk and resume them after a restart
+    CHECKPOINT_DIR: str = "./checkpoints"  # Local to the host: uploads and completed stages of in-flight jobs
+    CHECKPOINT_MIN_SIZE: int = 512 * 1024  # Smaller uploads are cheap to redo: kept in memory, not checkpointed
+    MAX_RETRIES: int = 3  # Retries per embedding call
+    DEDUP_ENABLED: bool = True  # Clone chunks of an identical, already processed file
     
     # NestJS Backend
     NESTJS_API_URL: str = "http://localhost:3001/api"
@@ -41,6 +108,10 @@ class Settings(BaseSettings):
     
     # Logging
     LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "logs/app.log"
+    LOG_ASYNC: bool = True  # Write through a background queue instead of blocking the caller
+    LOG_JSON: bool = False  # One JSON object per line in LOG_FILE (context fields included)
+    LOG_SAMPLE_RATE: float = 1.0  # Share of jobs whose INFO/DEBUG lines are kept
     
     class Config:
         env_file = ".env"
@@ -50,3 +121,32 @@ class Settings(BaseSettings):
 settings = Settings()
 
 
+# Native vector size of each embedding model; other sizes are shortened vectors
+NATIVE_DIMENSIONS = {
+    'text-embedding-3-large': 3072,
+    'text-embedding-3-small': 1536,
+    'text-embedding-ada-002': 1536,
+}
+
+
+def embedding_space(model: Optional[str] = None, dimensions: Optional[int] = None) -> str:
+    """
+    Tag of the vectors a model produces at a given size, as stored in
+    chunks.embeddingModel and chunk_embeddings.tag
+
+    The model name alone at its native size (so existing rows keep their
+    tag), `model@dims` otherwise. Defaults to the configured model and size.
+    """
+    model = model or settings.OPENAI_EMBEDDING_MODEL
+    dimensions = dimensions or settings.OPENAI_EMBEDDING_DIMENSIONS
+    if NATIVE_DIMENSIONS.get(model) == dimensions:
+        return model
+    return f"{model}@{dimensions}"
+
+
+def parse_embedding_space(tag: str) -> Tuple[str, Optional[int]]:
+    """Model and vector size of a tag (size None: the model's native size, if unknown)"""
+    model, _, dimensions = tag.partition('@')
+    return model, int(dimensions) if dimensions else NATIVE_DIMENSIONS.get(model)
+
+
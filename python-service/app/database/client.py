@@ -1,16 +1,40 @@
 """Database client for saving chunks"""
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.orm import sessionmaker
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from loguru import logger
-from app.config import settings
-import json
+from app.chunking import ChunkSet
+from app.config import embedding_space, settings
 import pymysql
 
 # Use PyMySQL instead of MySQLdb (pure Python, no system library needed)
 pymysql.install_as_MySQLdb()
 
 
+# Columns of the chunks table that callers may select
+CHUNK_COLUMNS = (
+    'id',
+    'documentId',
+    'chunkIndex',
+    'chapterNumber',
+    'chapterTitle',
+    'pageStart',
+    'pageEnd',
+    'content',
+    'contentLength',
+    'tokenCount',
+    'embedding',
+    'embeddingModel',
+    'chunkType',
+)
+
+# A chunk's vector in embedding space :space is chunks.embedding when the row
+# is tagged with that space, otherwise the one the re-embedding backfill
+# wrote to chunk_embeddings (see app/services/reembed.py)
+SPACE_JOIN = "LEFT JOIN chunk_embeddings ce ON ce.tag = :space AND ce.chunkId = c.id"
+IN_SPACE = "((c.embeddingModel = :space AND c.embedding IS NOT NULL) OR ce.embedding IS NOT NULL)"
+
+
 class DatabaseClient:
     """MySQL database client for saving processed documents"""
     
@@ -34,11 +58,23 @@ class DatabaseClient:
         
         logger.info(f"Connecting to database: {db_url.split('@')[1] if '@' in db_url else '***'}")
         
+        # Bound every statement: a read/write that stalls longer raises instead of
+        # holding a worker thread (and the job's slot) forever, and lock waits
+        # give up at the same point
+        connect_args = {}
+        if settings.DATABASE_STATEMENT_TIMEOUT > 0:
+            connect_args = {
+                'read_timeout': settings.DATABASE_STATEMENT_TIMEOUT,
+                'write_timeout': settings.DATABASE_STATEMENT_TIMEOUT,
+                'init_command': f"SET SESSION innodb_lock_wait_timeout = {settings.DATABASE_STATEMENT_TIMEOUT}",
+            }
+        
         self.engine = create_engine(
             db_url,
             pool_size=settings.DATABASE_POOL_SIZE,
             max_overflow=settings.DATABASE_MAX_OVERFLOW,
             pool_pre_ping=True,
+            connect_args=connect_args,
             echo=False,  # Set to True for SQL debugging
         )
         self.SessionLocal = sessionmaker(bind=self.engine)
@@ -46,31 +82,32 @@ class DatabaseClient:
     def save_chunks(
         self,
         document_id: str,
-        chunks: List[Dict],
+        chunks: ChunkSet,
         subject_id: str,
         document_type: str,
         user_id: Optional[str] = None,
         original_filename: Optional[str] = None,
+        before_commit: Optional[Callable[[], None]] = None,
     ) -> int:
         """
         Save chunks to database
         
         Args:
             document_id: Document ID from NestJS
-            chunks: List of chunk dicts with content, embedding, metadata
+            chunks: Chunk records with their embedding matrix
             subject_id: Subject ID
             document_type: Document type (TEXTBOOK, etc.)
             user_id: User ID who uploaded
             original_filename: Original file name
+            before_commit: Called right before the commit; raising rolls
+                the whole save back (used to cancel jobs)
         
         Returns:
             Number of chunks saved
         """
-        logger.info(f"💾 [DB] Starting save_chunks for document {document_id}")
-        logger.info(f"📊 [DB] Total chunks to save: {len(chunks)}")
-        logger.info(f"📋 [DB] Subject ID: {subject_id}, Document Type: {document_type}")
+        logger.info(f"💾 [DB] Saving {len(chunks)} chunks (subject {subject_id}, type {document_type})")
         
-        if not chunks or len(chunks) == 0:
+        if len(chunks) == 0:
             logger.warning(f"⚠️ [DB] No chunks to save for document {document_id}")
             self._update_document_status(document_id, 'FAILED', error='No chunks generated')
             return 0
@@ -81,7 +118,7 @@ class DatabaseClient:
             test_query = text("SELECT 1 as test")
             test_session.execute(test_query)
             test_session.close()
-            logger.info(f"✅ [DB] Database connection test successful")
+            logger.debug("✅ [DB] Database connection test successful")
         except Exception as conn_error:
             logger.error(f"❌ [DB] Database connection failed: {conn_error}")
             self._update_document_status(document_id, 'FAILED', error=f'Database connection failed: {str(conn_error)}')
@@ -89,105 +126,108 @@ class DatabaseClient:
         
         session = self.SessionLocal()
         saved_count = 0
+        space = embedding_space()
         
         try:
-            logger.info(f"🔄 [DB] Starting to insert {len(chunks)} chunks...")
+            # Serialize every embedding at once from the contiguous matrix
+            embeddings_json = chunks.embeddings_json()
+            
+            params = []
             for idx, chunk in enumerate(chunks):
-                if idx == 0:
-                    logger.info(f"📝 [DB] Sample chunk data: content_length={len(chunk.get('content', ''))}, has_embedding={chunk.get('embedding') is not None}")
-                    logger.info(f"📝 [DB] Sample chunk keys: {list(chunk.keys())}")
-                # Prepare embedding JSON
-                embedding = chunk.get('embedding', [])
-                if not embedding:
+                if chunk.row < 0:
                     logger.warning(f"⚠️ [DB] Chunk {idx} has no embedding, skipping...")
                     continue
                 
-                embedding_json = json.dumps(embedding)
-                
                 # Validate required fields
-                if not chunk.get('content'):
+                if chunk.content_length == 0:
                     logger.warning(f"⚠️ [DB] Chunk {idx} has no content, skipping...")
                     continue
                 
                 # Truncate chapter_title if too long (MySQL VARCHAR limit is typically 255)
-                chapter_title = chunk.get('chapter_title', '') or ''
+                chapter_title = chunk.chapter_title or ''
                 if len(chapter_title) > 255:
                     logger.warning(f"⚠️ [DB] Truncating chapter_title from {len(chapter_title)} to 255 chars")
                     chapter_title = chapter_title[:252] + '...'  # Leave room for ellipsis
                 
-                # Insert chunk into database
-                # Note: Prisma uses camelCase, but MySQL might use different naming
-                # Check actual column names in database
-                try:
-                    # Try with camelCase first (Prisma default)
-                    query = text("""
-                        INSERT INTO chunks (
-                            id,
-                            documentId,
-                            chapterNumber,
-                            chapterTitle,
-                            pageStart,
-                            pageEnd,
-                            content,
-                            contentLength,
-                            tokenCount,
-                            embedding,
-                            embeddingModel,
-                            chunkIndex,
-                            chunkType,
-                            createdAt,
-                            updatedAt
-                        ) VALUES (
-                            UUID(),
-                            :document_id,
-                            :chapter_number,
-                            :chapter_title,
-                            :page_start,
-                            :page_end,
-                            :content,
-                            :content_length,
-                            :token_count,
-                            :embedding,
-                            :embedding_model,
-                            :chunk_index,
-                            :chunk_type,
-                            NOW(),
-                            NOW()
-                        )
-                    """)
-                    
-                    params = {
-                        'document_id': document_id,
-                        'chapter_number': chunk.get('chapter_number'),
-                        'chapter_title': chapter_title,  # Use truncated version
-                        'page_start': chunk.get('page_start'),
-                        'page_end': chunk.get('page_end'),
-                        'content': chunk.get('content', ''),
-                        'content_length': chunk.get('content_length', len(chunk.get('content', ''))),
-                        'token_count': chunk.get('token_count'),
-                        'embedding': embedding_json,
-                        'embedding_model': 'text-embedding-3-large',
-                        'chunk_index': chunk.get('chunk_index', idx),
-                        'chunk_type': 'TEXT',
-                    }
-                    
+                params.append({
+                    'document_id': document_id,
+                    'chapter_number': chunk.chapter_number,
+                    'chapter_title': chapter_title,  # Use truncated version
+                    'page_start': chunk.page_start,
+                    'page_end': chunk.page_end,
+                    'content': chunk.content,
+                    'content_length': chunk.content_length,
+                    'token_count': chunk.token_count,
+                    'embedding': embeddings_json[chunk.row],
+                    'embedding_model': space,
+                    'chunk_index': chunk.chunk_index,
+                    'chunk_type': 'TEXT',
+                })
+            
+            if params:
+                logger.debug(
+                    "📝 [DB] Sample chunk data: content_length={}, embedding_dims={}",
+                    params[0]['content_length'], chunks.embeddings.shape[1],
+                )
+            
+            # Insert all chunks with one executemany
+            # Note: Prisma uses camelCase column names
+            query = text("""
+                INSERT INTO chunks (
+                    id,
+                    documentId,
+                    chapterNumber,
+                    chapterTitle,
+                    pageStart,
+                    pageEnd,
+                    content,
+                    contentLength,
+                    tokenCount,
+                    embedding,
+                    embeddingModel,
+                    chunkIndex,
+                    chunkType,
+                    createdAt,
+                    updatedAt
+                ) VALUES (
+                    UUID(),
+                    :document_id,
+                    :chapter_number,
+                    :chapter_title,
+                    :page_start,
+                    :page_end,
+                    :content,
+                    :content_length,
+                    :token_count,
+                    :embedding,
+                    :embedding_model,
+                    :chunk_index,
+                    :chunk_type,
+                    NOW(),
+                    NOW()
+                )
+            """)
+            
+            try:
+                # Re-processing a document replaces its chunks (same transaction)
+                replaced = session.execute(
+                    text("DELETE FROM chunks WHERE documentId = :document_id"),
+                    {'document_id': document_id},
+                ).rowcount
+                if replaced:
+                    logger.info(f"♻️ [DB] Replacing {replaced} chunks of a previous run")
+                if params:
                     session.execute(query, params)
-                    
-                    if idx == 0:
-                        logger.info(f"✅ [DB] First chunk inserted successfully")
-                    
-                except Exception as insert_error:
-                    logger.error(f"❌ [DB] Error inserting chunk {idx}: {insert_error}")
-                    logger.error(f"❌ [DB] Chunk data: content_length={len(chunk.get('content', ''))}, embedding_length={len(embedding)}")
-                    raise  # Re-raise to trigger rollback
-                
-                saved_count += 1
-                if saved_count % 10 == 0:
-                    logger.info(f"💾 [DB] Saved {saved_count}/{len(chunks)} chunks...")
+            except Exception as insert_error:
+                logger.error(f"❌ [DB] Error inserting chunks: {insert_error}")
+                raise  # Re-raise to trigger rollback
             
+            saved_count = len(params)
+            
+            if before_commit is not None:
+                before_commit()
             session.commit()
-            logger.info(f"✅ [DB] Successfully saved {saved_count} chunks for document {document_id}")
-            logger.info(f"📊 [DB] Chunks saved: {saved_count}/{len(chunks)}")
+            logger.info(f"✅ [DB] Saved {saved_count}/{len(chunks)} chunks")
             
             # Update document status
             self._update_document_status(document_id, 'COMPLETED', saved_count)
@@ -257,4 +297,666 @@ class DatabaseClient:
         
         finally:
             session.close()
+    
+    def set_content_hash(self, document_id: str, content_hash: str):
+        """Record a document's fingerprint (matched by later uploads once COMPLETED)"""
+        session = self.SessionLocal()
+        
+        try:
+            query = text("""
+                UPDATE documents
+                SET contentHash = :content_hash,
+                    updatedAt = NOW()
+                WHERE id = :document_id
+            """)
+            session.execute(query, {'content_hash': content_hash, 'document_id': document_id})
+            session.commit()
+        
+        except Exception as e:
+            logger.error(f"Error saving content hash: {e}")
+            session.rollback()
+        
+        finally:
+            session.close()
+    
+    def clone_duplicate_chunks(self, document_id: str, content_hash: str) -> Optional[Dict]:
+        """
+        Copy the chunks of an already processed identical file to a new document
+        
+        Finds a COMPLETED document with the same fingerprint, copies its chunks
+        and embeddings server-side with one INSERT…SELECT and marks the new
+        document COMPLETED, all in one transaction. Chunks of a previous run
+        of the document are deleted first, as in `save_chunks`. The source row is locked
+        in share mode so it can't be deleted mid-copy.
+        
+        Args:
+            document_id: New document ID
+            content_hash: Fingerprint of the uploaded file
+        
+        Returns:
+            Dict with source_document_id and chunks_count, or None when there is
+            no usable duplicate (the caller then processes the file normally)
+        """
+        session = self.SessionLocal()
+        
+        try:
+            source = session.execute(text("""
+                SELECT d.id
+                FROM documents d
+                WHERE d.contentHash = :content_hash
+                  AND d.status = 'COMPLETED'
+                  AND d.id <> :document_id
+                ORDER BY d.processedAt DESC
+                LIMIT 1
+                LOCK IN SHARE MODE
+            """), {'content_hash': content_hash, 'document_id': document_id}).scalar()
+            if source is None:
+                return None
+            
+            # Re-processing a document replaces its chunks (same transaction)
+            replaced = session.execute(
+                text("DELETE FROM chunks WHERE documentId = :document_id"),
+                {'document_id': document_id},
+            ).rowcount
+            
+            copied = session.execute(text("""
+                INSERT INTO chunks (
+                    id, documentId, chapterNumber, chapterTitle, pageStart, pageEnd,
+                    content, contentLength, tokenCount, embedding, embeddingModel,
+                    chunkIndex, chunkType, createdAt, updatedAt
+                )
+                SELECT
+                    UUID(), :document_id, chapterNumber, chapterTitle, pageStart, pageEnd,
+                    content, contentLength, tokenCount, embedding, embeddingModel,
+                    chunkIndex, chunkType, NOW(), NOW()
+                FROM chunks
+                WHERE documentId = :source_id
+                  AND embedding IS NOT NULL
+            """), {'document_id': document_id, 'source_id': source}).rowcount
+            if not copied:
+                # Source lost its chunks (e.g. being reprocessed): not a usable duplicate
+                session.rollback()
+                return None
+            
+            session.execute(text("""
+                UPDATE documents
+                SET status = 'COMPLETED',
+                    contentHash = :content_hash,
+                    errorMessage = NULL,
+                    processedAt = NOW(),
+                    updatedAt = NOW()
+                WHERE id = :document_id
+            """), {'content_hash': content_hash, 'document_id': document_id})
+            
+            session.commit()
+            if replaced:
+                logger.info(f"♻️ [DB] Replaced {replaced} chunks of a previous run of {document_id}")
+            logger.info(f"♻️ [DB] Cloned {copied} chunks from duplicate document {source} to {document_id}")
+            return {'source_document_id': source, 'chunks_count': copied}
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+    
+    def load_subject_embeddings(self, subject_id: str, document_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Load embeddings and filter metadata of a subject's completed chunks
+        
+        Args:
+            subject_id: Subject ID
+            document_ids: Only these documents (None = the whole subject)
+        
+        Returns:
+            List of rows with id, documentId, documentType, chapterNumber,
+            embedding (JSON, in the configured embedding space)
+        """
+        if document_ids is not None and not document_ids:
+            return []
+        
+        session = self.SessionLocal()
+        
+        try:
+            query = text(f"""
+                SELECT c.id, c.documentId, d.type AS documentType, c.chapterNumber,
+                       IF(c.embeddingModel = :space AND c.embedding IS NOT NULL, c.embedding, ce.embedding) AS embedding
+                FROM chunks c
+                JOIN documents d ON d.id = c.documentId
+                {SPACE_JOIN}
+                WHERE d.subjectId = :subject_id
+                  AND d.status = 'COMPLETED'
+                  AND {IN_SPACE}
+                  {'AND c.documentId IN :document_ids' if document_ids is not None else ''}
+                ORDER BY c.documentId, c.chunkIndex
+            """)
+            params = {'subject_id': subject_id, 'space': embedding_space()}
+            if document_ids is not None:
+                query = query.bindparams(bindparam('document_ids', expanding=True))
+                params['document_ids'] = list(document_ids)
+            rows = session.execute(query, params).mappings().all()
+            logger.info(f"📥 [DB] Loaded {len(rows)} chunk embeddings for subject {subject_id}")
+            return [dict(row) for row in rows]
+        
+        finally:
+            session.close()
+    
+    def count_subject_chunks(self, subject_id: str) -> int:
+        """Number of chunks in a subject's completed documents with a vector in the configured space"""
+        session = self.SessionLocal()
+        
+        try:
+            query = text(f"""
+                SELECT COUNT(*)
+                FROM chunks c
+                JOIN documents d ON d.id = c.documentId
+                {SPACE_JOIN}
+                WHERE d.subjectId = :subject_id
+                  AND d.status = 'COMPLETED'
+                  AND {IN_SPACE}
+            """)
+            params = {'subject_id': subject_id, 'space': embedding_space()}
+            return int(session.execute(query, params).scalar() or 0)
+        
+        finally:
+            session.close()
+    
+    def fetch_chunks(self, chunk_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Fetch chunk content and metadata by ID (without embeddings)
+        
+        Returns:
+            Dict of chunk ID -> row
+        """
+        if not chunk_ids:
+            return {}
+        
+        session = self.SessionLocal()
+        
+        try:
+            query = text("""
+                SELECT c.id, c.documentId, c.content, c.chunkIndex, c.chapterNumber,
+                       c.chapterTitle, c.pageStart, c.pageEnd,
+                       d.type, d.originalFileName
+                FROM chunks c
+                JOIN documents d ON d.id = c.documentId
+                WHERE c.id IN :ids
+            """).bindparams(bindparam('ids', expanding=True))
+            rows = session.execute(query, {'ids': list(chunk_ids)}).mappings().all()
+            return {row['id']: dict(row) for row in rows}
+        
+        finally:
+            session.close()
+    
+    def load_export_documents(
+        self,
+        document_ids: Optional[List[str]] = None,
+        subject_id: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        Completed documents to export, by ID and/or subject
+        
+        Returns:
+            List of document rows (id, subjectId, type, originalFileName,
+            mimeType, fileSize, contentHash)
+        """
+        conditions = ["status = 'COMPLETED'"]
+        params = {}
+        if document_ids:
+            conditions.append("id IN :ids")
+            params['ids'] = list(document_ids)
+        if subject_id:
+            conditions.append("subjectId = :subject_id")
+            params['subject_id'] = subject_id
+        
+        session = self.SessionLocal()
+        
+        try:
+            query = text(f"""
+                SELECT id, subjectId, type, originalFileName, mimeType, fileSize, contentHash
+                FROM documents
+                WHERE {' AND '.join(conditions)}
+                ORDER BY createdAt, id
+            """)
+            if document_ids:
+                query = query.bindparams(bindparam('ids', expanding=True))
+            return [dict(row) for row in session.execute(query, params).mappings().all()]
+        
+        finally:
+            session.close()
+    
+    def load_export_chunks(self, document_id: str) -> List[Dict]:
+        """Embedded chunks of one document, in chunk order, embeddings as JSON"""
+        session = self.SessionLocal()
+        
+        try:
+            query = text("""
+                SELECT chapterNumber, chapterTitle, pageStart, pageEnd, content, tokenCount,
+                       embedding, embeddingModel, chunkIndex, chunkType
+                FROM chunks
+                WHERE documentId = :document_id
+                  AND embedding IS NOT NULL
+                ORDER BY chunkIndex
+            """)
+            return [dict(row) for row in session.execute(query, {'document_id': document_id}).mappings().all()]
+        
+        finally:
+            session.close()
+    
+    def import_documents(
+        self,
+        documents: List[Dict],
+        chunks: List[Dict],
+        replace: bool = False,
+    ) -> Dict[str, List[str]]:
+        """
+        Insert exported documents and their chunks in one transaction
+        
+        Documents are created as COMPLETED when missing. An existing document
+        that already has chunks is skipped unless `replace` is set, in which
+        case its chunks are replaced. Chunks go in with one executemany.
+        
+        Args:
+            documents: Document rows (id, subjectId, type, originalFileName,
+                mimeType, fileSize, contentHash)
+            chunks: Chunk insert parameters, each with 'id' and 'document_id'
+            replace: Replace the chunks of documents that already have some
+        
+        Returns:
+            Dict with 'imported' and 'skipped' document IDs
+        
+        Raises:
+            ValueError: If a target subject does not exist
+        """
+        session = self.SessionLocal()
+        
+        try:
+            subject_ids = sorted({document['subjectId'] for document in documents})
+            if subject_ids:
+                found = set(session.execute(
+                    text("SELECT id FROM subjects WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+                    {'ids': subject_ids},
+                ).scalars())
+                missing = [subject for subject in subject_ids if subject not in found]
+                if missing:
+                    raise ValueError(f"Unknown subject(s): {', '.join(missing)}")
+            
+            imported, skipped = [], []
+            for document in documents:
+                existing = session.execute(text("""
+                    SELECT d.id, d.subjectId,
+                           EXISTS(SELECT 1 FROM chunks c WHERE c.documentId = d.id) AS hasChunks
+                    FROM documents d
+                    WHERE d.id = :id
+                    FOR UPDATE
+                """), {'id': document['id']}).mappings().first()
+                
+                if existing is None:
+                    session.execute(text("""
+                        INSERT INTO documents (
+                            id, subjectId, type, originalFileName, fileSize, mimeType,
+                            contentHash, status, processedAt, createdAt, updatedAt
+                        ) VALUES (
+                            :id, :subjectId, :type, :originalFileName, :fileSize, :mimeType,
+                            :contentHash, 'COMPLETED', NOW(), NOW(), NOW()
+                        )
+                    """), document)
+                else:
+                    if existing['subjectId'] != document['subjectId']:
+                        raise ValueError(
+                            f"Document {document['id']} exists in subject {existing['subjectId']}, "
+                            f"not {document['subjectId']}"
+                        )
+                    if existing['hasChunks'] and not replace:
+                        skipped.append(document['id'])
+                        continue
+                    session.execute(text("DELETE FROM chunks WHERE documentId = :id"), {'id': document['id']})
+                    session.execute(text("""
+                        UPDATE documents
+                        SET status = 'COMPLETED',
+                            contentHash = COALESCE(:contentHash, contentHash),
+                            errorMessage = NULL,
+                            processedAt = NOW(),
+                            updatedAt = NOW()
+                        WHERE id = :id
+                    """), {'id': document['id'], 'contentHash': document.get('contentHash')})
+                imported.append(document['id'])
+            
+            wanted = set(imported)
+            params = [chunk for chunk in chunks if chunk['document_id'] in wanted]
+            if params:
+                session.execute(text("""
+                    INSERT INTO chunks (
+                        id, documentId, chapterNumber, chapterTitle, pageStart, pageEnd,
+                        content, contentLength, tokenCount, embedding, embeddingModel,
+                        chunkIndex, chunkType, createdAt, updatedAt
+                    ) VALUES (
+                        :id, :document_id, :chapter_number, :chapter_title, :page_start, :page_end,
+                        :content, :content_length, :token_count, :embedding, :embedding_model,
+                        :chunk_index, :chunk_type, NOW(), NOW()
+                    )
+                """), params)
+            
+            session.commit()
+            logger.info(
+                f"📦 [DB] Imported {len(imported)} documents ({len(params)} chunks), "
+                f"skipped {len(skipped)} already processed"
+            )
+            return {'imported': imported, 'skipped': skipped}
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+    
+    def fetch_chunk_page(
+        self,
+        columns: List[str],
+        document_id: Optional[str] = None,
+        subject_id: Optional[str] = None,
+        after: Optional[tuple] = None,
+        limit: int = 500,
+    ) -> List[Dict]:
+        """
+        One keyset page of chunks in (documentId, chunkIndex, id) order
+        
+        chunkIndex restarts in every chapter, so the chunk ID breaks ties.
+        
+        Args:
+            columns: Chunk columns to select (from CHUNK_COLUMNS); the key
+                columns are always included
+            document_id: Chunks of this document
+            subject_id: Chunks of this subject's completed documents
+            after: (documentId, chunkIndex, id) of the last row already read
+            limit: Page size
+        
+        Returns:
+            List of rows
+        """
+        selected = ['id', 'documentId', 'chunkIndex'] + [
+            column for column in columns if column not in ('id', 'documentId', 'chunkIndex')
+        ]
+        unknown = [column for column in selected if column not in CHUNK_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown chunk columns: {', '.join(unknown)}")
+        
+        conditions = []
+        params = {'limit': limit}
+        if document_id is not None:
+            conditions.append("c.documentId = :document_id")
+            params['document_id'] = document_id
+        if subject_id is not None:
+            conditions.append("d.subjectId = :subject_id AND d.status = 'COMPLETED'")
+            params['subject_id'] = subject_id
+        if after is not None:
+            conditions.append("""(
+                c.documentId > :after_document
+                OR (c.documentId = :after_document AND c.chunkIndex > :after_index)
+                OR (c.documentId = :after_document AND c.chunkIndex = :after_index AND c.id > :after_id)
+            )""")
+            params.update(after_document=after[0], after_index=after[1], after_id=after[2])
+        
+        join = "JOIN documents d ON d.id = c.documentId" if subject_id is not None else ""
+        query = text(f"""
+            SELECT {', '.join('c.' + column for column in selected)}
+            FROM chunks c
+            {join}
+            WHERE {' AND '.join(conditions) or '1 = 1'}
+            ORDER BY c.documentId, c.chunkIndex, c.id
+            LIMIT :limit
+        """)
+        
+        session = self.SessionLocal()
+        
+        try:
+            return [dict(row) for row in session.execute(query, params).mappings().all()]
+        
+        finally:
+            session.close()
+    
+    def get_document_subject(self, document_id: str) -> Optional[str]:
+        """Subject ID of a document, or None if the document does not exist"""
+        session = self.SessionLocal()
+        
+        try:
+            query = text("SELECT subjectId FROM documents WHERE id = :document_id")
+            return session.execute(query, {'document_id': document_id}).scalar()
+        
+        finally:
+            session.close()
+    
+    def delete_document_chunks(self, document_id: str) -> int:
+        """Delete all chunks of a document, returning the number removed"""
+        session = self.SessionLocal()
+        
+        try:
+            query = text("DELETE FROM chunks WHERE documentId = :document_id")
+            result = session.execute(query, {'document_id': document_id})
+            session.commit()
+            logger.info(f"🗑️ [DB] Deleted {result.rowcount} chunks of document {document_id}")
+            return result.rowcount
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+    
+    def scan_chunks_to_embed(self, space: str, after: str, limit: int) -> List[Dict]:
+        """
+        Next page of embedded chunks that have no vector in an embedding space yet
+        
+        Keyset pagination on the primary key, so every page costs the same
+        however far the scan has gone.
+        
+        Args:
+            space: Embedding space tag (see app.config.embedding_space)
+            after: Chunk ID the previous page ended at ('' to start)
+            limit: Maximum rows
+        
+        Returns:
+            Rows with id and content, in ID order
+        """
+        session = self.SessionLocal()
+        
+        try:
+            query = text(f"""
+                SELECT c.id, c.content
+                FROM chunks c
+                {SPACE_JOIN}
+                WHERE c.id > :after
+                  AND c.embedding IS NOT NULL
+                  AND (c.embeddingModel IS NULL OR c.embeddingModel <> :space)
+                  AND ce.id IS NULL
+                ORDER BY c.id
+                LIMIT :limit
+            """)
+            params = {'space': space, 'after': after, 'limit': limit}
+            return [dict(row) for row in session.execute(query, params).mappings().all()]
+        
+        finally:
+            session.close()
+    
+    def save_chunk_embeddings(self, space: str, rows: List[Dict]) -> int:
+        """
+        Store vectors of an embedding space next to the chunks' current ones
+        
+        Chunks deleted meanwhile and vectors another backfill already wrote
+        are skipped (INSERT IGNORE).
+        
+        Args:
+            space: Embedding space tag
+            rows: Dicts with chunk_id and embedding (JSON)
+        
+        Returns:
+            Number of vectors written
+        """
+        if not rows:
+            return 0
+        
+        session = self.SessionLocal()
+        
+        try:
+            query = text("""
+                INSERT IGNORE INTO chunk_embeddings (id, chunkId, tag, embedding, createdAt)
+                VALUES (UUID(), :chunk_id, :space, :embedding, NOW(3))
+            """)
+            result = session.execute(query, [{**row, 'space': space} for row in rows])
+            session.commit()
+            return result.rowcount
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+    
+    def embedding_coverage(self) -> Dict:
+        """
+        Embedded chunks per embedding space
+        
+        Returns:
+            Dict with the number of embedded chunks, and per space tag the
+            vectors stored in chunks.embedding (`stored`) and in
+            chunk_embeddings (`backfilled`)
+        """
+        session = self.SessionLocal()
+        
+        try:
+            stored = session.execute(text("""
+                SELECT embeddingModel AS tag, COUNT(*) AS n
+                FROM chunks
+                WHERE embedding IS NOT NULL
+                GROUP BY embeddingModel
+            """)).mappings().all()
+            backfilled = session.execute(text("""
+                SELECT tag, COUNT(*) AS n
+                FROM chunk_embeddings
+                GROUP BY tag
+            """)).mappings().all()
+            return {
+                'chunks': sum(int(row['n']) for row in stored),
+                'stored': {row['tag']: int(row['n']) for row in stored},
+                'backfilled': {row['tag']: int(row['n']) for row in backfilled},
+            }
+        
+        finally:
+            session.close()
+    
+    def promote_chunk_embeddings(self, space: str, limit: int) -> int:
+        """
+        Move a page of backfilled vectors into chunks.embedding
+        
+        The vectors they replace are kept in chunk_embeddings under their
+        own tag, so switching back stays possible until that tag is dropped.
+        Search results don't change: both tables are read through the same
+        space (see SPACE_JOIN).
+        
+        Args:
+            space: Embedding space tag to promote
+            limit: Maximum chunks per call (one transaction)
+        
+        Returns:
+            Number of chunks promoted (0 once none is left)
+        """
+        session = self.SessionLocal()
+        
+        try:
+            chunk_ids = session.execute(
+                text("SELECT chunkId FROM chunk_embeddings WHERE tag = :space ORDER BY chunkId LIMIT :limit FOR UPDATE"),
+                {'space': space, 'limit': limit},
+            ).scalars().all()
+            if not chunk_ids:
+                return 0
+            
+            params = {'space': space, 'chunk_ids': list(chunk_ids)}
+            session.execute(text("""
+                INSERT IGNORE INTO chunk_embeddings (id, chunkId, tag, embedding, createdAt)
+                SELECT UUID(), c.id, c.embeddingModel, c.embedding, NOW(3)
+                FROM chunks c
+                WHERE c.id IN :chunk_ids
+                  AND c.embedding IS NOT NULL
+                  AND c.embeddingModel IS NOT NULL
+                  AND c.embeddingModel <> :space
+            """).bindparams(bindparam('chunk_ids', expanding=True)), params)
+            session.execute(text("""
+                UPDATE chunks c
+                JOIN chunk_embeddings ce ON ce.tag = :space AND ce.chunkId = c.id
+                SET c.embedding = ce.embedding, c.embeddingModel = ce.tag
+                WHERE c.id IN :chunk_ids
+            """).bindparams(bindparam('chunk_ids', expanding=True)), params)
+            session.execute(text("""
+                DELETE FROM chunk_embeddings
+                WHERE tag = :space AND chunkId IN :chunk_ids
+            """).bindparams(bindparam('chunk_ids', expanding=True)), params)
+            session.commit()
+            return len(chunk_ids)
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+    
+    def drop_chunk_embeddings(self, space: str, limit: int) -> int:
+        """Delete up to `limit` backfilled vectors of an embedding space (0 once none is left)"""
+        session = self.SessionLocal()
+        
+        try:
+            result = session.execute(
+                text("DELETE FROM chunk_embeddings WHERE tag = :space LIMIT :limit"),
+                {'space': space, 'limit': limit},
+            )
+            session.commit()
+            return result.rowcount
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+    
+    def retag_chunk_embeddings(self, old: str, new: str, limit: int) -> int:
+        """Relabel up to `limit` chunks whose vectors were stored under the wrong tag (0 once none is left)"""
+        session = self.SessionLocal()
+        
+        try:
+            result = session.execute(
+                text("UPDATE chunks SET embeddingModel = :new WHERE embeddingModel = :old LIMIT :limit"),
+                {'old': old, 'new': new, 'limit': limit},
+            )
+            session.commit()
+            return result.rowcount
+        
+        except Exception:
+            session.rollback()
+            raise
+        
+        finally:
+            session.close()
+
+
+_database_client: Optional[DatabaseClient] = None
+
+
+def get_database_client() -> DatabaseClient:
+    """Process-wide client, so every caller shares one connection pool"""
+    global _database_client
+    if _database_client is None:
+        _database_client = DatabaseClient()
+    return _database_client
+
 
+def close_database_client():
+    """Dispose of the shared connection pool, if one was created"""
+    global _database_client
+    if _database_client is not None:
+        _database_client.engine.dispose()
+        _database_client = None
@@ -1,6 +1,17 @@
 """Embedding generators"""
-from .openai_embedder import OpenAIEmbedder
+from .openai_embedder import OpenAIEmbedder, get_embedder
+from .batcher import EmbeddingBatcher
+from .query_cache import QueryEmbeddingCache, get_query_cache
+from .scheduler import EmbeddingScheduler, get_embedding_scheduler
 
-__all__ = ['OpenAIEmbedder']
+__all__ = [
+    'OpenAIEmbedder',
+    'get_embedder',
+    'EmbeddingBatcher',
+    'QueryEmbeddingCache',
+    'get_query_cache',
+    'EmbeddingScheduler',
+    'get_embedding_scheduler',
+]
 
 
@@ -0,0 +1,195 @@
+"""Cross-job micro-batching of embedding requests"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from loguru import logger
+
+
+class _Request:
+    """One caller's submission: texts in, vectors out through a future"""
+
+    __slots__ = ('future', 'results', 'remaining')
+
+    def __init__(self, future: asyncio.Future, size: int):
+        self.future = future
+        self.results: List[Optional[List[float]]] = [None] * size
+        self.remaining = size
+
+    def set_vector(self, index: int, vector: List[float]):
+        if self.future.done():
+            return
+        self.results[index] = vector
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.future.set_result(self.results)
+
+    def fail(self, error: Exception):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class _Item:
+    """A single text waiting to be embedded"""
+
+    __slots__ = ('request', 'index', 'text', 'tokens', 'enqueued_at')
+
+    def __init__(self, request: _Request, index: int, text: str, tokens: int):
+        self.request = request
+        self.index = index
+        self.text = text
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class EmbeddingBatcher:
+    """
+    Process-wide micro-batcher for embedding calls
+
+    Jobs submit texts and await a future; pending texts from every in-flight
+    job are merged into full-size API calls. A batch is flushed when it
+    reaches `max_batch_size` texts or `max_batch_tokens` estimated tokens, or
+    when its oldest text has waited `max_wait` seconds. Results are routed
+    back to each caller in order. If a merged call is rejected as invalid,
+    each caller's texts are retried on their own so only the offending job
+    fails.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[List[str]], Awaitable[List[List[float]]]],
+        estimate_tokens: Callable[[str], int],
+        max_batch_size: int = 100,
+        max_batch_tokens: int = 250_000,
+        max_wait: float = 0.02,
+    ):
+        """
+        Args:
+            send: Coroutine that embeds a list of texts with one API call
+            estimate_tokens: Token estimate for a single text
+            max_batch_size: Maximum texts per API call
+            max_batch_tokens: Maximum estimated tokens per API call
+            max_wait: Seconds a text may wait for a batch to fill up
+        """
+        self._send = send
+        self._estimate_tokens = estimate_tokens
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+
+        self._queue: Deque[_Item] = deque()
+        self._full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._in_flight: set = set()
+        self._stats = {'submitted': 0, 'texts': 0, 'batches': 0, 'isolated_failures': 0}
+
+    async def submit(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, sharing API calls with other concurrent callers"""
+        if not texts:
+            return []
+
+        request = _Request(asyncio.get_running_loop().create_future(), len(texts))
+        for index, text in enumerate(texts):
+            self._queue.append(_Item(request, index, text, self._estimate_tokens(text)))
+        self._stats['submitted'] += 1
+        self._stats['texts'] += len(texts)
+
+        if len(self._queue) >= self.max_batch_size:
+            self._full.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+        return await request.future
+
+    def stats(self) -> Dict:
+        """Counters, including the average number of texts per API call"""
+        batches = self._stats['batches']
+        return {
+            **self._stats,
+            'pending': len(self._queue),
+            'avg_batch_size': round(self._stats['texts'] / batches, 1) if batches else 0.0,
+        }
+
+    async def _flush_loop(self):
+        """Form batches until the queue drains"""
+        while self._queue:
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            remaining = deadline - time.monotonic()
+            if remaining > 0 and len(self._queue) < self.max_batch_size:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._take_batch()
+            if batch:
+                task = asyncio.create_task(self._send_batch(batch))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    def _take_batch(self) -> List[_Item]:
+        """Pop up to one API call's worth of texts, skipping cancelled callers"""
+        batch: List[_Item] = []
+        tokens = 0
+        while self._queue and len(batch) < self.max_batch_size:
+            item = self._queue[0]
+            if item.request.future.done():
+                self._queue.popleft()
+                continue
+            if batch and tokens + item.tokens > self.max_batch_tokens:
+                break
+            batch.append(self._queue.popleft())
+            tokens += item.tokens
+        return batch
+
+    async def _send_batch(self, batch: List[_Item]):
+        self._stats['batches'] += 1
+        try:
+            vectors = await self._send([item.text for item in batch])
+        except Exception as e:
+            requests = list({id(item.request): item.request for item in batch}.values())
+            if len(requests) > 1 and _is_invalid_input(e):
+                await self._send_isolated(batch)
+            else:
+                for request in requests:
+                    request.fail(e)
+            return
+
+        _deliver(batch, vectors)
+
+    async def _send_isolated(self, batch: List[_Item]):
+        """Retry each caller's share of a rejected batch separately"""
+        groups: Dict[int, List[_Item]] = {}
+        for item in batch:
+            groups.setdefault(id(item.request), []).append(item)
+
+        async def send_group(items: List[_Item]):
+            try:
+                vectors = await self._send([item.text for item in items])
+            except Exception as e:
+                self._stats['isolated_failures'] += 1
+                logger.warning(f"⚠️ [EMBED] Isolated batch failure for one caller: {e}")
+                items[0].request.fail(e)
+                return
+            _deliver(items, vectors)
+
+        await asyncio.gather(*(send_group(items) for items in groups.values()))
+
+
+def _deliver(items: List[_Item], vectors: List[List[float]]):
+    """Route a call's vectors to their callers, failing them all if the count is off"""
+    if len(vectors) != len(items):
+        error = ValueError(f"Embedding API returned {len(vectors)} vectors for {len(items)} texts")
+        logger.error(f"❌ [EMBED] {error}")
+        for request in {id(item.request): item.request for item in items}.values():
+            request.fail(error)
+        return
+    for item, vector in zip(items, vectors):
+        item.request.set_vector(item.index, vector)
+
+
+def _is_invalid_input(error: Exception) -> bool:
+    """Client errors caused by the request content (not throttling or auth)"""
+    status = getattr(error, 'status_code', None)
+    return status in (400, 413, 422)
@@ -1,78 +1,162 @@
 """OpenAI Embedding Generator"""
-from openai import OpenAI
-from typing import List
+import base64
+import numpy as np
+from openai import AsyncOpenAI
+from typing import Dict, List, Optional
 from loguru import logger
-from app.config import settings
+from app.config import NATIVE_DIMENSIONS, embedding_space, settings
+from .batcher import EmbeddingBatcher
+from .scheduler import EmbeddingScheduler, get_embedding_scheduler
 
 
 class OpenAIEmbedder:
     """Generate embeddings using OpenAI API"""
-    
-    def __init__(self):
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        dimensions: Optional[int] = None,
+        scheduler: Optional[EmbeddingScheduler] = None,
+    ):
+        """
+        Args:
+            model: Embedding model (default OPENAI_EMBEDDING_MODEL)
+            dimensions: Vector size (default OPENAI_EMBEDDING_DIMENSIONS)
+            scheduler: Rate budget to run calls under (default: the shared one)
+        """
         if not settings.OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY not set in environment")
-        
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.model = settings.OPENAI_EMBEDDING_MODEL
-        self.dimensions = settings.OPENAI_EMBEDDING_DIMENSIONS
-    
+
+        # Retries and timeouts are handled by the shared scheduler
+        self.client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            max_retries=0,
+            timeout=settings.EMBEDDING_REQUEST_TIMEOUT,
+        )
+        self.model = model or settings.OPENAI_EMBEDDING_MODEL
+        self.dimensions = dimensions or settings.OPENAI_EMBEDDING_DIMENSIONS
+        self.space = embedding_space(self.model, self.dimensions)
+        self.scheduler = scheduler or get_embedding_scheduler()
+        self.batcher = EmbeddingBatcher(
+            send=self._request_embeddings,
+            estimate_tokens=lambda text: self._estimate_tokens([text]),
+            max_batch_size=settings.EMBEDDING_BATCH_SIZE,
+            max_batch_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+            max_wait=settings.EMBEDDING_BATCH_MAX_WAIT_MS / 1000.0,
+        )
+
     async def embed(self, text: str) -> List[float]:
         """
         Generate embedding for a single text
-        
+
         Args:
             text: Text to embed
-        
+
         Returns:
             List of floats (embedding vector)
         """
         try:
-            # Note: dimensions parameter is only supported in newer OpenAI API versions
-            # For text-embedding-3-large, default dimensions is 3072
-            # We'll use the default dimensions and not pass it explicitly
-            # to avoid compatibility issues with older client versions
-            
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=text,
+            response = await self.scheduler.run(
+                lambda: self.client.embeddings.create(
+                    model=self.model,
+                    input=text,
+                    **self._size_options(),
+                ),
+                tokens=self._estimate_tokens([text]),
             )
-            
+
             embedding = response.data[0].embedding
             logger.debug(f"Generated embedding: {len(embedding)} dimensions (model: {self.model})")
-            
+
             return embedding
-            
+
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
-    
-    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+
+    async def embed_batch(self, texts: List[str]) -> List[np.ndarray]:
         """
         Generate embeddings for multiple texts (more efficient)
-        
+
+        Texts are coalesced with those of other concurrent jobs into
+        full-size API calls by the shared micro-batcher.
+
         Args:
             texts: List of texts to embed
-        
+
         Returns:
-            List of embedding vectors
+            List of float32 embedding vectors
+        """
+        return await self.batcher.submit(texts)
+
+    async def _request_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Embed texts with a single API call
+
+        Vectors are requested base64-encoded and decoded straight into float32
+        arrays, never materialized as lists of Python floats.
         """
         try:
-            # Note: dimensions parameter is only supported in newer OpenAI API versions
-            # For text-embedding-3-large, default dimensions is 3072
-            # We'll use the default dimensions and not pass it explicitly
-            # to avoid compatibility issues with older client versions
-            
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=texts,
+            response = await self.scheduler.run(
+                lambda: self.client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    encoding_format='base64',
+                    **self._size_options(),
+                ),
+                tokens=self._estimate_tokens(texts),
+            )
+
+            embeddings = [_decode_embedding(item.embedding) for item in response.data]
+            logger.debug(
+                "Generated {} embeddings in batch (model: {}, dimensions: {})",
+                len(embeddings), self.model, len(embeddings[0]) if embeddings else 0,
             )
-            
-            embeddings = [item.embedding for item in response.data]
-            logger.info(f"Generated {len(embeddings)} embeddings in batch (model: {self.model}, dimensions: {len(embeddings[0]) if embeddings else 0})")
-            
+
             return embeddings
-            
+
         except Exception as e:
             logger.error(f"Error generating batch embeddings: {e}")
             raise
 
+    def _size_options(self) -> Dict:
+        """
+        Request arguments asking for shortened vectors
+
+        Sent only below the model's native size; the installed client
+        predates the `dimensions` argument, so it goes in the request body.
+        """
+        if NATIVE_DIMENSIONS.get(self.model) == self.dimensions:
+            return {}
+        return {'extra_body': {'dimensions': self.dimensions}}
+
+    def _estimate_tokens(self, texts: List[str]) -> int:
+        """Conservative token estimate for rate budgeting (~3 chars per token)"""
+        return sum(len(text) // 3 + 1 for text in texts)
+
+
+def _decode_embedding(data) -> np.ndarray:
+    """float32 vector from a base64 payload (or a float list, if the API sent one)"""
+    if isinstance(data, str):
+        return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+    return np.asarray(data, dtype=np.float32)
+
+
+_embedder: Optional[OpenAIEmbedder] = None
+
+
+def get_embedder() -> OpenAIEmbedder:
+    """Process-wide embedder, so every job shares one client and batcher"""
+    global _embedder
+    if _embedder is None:
+        _embedder = OpenAIEmbedder()
+    return _embedder
+
+
+async def close_embedder():
+    """Close the shared embedder's HTTP client, if one was created"""
+    global _embedder
+    if _embedder is not None:
+        await _embedder.client.close()
+        _embedder = None
@@ -0,0 +1,193 @@
+"""In-memory cache of query embeddings for retrieval prompts"""
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+from app.config import settings
+from .openai_embedder import get_embedder
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryEmbeddingCache:
+    """
+    LRU + TTL cache of float32 query vectors with a total-bytes cap
+
+    Retrieval prompts (subject, grade, topic) repeat constantly across
+    teachers, so a hit skips the embedding round trip entirely. Concurrent
+    requests for the same query share a single in-flight embedding call.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[np.ndarray]]],
+        model: str,
+        max_entries: int = 10_000,
+        max_bytes: int = 128 * 1024 * 1024,
+        ttl_seconds: float = 24 * 3600,
+    ):
+        """
+        Args:
+            embed_batch: Embeds a list of texts (the shared embedder's batch call)
+            model: Embedding space (model and size), part of every cache key
+            max_entries: Maximum number of cached vectors
+            max_bytes: Maximum total size of cached vectors
+            ttl_seconds: Lifetime of a cached vector
+        """
+        self._embed_batch = embed_batch
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: 'OrderedDict[str, Tuple[np.ndarray, float]]' = OrderedDict()
+        self._bytes = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._embedding: Set[asyncio.Task] = set()  # Keeps in-flight embedding calls referenced
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """NFC-normalize and collapse whitespace so equivalent prompts share a key"""
+        return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', query)).strip()
+
+    async def get_many(self, queries: List[str]) -> List[np.ndarray]:
+        """
+        Embed queries, serving repeats from the cache
+
+        Returns:
+            One read-only float32 vector per query, in input order
+        """
+        keys = [self._key(self.normalize(query)) for query in queries]
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        waiting: Dict[int, asyncio.Future] = {}
+        to_embed: Dict[str, str] = {}  # key -> normalized text
+
+        for idx, key in enumerate(keys):
+            vector = self._lookup(key)
+            if vector is not None:
+                self._stats['hits'] += 1
+                results[idx] = vector
+            elif key in self._pending:
+                self._stats['coalesced'] += 1
+                waiting[idx] = self._pending[key]
+            elif key in to_embed:
+                self._stats['coalesced'] += 1
+            else:
+                self._stats['misses'] += 1
+                to_embed[key] = self.normalize(queries[idx])
+
+        embedded = await self._embed_missing(to_embed) if to_embed else {}
+
+        for idx, key in enumerate(keys):
+            if results[idx] is not None:
+                continue
+            future = waiting.get(idx)
+            if future is not None:
+                # Shielded: a cancelled caller must not cancel the shared future
+                results[idx] = await asyncio.shield(future)
+            else:
+                results[idx] = embedded[key]
+
+        return results
+
+    async def get(self, query: str) -> np.ndarray:
+        """Embed a single query through the cache"""
+        return (await self.get_many([query]))[0]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self._stats['hits'] + self._stats['misses'] + self._stats['coalesced']
+        return {
+            **self._stats,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hit_rate': round((self._stats['hits'] + self._stats['coalesced']) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _key(self, normalized: str) -> str:
+        return f"{self.model}\x00{normalized}"
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        vector, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self._stats['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    async def _embed_missing(self, to_embed: Dict[str, str]) -> Dict[str, np.ndarray]:
+        """
+        Embed uncached queries in one call; concurrent callers await the futures
+
+        The call runs in its own task: when this caller is cancelled, it
+        still completes for the callers waiting on the same queries.
+        """
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in to_embed}
+        self._pending.update(futures)
+        task = asyncio.create_task(self._resolve(to_embed, futures))
+        self._embedding.add(task)
+        task.add_done_callback(self._embedding.discard)
+        await asyncio.shield(task)
+        return {key: future.result() for key, future in futures.items()}
+
+    async def _resolve(self, to_embed: Dict[str, str], futures: Dict[str, asyncio.Future]):
+        """Embed the queries, cache the vectors and resolve their futures"""
+        try:
+            vectors = await self._embed_batch(list(to_embed.values()))
+        except BaseException as e:
+            for key, future in futures.items():
+                self._pending.pop(key, None)
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                    future.exception()  # Mark retrieved: waiters may not exist
+                else:
+                    future.cancel()
+            raise
+
+        for key, values in zip(to_embed, vectors):
+            vector = np.asarray(values, dtype=np.float32)
+            vector.flags.writeable = False
+            self._store(key, vector)
+            self._pending.pop(key, None)
+            futures[key].set_result(vector)
+
+    def _store(self, key: str, vector: np.ndarray):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (vector, time.monotonic() + self.ttl_seconds)
+        self._bytes += vector.nbytes + len(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats['evictions'] += 1
+
+    def _remove(self, key: str):
+        vector, _ = self._entries.pop(key)
+        self._bytes -= vector.nbytes + len(key)
+
+
+_query_cache: Optional[QueryEmbeddingCache] = None
+
+
+def get_query_cache() -> QueryEmbeddingCache:
+    """Process-wide query cache backed by the shared embedder"""
+    global _query_cache
+    if _query_cache is None:
+        embedder = get_embedder()
+        _query_cache = QueryEmbeddingCache(
+            embed_batch=embedder.embed_batch,
+            model=embedder.space,
+            max_entries=settings.QUERY_CACHE_MAX_ENTRIES,
+            max_bytes=settings.QUERY_CACHE_MAX_BYTES,
+            ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS,
+        )
+    return _query_cache
@@ -0,0 +1,242 @@
+"""Rate-limit-aware scheduling of embedding API calls"""
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from loguru import logger
+from openai import APIConnectionError
+from app.config import settings
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    """Budget of units per minute that refills continuously"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(per_minute, 1))
+        self.rate = self.capacity / 60.0  # units per second
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (requests larger than the
+        bucket only wait for a full bucket)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+
+class EmbeddingScheduler:
+    """
+    Shared scheduler for embedding requests
+
+    - Enforces requests-per-minute and tokens-per-minute budgets across every
+      concurrent job in the process (FIFO, so no job starves)
+    - Retries throttled, timed-out and 5xx calls with jittered exponential
+      backoff, honouring Retry-After when the API sends it
+    - Adapts concurrency AIMD-style: halved on throttling, raised by one after
+      a full window of successful calls
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        max_retries: int = 3,
+        request_timeout: float = 60.0,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_concurrency = max(min(min_concurrency, self.max_concurrency), 1)
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._budget_lock = asyncio.Lock()
+        self._slots = asyncio.Condition()
+
+        self._limit = self.max_concurrency
+        self._in_flight = 0
+        self._success_streak = 0
+        self._cooldown_until = 0.0
+        self._last_decrease = 0.0
+
+        self._stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'failures': 0}
+
+    async def run(self, call: Callable[[], Awaitable[T]], tokens: int) -> T:
+        """
+        Run an API call under the shared budgets, retrying transient failures
+
+        Args:
+            call: Zero-argument coroutine factory (called again on every attempt)
+            tokens: Estimated tokens consumed by the call
+
+        Returns:
+            The call's result
+        """
+        attempt = 0
+        while True:
+            await self._acquire_slot()
+            try:
+                await self._acquire_budget(tokens)
+                self._stats['requests'] += 1
+                result = await asyncio.wait_for(call(), timeout=self.request_timeout)
+            except Exception as e:
+                retryable, retry_after, throttled = self._classify(e)
+                if throttled:
+                    self._on_throttled(retry_after)
+                if not retryable or attempt >= self.max_retries:
+                    self._stats['failures'] += 1
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                attempt += 1
+                self._stats['retries'] += 1
+                logger.warning(
+                    f"⏳ [EMBED] {type(e).__name__} on attempt {attempt}/{self.max_retries + 1}, "
+                    f"retrying in {delay:.1f}s (concurrency limit {self._limit})"
+                )
+            else:
+                self._on_success()
+                return result
+            finally:
+                await self._release_slot()
+
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        """Counters and current adaptive state"""
+        return {
+            **self._stats,
+            'concurrency_limit': self._limit,
+            'in_flight': self._in_flight,
+        }
+
+    async def _acquire_slot(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+
+    async def _release_slot(self):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    async def _acquire_budget(self, tokens: int):
+        """Wait (in FIFO order) until both budgets and any cooldown allow the call"""
+        async with self._budget_lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self._cooldown_until - now,
+                    self._requests.wait_time(1, now),
+                    self._tokens.wait_time(tokens, now),
+                )
+                if wait <= 0:
+                    self._requests.consume(1)
+                    self._tokens.consume(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def _on_success(self):
+        self._success_streak += 1
+        if self._limit < self.max_concurrency and self._success_streak >= self._limit:
+            self._limit += 1
+            self._success_streak = 0
+
+    def _on_throttled(self, retry_after: Optional[float]):
+        now = time.monotonic()
+        self._stats['throttled'] += 1
+        self._success_streak = 0
+        # Every in-flight call sees the same 429 burst: decrease once per window
+        if now - self._last_decrease >= max(retry_after or 0.0, self.base_delay):
+            self._limit = max(self.min_concurrency, self._limit // 2)
+            self._last_decrease = now
+        if retry_after:
+            self._cooldown_until = max(self._cooldown_until, now + retry_after)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, retry_after + random.uniform(0, self.base_delay))
+        return delay
+
+    def _classify(self, error: Exception) -> Tuple[bool, Optional[float], bool]:
+        """
+        Returns:
+            Tuple of (retryable, retry_after seconds, throttled)
+        """
+        if isinstance(error, (asyncio.TimeoutError, APIConnectionError)):
+            return True, None, False
+
+        status = getattr(error, 'status_code', None)
+        if status is None:
+            return False, None, False
+
+        response = getattr(error, 'response', None)
+        retry_after = _parse_retry_after(response.headers) if response is not None else None
+
+        if status == 429:
+            # Exhausted billing quota will not recover by waiting
+            if getattr(error, 'code', None) == 'insufficient_quota':
+                return False, None, True
+            return True, retry_after, True
+        if status in (408, 409) or status >= 500:
+            return True, retry_after, False
+        return False, None, False
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    """Read retry-after-ms / retry-after (seconds or HTTP date) headers"""
+    try:
+        value = headers.get('retry-after-ms')
+        if value:
+            return float(value) / 1000.0
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except Exception:
+        return None
+
+
+_scheduler: Optional[EmbeddingScheduler] = None
+
+
+def get_embedding_scheduler() -> EmbeddingScheduler:
+    """Process-wide scheduler shared by every embedding call (its share of the service's limits)"""
+    global _scheduler
+    if _scheduler is None:
+        # The account's limits are shared by every worker process
+        workers = max(settings.WORKERS, 1)
+        _scheduler = EmbeddingScheduler(
+            requests_per_minute=settings.EMBEDDING_REQUESTS_PER_MINUTE // workers,
+            tokens_per_minute=settings.EMBEDDING_TOKENS_PER_MINUTE // workers,
+            max_concurrency=max(settings.EMBEDDING_MAX_CONCURRENCY // workers, 1),
+            min_concurrency=settings.EMBEDDING_MIN_CONCURRENCY,
+            max_retries=settings.MAX_RETRIES,
+            request_timeout=settings.EMBEDDING_REQUEST_TIMEOUT,
+            base_delay=settings.EMBEDDING_RETRY_BASE_DELAY,
+            max_delay=settings.EMBEDDING_RETRY_MAX_DELAY,
+        )
+    return _scheduler
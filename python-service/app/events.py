@@ -0,0 +1,31 @@
+"""In-process notifications about changes to processed content"""
+from typing import Callable, List, Optional
+from loguru import logger
+
+# Kinds of subject changes
+DOCUMENT_COMPLETED = 'completed'
+DOCUMENT_DELETED = 'deleted'
+
+# listener(subject_id, document_id, change); subject_id is None when unknown (invalidate all)
+SubjectChangeListener = Callable[[Optional[str], Optional[str], str], None]
+
+_subject_listeners: List[SubjectChangeListener] = []
+
+
+def subscribe_subject_changes(listener: SubjectChangeListener):
+    """Register a callback for documents completed in or removed from a subject"""
+    if listener not in _subject_listeners:
+        _subject_listeners.append(listener)
+
+
+def publish_subject_change(
+    subject_id: Optional[str],
+    document_id: Optional[str] = None,
+    change: str = DOCUMENT_COMPLETED,
+):
+    """Notify listeners that a subject's searchable content changed"""
+    for listener in list(_subject_listeners):
+        try:
+            listener(subject_id, document_id, change)
+        except Exception as e:
+            logger.error(f"❌ [EVENTS] Subject change listener failed for {subject_id}: {e}")
@@ -0,0 +1,78 @@
+"""Logging setup and per-job log context"""
+import os
+import random
+import sys
+from contextlib import contextmanager
+from typing import Iterator
+from loguru import logger
+from app.config import settings
+
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>{extra[context]} - <level>{message}</level>"
+)
+FILE_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line}{extra[context]} - {message}"
+
+# Records below this level are dropped for jobs that were not sampled
+_SAMPLED_BELOW = logger.level("WARNING").no
+
+
+def setup_logging():
+    """
+    Configure the console and file sinks
+
+    With LOG_ASYNC the sinks are fed through loguru's background queue
+    (`enqueue=True`), so a log call never waits on stderr or the disk.
+    """
+    log_dir = os.path.dirname(settings.LOG_FILE)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    logger.remove()  # Remove default handler
+    logger.configure(extra={'context': ''}, patcher=_add_context)
+    logger.add(
+        sys.stderr,
+        level=settings.LOG_LEVEL,
+        colorize=True,
+        format=CONSOLE_FORMAT,
+        filter=_sampled,
+        enqueue=settings.LOG_ASYNC,
+    )
+    logger.add(
+        settings.LOG_FILE,
+        rotation="10 MB",
+        level=settings.LOG_LEVEL,
+        format=FILE_FORMAT,
+        serialize=settings.LOG_JSON,
+        filter=_sampled,
+        enqueue=settings.LOG_ASYNC,
+    )
+
+
+@contextmanager
+def job_context(document_id: str) -> Iterator[None]:
+    """
+    Attach a document ID to every record logged by this job (threads and
+    tasks it starts included) and decide whether its INFO/DEBUG records are
+    kept (LOG_SAMPLE_RATE); warnings and errors are always kept
+    """
+    sampled = settings.LOG_SAMPLE_RATE >= 1 or random.random() < settings.LOG_SAMPLE_RATE
+    with logger.contextualize(document_id=document_id, sampled=sampled):
+        yield
+
+
+def log_stage(stage: str):
+    """Tag records logged inside the block with a pipeline stage"""
+    return logger.contextualize(stage=stage)
+
+
+def _add_context(record):
+    extra = record['extra']
+    document_id = extra.get('document_id')
+    if document_id:
+        stage = extra.get('stage')
+        extra['context'] = f" [{document_id}{'/' + stage if stage else ''}]"
+
+
+def _sampled(record) -> bool:
+    return record['extra'].get('sampled', True) or record['level'].no >= _SAMPLED_BELOW
@@ -1,27 +1,66 @@
 """FastAPI application"""
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
+from typing import BinaryIO, List, Literal, Optional, Set, Tuple
 from loguru import logger
+import asyncio
 import os
-import uuid
-import aiofiles
+import tempfile
 from app.config import settings
-from app.services.document_processor import DocumentProcessor
+from app.events import DOCUMENT_DELETED, publish_subject_change
+from app.services.admission import AdmissionGate, AdmissionRejected, Ticket, get_admission_controller
+from app.services.jobs import SUPERSEDED, TIMED_OUT, Job, JobCancelled, get_job_registry
+
+# Parsers, the OpenAI SDK and SQLAlchemy are imported inside the handlers that
+# need them (see LAZY_INIT), so a new worker answers /health right away
 
 # Configure logging - also output to console
 import sys
-logger.remove()  # Remove default handler
-logger.add(sys.stderr, level=settings.LOG_LEVEL, colorize=True, format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>")
-logger.add("logs/app.log", rotation="10 MB", level=settings.LOG_LEVEL, format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}")
+from app.logging_config import job_context, setup_logging
+setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Optionally warm up clients at startup; close whichever were created at shutdown"""
+    if not settings.LAZY_INIT:
+        from app.services.document_processor import get_processor
+        from app.retrieval import get_retrieval_service
+        get_processor().warm_up()
+        get_retrieval_service()
+        logger.info("🔥 [API] Parsers and clients initialized at startup")
+    
+    resume_sweep = None
+    if settings.CHECKPOINT_ENABLED:
+        retry_after = await _resume_interrupted_jobs()
+        if retry_after is not None:
+            resume_sweep = asyncio.create_task(_retry_interrupted_jobs(retry_after))
+    
+    yield
+    
+    if resume_sweep is not None:
+        resume_sweep.cancel()
+    
+    # Only modules that were actually imported can hold open clients
+    embedder_module = sys.modules.get('app.embeddings.openai_embedder')
+    if embedder_module is not None:
+        await embedder_module.close_embedder()
+    database_module = sys.modules.get('app.database.client')
+    if database_module is not None:
+        database_module.close_database_client()
+    
+    # Drain records still queued for the background log sinks
+    await logger.complete()
 
-# Create logs directory if it doesn't exist
-os.makedirs("logs", exist_ok=True)
 
 app = FastAPI(
     title="EduGenie Document Processing Service",
     description="Python service for document parsing, chunking, and embedding generation",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS
@@ -33,9 +72,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize processor
-processor = DocumentProcessor()
-
+# Refuse uploads with 429 while their lane's queue is full, before reading them
+app.add_middleware(AdmissionGate, paths={"/api/v1/process": False, "/api/v1/process-sync": True})
 
 @app.get("/")
 async def root():
@@ -67,44 +105,48 @@ async def process_document(
     Process a document: parse, chunk, generate embeddings, save to DB
     
     This endpoint accepts a file upload and processes it asynchronously.
+    Answers 429 with Retry-After when the queue (or the user's or subject's
+    share of it) is full. A run of the same document still in flight is
+    cancelled.
     """
     # Validate file
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
     
-    # Check file size
-    file_content = await file.read()
-    if len(file_content) > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Max size: {settings.MAX_FILE_SIZE / 1024 / 1024}MB",
-        )
-    
-    # Save file temporarily
-    os.makedirs(settings.TEMP_DIR, exist_ok=True)
-    temp_file_path = os.path.join(settings.TEMP_DIR, f"{uuid.uuid4()}_{file.filename}")
+    # Take a place in the queue before copying the upload
+    admission = get_admission_controller()
+    ticket = _admit(admission.lane_for(file.size), user_id, subject_id)
     
-    async with aiofiles.open(temp_file_path, 'wb') as f:
-        await f.write(file_content)
+    # Keep the upload in memory (spilled to an anonymous temp file when large);
+    # rejects files over MAX_FILE_SIZE
+    try:
+        upload, size = await _spool_upload(file)
+    except BaseException:
+        ticket.cancel()
+        raise
     
     logger.info(
-        f"📥 [API] Received file: {file.filename}, size: {len(file_content)} bytes"
+        f"📥 [API] Received file: {file.filename}, size: {size} bytes, "
+        f"in memory: {size <= settings.UPLOAD_SPOOL_MAX_MEMORY}"
     )
     logger.info(
         f"📋 [API] Document ID: {document_id}, Subject ID: {subject_id}, Type: {document_type}"
     )
-    logger.info(f"💾 [API] Saved temp file: {temp_file_path}")
     
     # Process in background
     logger.info(f"🔄 [API] Queuing background task for document {document_id}")
+    job = get_job_registry().register(document_id, subject_id, ticket)
     background_tasks.add_task(
         _process_document_task,
-        temp_file_path,
+        job,
+        upload,
         document_id,
         subject_id,
         document_type,
         user_id,
         original_filename or file.filename,
+        file.content_type,
+        size,
     )
     
     logger.info(f"✅ [API] Document {document_id} queued successfully")
@@ -112,50 +154,190 @@ async def process_document(
     return {
         "status": "queued",
         "document_id": document_id,
+        "lane": ticket.lane,
         "message": "Document queued for processing",
     }
 
 
+def _admit(lane: str, user_id: Optional[str] = None, subject_id: Optional[str] = None) -> Ticket:
+    """Admission ticket for a job, or 429 with Retry-After"""
+    try:
+        return get_admission_controller().admit(lane, user_id, subject_id)
+    except AdmissionRejected as e:
+        logger.warning(f"🚦 [API] Rejected {lane} job: {e.reason} (retry after {e.retry_after}s)")
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+
+async def _spool_upload(
+    file: UploadFile,
+    max_size: int = settings.MAX_FILE_SIZE,
+) -> Tuple[tempfile.SpooledTemporaryFile, int]:
+    """
+    Copy an upload into a spooled buffer
+    
+    Uploads up to UPLOAD_SPOOL_MAX_MEMORY stay in memory and are parsed without
+    touching the disk; larger ones spill to an unnamed temp file in TEMP_DIR,
+    which the OS reclaims even if the process dies mid-job.
+    
+    Args:
+        file: Upload to copy
+        max_size: Largest accepted size in bytes
+    
+    Returns:
+        Tuple of (buffer rewound to the start, size in bytes)
+    """
+    os.makedirs(settings.TEMP_DIR, exist_ok=True)
+    upload = tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_MAX_MEMORY, dir=settings.TEMP_DIR)
+    size = 0
+    while block := await file.read(1024 * 1024):
+        size += len(block)
+        if size > max_size:
+            upload.close()
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large. Max size: {max_size / 1024 / 1024}MB",
+            )
+        upload.write(block)
+    upload.seek(0)
+    return upload, size
+
+
 async def _process_document_task(
-    file_path: str,
+    job: Job,
+    upload: BinaryIO,
     document_id: str,
     subject_id: str,
     document_type: str,
     user_id: Optional[str],
     original_filename: str,
+    content_type: Optional[str],
+    size: int,
+    checkpoint=None,
 ):
-    """Background task for processing document"""
-    logger.info(f"🚀 [BACKGROUND TASK] Starting processing for document {document_id}")
-    logger.info(f"📄 File: {original_filename}, Path: {file_path}")
-    logger.info(f"📋 Subject ID: {subject_id}, Type: {document_type}, User: {user_id}")
+    """
+    Background task for processing document (waits for a processing slot first)
     
-    try:
-        result = await processor.process_document(
-            file_path=file_path,
+    The upload and each completed stage are checkpointed to CHECKPOINT_DIR
+    (unless `checkpoint` is given: a resumed job), so a job interrupted by a
+    restart is picked up by _resume_interrupted_jobs. The checkpoint is
+    removed once the job has ended. Uploads under CHECKPOINT_MIN_SIZE are not
+    checkpointed: they stay on the in-memory path and are cheap to redo.
+    """
+    if checkpoint is None and settings.CHECKPOINT_ENABLED and size >= settings.CHECKPOINT_MIN_SIZE:
+        from app.services.checkpoints import get_checkpoint_store
+        try:
+            checkpoint = await asyncio.to_thread(
+                get_checkpoint_store().create,
+                document_id,
+                upload,
+                subject_id=subject_id,
+                document_type=document_type,
+                user_id=user_id,
+                original_filename=original_filename,
+                content_type=content_type,
+                size=size,
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ [BACKGROUND TASK] Could not checkpoint document {document_id}: {e}")
+    
+    async def work(job: Job):
+        logger.info(f"🚀 [BACKGROUND TASK] Starting processing ({job.lane} lane)")
+        logger.info(f"📄 File: {original_filename}, Content type: {content_type}")
+        logger.info(f"📋 Subject ID: {subject_id}, Type: {document_type}, User: {user_id}")
+        
+        from app.services.document_processor import get_processor
+        return await get_processor().process_document(
+            source=upload,
             document_id=document_id,
             subject_id=subject_id,
             document_type=document_type,
             user_id=user_id,
             original_filename=original_filename,
+            content_type=content_type,
+            job=job,
+            checkpoint=checkpoint,
         )
-        logger.info(f"✅ [BACKGROUND TASK] Successfully completed: {result}")
-    except Exception as e:
-        logger.error(f"❌ [BACKGROUND TASK] Processing failed for document {document_id}: {e}")
-        logger.error(f"❌ [BACKGROUND TASK] Error type: {type(e).__name__}")
-        logger.exception(e)  # Full stack trace
+    
+    with job_context(document_id):
+        try:
+            result = await get_job_registry().run(job, work)
+            logger.info(f"✅ [BACKGROUND TASK] Successfully completed: {result}")
+        except JobCancelled as e:
+            logger.warning(f"🛑 [BACKGROUND TASK] Processing {e.reason}")
+            await _record_cancellation(e)
+        except asyncio.CancelledError:
+            # Shutting down: the next start resumes the job from its checkpoint
+            if checkpoint is not None:
+                checkpoint.release()
+                checkpoint = None
+            raise
+        except Exception as e:
+            logger.error(f"❌ [BACKGROUND TASK] Processing failed: {e}")
+            logger.error(f"❌ [BACKGROUND TASK] Error type: {type(e).__name__}")
+            logger.exception(e)  # Full stack trace (the processor has marked the document FAILED)
+        finally:
+            # Release the buffer (and its spill file, if any)
+            upload.close()
+            if checkpoint is not None:
+                await asyncio.to_thread(checkpoint.remove)
+
+
+# Resumed jobs run outside any request: keep their tasks referenced
+_resumed_tasks: Set[asyncio.Task] = set()
+
+
+async def _resume_interrupted_jobs() -> Optional[int]:
+    """
+    Queue the background jobs whose process died, from their checkpoints
+    
+    Returns:
+        Seconds to wait before trying again if admission refused some of
+        them (their checkpoints are left for the next sweep), else None
+    """
+    from app.services.checkpoints import get_checkpoint_store
+    
+    admission = get_admission_controller()
+    retry_after = None
+    for checkpoint in await asyncio.to_thread(lambda: list(get_checkpoint_store().orphaned())):
+        meta = checkpoint.meta
+        document_id = meta['document_id']
+        try:
+            ticket = admission.admit(admission.lane_for(meta.get('size')), meta.get('user_id'), meta['subject_id'])
+        except AdmissionRejected as e:
+            logger.warning(
+                f"🚦 [API] Not resuming document {document_id} now: {e.reason} (retrying in {e.retry_after}s)"
+            )
+            checkpoint.release()
+            retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+            continue
         
-        # Try to update document status to FAILED
+        logger.info(f"⏯️ [API] Resuming interrupted job for document {document_id}")
+        task = asyncio.create_task(_process_document_task(
+            get_job_registry().register(document_id, meta['subject_id'], ticket),
+            open(checkpoint.source_path, 'rb'),
+            document_id,
+            meta['subject_id'],
+            meta['document_type'],
+            meta.get('user_id'),
+            meta.get('original_filename'),
+            meta.get('content_type'),
+            meta.get('size', 0),
+            checkpoint=checkpoint,
+        ))
+        _resumed_tasks.add(task)
+        task.add_done_callback(_resumed_tasks.discard)
+    return retry_after
+
+
+async def _retry_interrupted_jobs(delay: int):
+    """Sweep the checkpoints again until every interrupted job has been admitted"""
+    while delay is not None:
+        await asyncio.sleep(delay)
         try:
-            from app.database.client import DatabaseClient
-            db = DatabaseClient()
-            db._update_document_status(document_id, 'FAILED', error=str(e))
-        except Exception as update_error:
-            logger.error(f"❌ [BACKGROUND TASK] Failed to update document status: {update_error}")
-    finally:
-        # Clean up temp file
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"🧹 [BACKGROUND TASK] Cleaned up temp file: {file_path}")
+            delay = await _resume_interrupted_jobs()
+        except Exception as e:
+            logger.exception(f"❌ [API] Resuming interrupted jobs failed: {e}")
+            delay = 60
 
 
 @app.post("/api/v1/process-sync")
@@ -169,28 +351,517 @@ async def process_document_sync(
 ):
     """
     Process document synchronously (for testing)
-    """
-    # Save file temporarily
-    os.makedirs(settings.TEMP_DIR, exist_ok=True)
-    temp_file_path = os.path.join(settings.TEMP_DIR, f"{uuid.uuid4()}_{file.filename}")
-    
-    file_content = await file.read()
-    async with aiofiles.open(temp_file_path, 'wb') as f:
-        await f.write(file_content)
     
+    Runs in the priority lane, ahead of queued background jobs.
+    """
+    ticket = _admit(get_admission_controller().lane_for(file.size, sync=True))
     try:
-        result = await processor.process_document(
-            file_path=temp_file_path,
+        upload, _ = await _spool_upload(file)
+    except BaseException:
+        ticket.cancel()
+        raise
+    
+    async def work(job: Job):
+        from app.services.document_processor import get_processor
+        return await get_processor().process_document(
+            source=upload,
             document_id=document_id,
             subject_id=subject_id,
             document_type=document_type,
             user_id=user_id,
             original_filename=original_filename or file.filename,
+            content_type=file.content_type,
+            job=job,
         )
-        return result
+    
+    try:
+        with job_context(document_id):
+            registry = get_job_registry()
+            return await registry.run(registry.register(document_id, subject_id, ticket), work)
+    except JobCancelled as e:
+        await _record_cancellation(e)
+        raise HTTPException(status_code=504 if e.reason == TIMED_OUT else 409, detail=str(e))
     finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        upload.close()
+
+
+async def _record_cancellation(e: JobCancelled):
+    """Mark a cancelled or timed-out document FAILED (a superseded run leaves it to the new one)"""
+    if e.reason == SUPERSEDED:
+        return
+    try:
+        from app.database.client import get_database_client
+        db = get_database_client()
+        await asyncio.to_thread(db._update_document_status, e.document_id, 'FAILED', error=str(e))
+    except Exception as update_error:
+        logger.error(f"❌ [API] Failed to update document status: {update_error}")
+
+
+@app.delete("/api/v1/jobs/{document_id}")
+async def cancel_job(document_id: str):
+    """
+    Cancel a document's queued or running job
+    
+    Parsing is killed at once; otherwise work stops at the next checkpoint
+    (between stages, chapters and embedding batches). A save in progress is
+    rolled back, the processing slot is freed and the document is marked
+    FAILED. Answers 409 once the job is committing its results.
+    """
+    registry = get_job_registry()
+    job = registry.get(document_id)
+    cancelled = registry.cancel(document_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail=f"No job in flight for document {document_id}")
+    if not cancelled:
+        raise HTTPException(status_code=409, detail="Job is already saving its results")
+    
+    # Usually stops within moments; report rather than wait on a stuck job
+    if job.task is not None:
+        await asyncio.wait({job.task}, timeout=5.0)
+    return {
+        "status": "cancelled" if job.task is not None and job.task.done() else "cancelling",
+        "document_id": document_id,
+    }
+
+
+@app.get("/api/v1/process/stats")
+async def process_stats():
+    """Admission control (running and queued jobs per lane, limits, drain rate) and in-flight jobs"""
+    return {**get_admission_controller().stats(), "jobs": get_job_registry().stats()}
+
+
+class EmbedQueryRequest(BaseModel):
+    """Body for /api/v1/embed-query: a single query or a batch"""
+    query: Optional[str] = None
+    queries: Optional[List[str]] = None
+
+
+@app.post("/api/v1/embed-query")
+async def embed_query(request: EmbedQueryRequest):
+    """
+    Embed retrieval queries, serving repeated prompts from the in-memory cache
+    
+    Returns `embedding` for `query`, or `embeddings` (same order) for `queries`.
+    """
+    if request.query is None and not request.queries:
+        raise HTTPException(status_code=400, detail="Provide 'query' or 'queries'")
+    
+    texts = [request.query] if request.query is not None else request.queries
+    if len(texts) > settings.QUERY_EMBED_MAX_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many queries. Max per request: {settings.QUERY_EMBED_MAX_BATCH}",
+        )
+    if any(not text or not text.strip() for text in texts):
+        raise HTTPException(status_code=400, detail="Queries must not be empty")
+    
+    from app.embeddings import get_query_cache
+    query_cache = get_query_cache()
+    vectors = await query_cache.get_many(texts)
+    
+    response = {
+        "model": query_cache.model,
+        "dimensions": int(vectors[0].shape[0]) if vectors else 0,
+        "cache": query_cache.stats(),
+    }
+    if request.query is not None:
+        response["embedding"] = vectors[0].tolist()
+    else:
+        response["embeddings"] = [vector.tolist() for vector in vectors]
+    return response
+
+
+@app.get("/api/v1/embed-query/stats")
+async def embed_query_stats():
+    """Query embedding cache statistics (hit rate, size, evictions)"""
+    from app.embeddings import get_query_cache
+    return get_query_cache().stats()
+
+
+class SearchRequest(BaseModel):
+    """Body for /api/v1/search"""
+    subject_id: str
+    query: Optional[str] = None
+    query_embedding: Optional[List[float]] = None
+    k: int = 10
+    document_types: Optional[List[str]] = None
+    document_ids: Optional[List[str]] = None
+    chapter_numbers: Optional[List[int]] = None
+    min_score: Optional[float] = None
+    include_content: bool = True
+    mode: Literal['similarity', 'mmr'] = 'similarity'
+    mmr_lambda: float = 0.5  # mode="mmr": relevance weight (1 = plain similarity order)
+    fetch_k: Optional[int] = None  # mode="mmr": candidates to diversify (default RETRIEVAL_MMR_FETCH_K)
+    chapter_quota: Optional[int] = None  # mode="mmr": max results per chapter
+
+
+@app.post("/api/v1/search")
+async def search_chunks(request: SearchRequest):
+    """
+    Top-k chunks of a subject by cosine similarity to a query text or vector
+    
+    Rankings are cached per (subject, query, k, filters, mode) until a
+    document of the subject completes processing or is deleted.
+    
+    `mode="mmr"` returns k diverse chunks instead (Maximal Marginal Relevance
+    over the top `fetch_k`), optionally at most `chapter_quota` per chapter.
+    """
+    if request.query is None and not request.query_embedding:
+        raise HTTPException(status_code=400, detail="Provide 'query' or 'query_embedding'")
+    if not 1 <= request.k <= settings.RETRIEVAL_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {settings.RETRIEVAL_MAX_K}")
+    if not 0.0 <= request.mmr_lambda <= 1.0:
+        raise HTTPException(status_code=400, detail="mmr_lambda must be between 0 and 1")
+    if request.fetch_k is not None and request.fetch_k < 1:
+        raise HTTPException(status_code=400, detail="fetch_k must be positive")
+    if request.chapter_quota is not None and request.chapter_quota < 1:
+        raise HTTPException(status_code=400, detail="chapter_quota must be positive")
+    
+    from app.retrieval import SearchFilters, get_retrieval_service
+    filters = SearchFilters(
+        document_types=request.document_types,
+        document_ids=request.document_ids,
+        chapter_numbers=request.chapter_numbers,
+        min_score=request.min_score,
+    )
+    try:
+        return await get_retrieval_service().search(
+            subject_id=request.subject_id,
+            k=request.k,
+            query=request.query,
+            query_embedding=request.query_embedding,
+            filters=filters,
+            include_content=request.include_content,
+            mode=request.mode,
+            mmr_lambda=request.mmr_lambda,
+            fetch_k=request.fetch_k,
+            chapter_quota=request.chapter_quota,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+class BatchQuery(BaseModel):
+    """One query of a batch search: a text or a vector"""
+    query: Optional[str] = None
+    query_embedding: Optional[List[float]] = None
+
+
+class BatchSearchRequest(BaseModel):
+    """Body for /api/v1/search/batch"""
+    subject_id: str
+    queries: List[BatchQuery]
+    k: int = 10
+    document_types: Optional[List[str]] = None
+    document_ids: Optional[List[str]] = None
+    chapter_numbers: Optional[List[int]] = None
+    min_score: Optional[float] = None
+    include_content: bool = True
+    dedupe: bool = False  # Return each chunk for one query only (the one it matches best)
+
+
+@app.post("/api/v1/search/batch")
+async def search_chunks_batch(request: BatchSearchRequest):
+    """
+    Top-k chunks of a subject for each of several queries, in one round trip
+    
+    Query texts are embedded with one call and all queries are scored with a
+    single matrix product; `results` holds one list per query, in order.
+    Filters apply to every query. Rankings share the /api/v1/search cache.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="Provide at least one query")
+    if len(request.queries) > settings.RETRIEVAL_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {settings.RETRIEVAL_MAX_BATCH} queries per request")
+    if any(item.query is None and not item.query_embedding for item in request.queries):
+        raise HTTPException(status_code=400, detail="Every query needs 'query' or 'query_embedding'")
+    if not 1 <= request.k <= settings.RETRIEVAL_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {settings.RETRIEVAL_MAX_K}")
+    
+    from app.retrieval import SearchFilters, get_retrieval_service
+    filters = SearchFilters(
+        document_types=request.document_types,
+        document_ids=request.document_ids,
+        chapter_numbers=request.chapter_numbers,
+        min_score=request.min_score,
+    )
+    try:
+        return await get_retrieval_service().search_batch(
+            subject_id=request.subject_id,
+            k=request.k,
+            queries=[item.query if item.query is not None else item.query_embedding for item in request.queries],
+            filters=filters,
+            include_content=request.include_content,
+            dedupe=request.dedupe,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/search/stats")
+async def search_stats():
+    """Retrieval result cache statistics and loaded subject indexes"""
+    from app.retrieval import get_retrieval_service
+    return get_retrieval_service().stats()
+
+
+class SampleRequest(BaseModel):
+    """Body for /api/v1/subjects/{subject_id}/sample"""
+    n: int = 20
+    seed: Optional[int] = None
+    include_content: bool = True
+
+
+@app.post("/api/v1/subjects/{subject_id}/sample")
+async def sample_subject(subject_id: str, request: SampleRequest):
+    """
+    Chunks of a subject spread across its topic clusters
+    
+    For whole-subject prompts (e.g. "an exam covering the entire subject")
+    where no query exists: samples round-robin over precomputed clusters so
+    every topic and chapter is represented. Pass `seed` for a repeatable draw.
+    """
+    if not 1 <= request.n <= settings.RETRIEVAL_MAX_K:
+        raise HTTPException(status_code=400, detail=f"n must be between 1 and {settings.RETRIEVAL_MAX_K}")
+    
+    from app.retrieval import get_cluster_service
+    return await get_cluster_service().sample(
+        subject_id,
+        request.n,
+        seed=request.seed,
+        include_content=request.include_content,
+    )
+
+
+@app.delete("/api/v1/documents/{document_id}")
+async def delete_document_chunks(document_id: str, subject_id: Optional[str] = None):
+    """
+    Remove a document's chunks and drop cached retrievals of its subject
+    
+    Call before deleting the document in the backend; pass `subject_id` if the
+    document row may already be gone.
+    """
+    from app.database.client import get_database_client
+    from app.retrieval import get_retrieval_service
+    db = get_database_client()
+    get_retrieval_service()  # Tombstones the document in the shared index store
+    
+    subject_id = subject_id or await asyncio.to_thread(db.get_document_subject, document_id)
+    deleted = await asyncio.to_thread(db.delete_document_chunks, document_id)
+    publish_subject_change(subject_id, document_id, DOCUMENT_DELETED)
+    
+    return {
+        "status": "deleted",
+        "document_id": document_id,
+        "subject_id": subject_id,
+        "chunks_deleted": deleted,
+    }
+
+
+@app.get("/api/v1/documents/{document_id}/chunks")
+async def stream_document_chunks(
+    document_id: str,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    embedding_format: str = 'base64',
+):
+    """
+    Stream a document's chunks as NDJSON (see _chunk_stream_response)
+    """
+    from app.database.client import get_database_client
+    if await asyncio.to_thread(get_database_client().get_document_subject, document_id) is None:
+        raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
+    return _chunk_stream_response(fields, cursor, limit, embedding_format, document_id=document_id)
+
+
+@app.get("/api/v1/subjects/{subject_id}/chunks")
+async def stream_subject_chunks(
+    subject_id: str,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    embedding_format: str = 'base64',
+):
+    """
+    Stream the chunks of a subject's completed documents as NDJSON (see
+    _chunk_stream_response)
+    """
+    return _chunk_stream_response(fields, cursor, limit, embedding_format, subject_id=subject_id)
+
+
+def _chunk_stream_response(
+    fields: Optional[str],
+    cursor: Optional[str],
+    limit: Optional[int],
+    embedding_format: str,
+    document_id: Optional[str] = None,
+    subject_id: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    NDJSON response of chunks in (documentId, chunkIndex, id) order
+    
+    One JSON object per chunk, then a final `{"next_cursor": ...}` line; pass
+    it back as `cursor` to continue (null = no more chunks). `fields` is a
+    comma-separated column list, embeddings excluded by default; selected
+    embeddings are base64 float32 (little-endian) unless
+    `embedding_format=float`. Without `limit`, everything is streamed.
+    """
+    from app.services.chunk_stream import EMBEDDING_FORMATS, decode_cursor, parse_fields, stream_chunks
+    
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    if embedding_format not in EMBEDDING_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"embedding_format must be one of: {', '.join(EMBEDDING_FORMATS)}",
+        )
+    try:
+        columns = parse_fields(fields)
+        after = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        stream_chunks(
+            columns,
+            document_id=document_id,
+            subject_id=subject_id,
+            cursor=after,
+            limit=limit,
+            embedding_format=embedding_format,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get("/api/v1/bundles/export")
+async def export_bundle(
+    subject_id: Optional[str] = None,
+    document_id: Optional[List[str]] = Query(None),
+):
+    """
+    Download completed documents (all of a subject's, or by ID) as a bundle
+    
+    The bundle holds chunk text, metadata and float32 embeddings, so it can be
+    imported elsewhere without any embedding calls.
+    """
+    from app.services.bundles import export_bundle as write_bundle
+    
+    os.makedirs(settings.TEMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix='.npz', dir=settings.TEMP_DIR)
+    os.close(fd)
+    try:
+        summary = await asyncio.to_thread(write_bundle, path, document_ids=document_id, subject_id=subject_id)
+    except ValueError as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        os.remove(path)
+        raise
+    
+    return FileResponse(
+        path,
+        media_type="application/zip",
+        filename=f"{subject_id or 'documents'}.npz",
+        headers={"X-Bundle-Manifest-Sha256": summary['manifest_sha256']},
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@app.post("/api/v1/bundles/import")
+async def import_bundle(
+    file: UploadFile = File(...),
+    subject_id: Optional[str] = Form(None),
+    replace: bool = Form(False),
+):
+    """
+    Load a bundle: documents and chunks are bulk inserted with their stored
+    embeddings and subject indexes are published directly from the bundle
+    
+    Existing documents that already have chunks are skipped unless `replace`.
+    """
+    from app.services.bundles import import_bundle as load_bundle
+    
+    upload, size = await _spool_upload(file, max_size=settings.BUNDLE_MAX_SIZE)
+    logger.info(f"📦 [API] Importing bundle {file.filename} ({size} bytes)")
+    try:
+        return await asyncio.to_thread(load_bundle, upload, subject_id=subject_id, replace=replace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        upload.close()
+
+
+class BackfillRequest(BaseModel):
+    """Body for POST /api/v1/backfills: target embedding space (default: the configured model at its native size)"""
+    model: Optional[str] = None
+    dimensions: Optional[int] = None
+    restart: bool = False
+
+
+# Backfills running in this worker (kept referenced until they finish)
+_backfill_tasks: Set[asyncio.Task] = set()
+
+
+@app.post("/api/v1/backfills", status_code=202)
+async def start_backfill(request: BackfillRequest):
+    """
+    Re-embed stored chunks into another embedding model or size, in the background
+    
+    New vectors are written next to the current ones; search keeps using the
+    configured space until OPENAI_EMBEDDING_MODEL / OPENAI_EMBEDDING_DIMENSIONS
+    are switched. A stopped or interrupted backfill resumes where it was.
+    Answers 409 while a backfill to the same space is running.
+    """
+    from app.services.reembed import Backfill, BackfillRunning, target_space
+    
+    try:
+        backfill = Backfill(target_space(request.model, request.dimensions))
+        backfill.acquire()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BackfillRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    task = asyncio.create_task(_run_backfill(backfill, request.restart))
+    _backfill_tasks.add(task)
+    task.add_done_callback(_backfill_tasks.discard)
+    return {"status": "started", "space": backfill.space}
+
+
+async def _run_backfill(backfill, restart: bool):
+    try:
+        await backfill.run(restart=restart)
+    except Exception as e:
+        # Also raised before the run starts (lock, progress file), where nothing else logs it
+        logger.exception(f"❌ [BACKFILL] Backfill to {backfill.space} failed: {e}")
+
+
+@app.get("/api/v1/backfills")
+async def backfill_status(model: Optional[str] = None, dimensions: Optional[int] = None):
+    """Progress of the backfill to a space and how many chunks have a vector in it"""
+    from app.services.reembed import backfill_status as read_status, target_space
+    
+    try:
+        space = target_space(model, dimensions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await asyncio.to_thread(read_status, space)
+
+
+@app.delete("/api/v1/backfills")
+async def stop_backfill(model: Optional[str] = None, dimensions: Optional[int] = None):
+    """Stop the running backfill to a space after its current page (from any worker)"""
+    from app.services.reembed import Backfill, target_space
+    
+    try:
+        backfill = Backfill(target_space(model, dimensions))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not backfill.request_stop():
+        raise HTTPException(status_code=404, detail=f"No backfill to {backfill.space} is running")
+    return {"status": "stopping", "space": backfill.space}
 
 
 if __name__ == "__main__":
@@ -1,8 +1,35 @@
-"""Document parsers"""
-from .pdf_parser import PDFParser
-from .docx_parser import DOCXParser
-from .excel_parser import ExcelParser
+"""Document parsers
 
-__all__ = ['PDFParser', 'DOCXParser', 'ExcelParser']
+Parser classes are imported on first access, so PyMuPDF, python-docx and
+openpyxl are only loaded once a file of that type is parsed.
+"""
+import importlib
+from typing import TYPE_CHECKING
 
+_LAZY = {
+    'PDFParser': '.pdf_parser',
+    'DOCXParser': '.docx_parser',
+    'ExcelParser': '.excel_parser',
+    'HeadingDetector': '.headings',
+    'DocumentSource': '.sources',
+    'detect_type': '.sources',
+}
 
+if TYPE_CHECKING:
+    from .pdf_parser import PDFParser
+    from .docx_parser import DOCXParser
+    from .excel_parser import ExcelParser
+    from .headings import HeadingDetector
+    from .sources import DocumentSource, detect_type
+
+
+def __getattr__(name: str):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = ['PDFParser', 'DOCXParser', 'ExcelParser', 'HeadingDetector', 'DocumentSource', 'detect_type']
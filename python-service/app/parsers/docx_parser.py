@@ -1,129 +1,319 @@
 """DOCX Parser using python-docx"""
-from docx import Document
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 from loguru import logger
-import re
+from xml.etree import ElementTree
+import zipfile
+from .headings import HeadingDetector
+from .sources import DocumentSource, as_file, describe
+
+
+# WordprocessingML namespaces
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+CORE_NS = {
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'dcterms': 'http://purl.org/dc/terms/',
+    'cp': 'http://schemas.openxmlformats.org/package/2006/metadata/core-properties',
+}
+
+
+def _w(tag: str) -> str:
+    """Qualified WordprocessingML tag name"""
+    return f'{{{W_NS}}}{tag}'
+
+
+W_P = _w('p')
+W_T = _w('t')
+W_TAB = _w('tab')
+W_BR = _w('br')
+W_CR = _w('cr')
+W_TBL = _w('tbl')
+W_TR = _w('tr')
+W_TC = _w('tc')
+W_PSTYLE = _w('pStyle')
+W_PAGE_BREAK_BEFORE = _w('pageBreakBefore')
+W_TYPE = _w('type')
+W_VAL = _w('val')
 
 
 class DOCXParser:
     """Parse DOCX documents and extract structure"""
-    
-    def __init__(self):
-        self.chapter_patterns = [
-            r'^CHƯƠNG\s+(\d+)',
-            r'^Chương\s+(\d+)',
-            r'^CHƯƠNG\s+(\d+):',
-            r'^Chương\s+(\d+):',
-            r'^BÀI\s+(\d+)',
-            r'^Bài\s+(\d+)',
-        ]
-        self.chapter_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.chapter_patterns]
-    
-    def parse(self, file_path: str) -> Dict:
-        """Parse DOCX and extract chapters"""
+
+    def __init__(self, streaming: bool = True):
+        """
+        Args:
+            streaming: Read word/document.xml incrementally instead of loading
+                the python-docx object model (also extracts tables and page breaks)
+        """
+        self.streaming = streaming
+        self.heading_detector = HeadingDetector()
+
+    def parse(self, source: DocumentSource) -> Dict:
+        """Parse DOCX (path, bytes or binary file object) and extract chapters"""
         try:
-            doc = Document(file_path)
-            logger.info(f"Opened DOCX: {file_path}")
-            
-            # Extract metadata
-            core_props = doc.core_properties
-            metadata = {
-                'title': core_props.title or '',
-                'author': core_props.author or '',
-                'subject': core_props.subject or '',
-                'created': str(core_props.created) if core_props.created else '',
-            }
-            
-            # Extract paragraphs
-            paragraphs = []
-            for para in doc.paragraphs:
-                text = para.text.strip()
-                if text:
-                    paragraphs.append({
-                        'text': text,
-                        'style': para.style.name if para.style else None,
-                    })
-            
+            if self.streaming:
+                metadata, paragraphs, page_count = self._parse_streaming(as_file(source))
+            else:
+                metadata, paragraphs, page_count = self._parse_document(as_file(source))
+            logger.info(
+                f"Opened DOCX: {describe(source)}, {len(paragraphs)} blocks "
+                f"(streaming={self.streaming})"
+            )
+
             # Detect chapters
             chapters = self._detect_chapters(paragraphs)
-            
+
             # If no chapters, treat as single document
             if not chapters:
                 logger.warning("No chapters detected in DOCX")
                 full_text = '\n\n'.join([p['text'] for p in paragraphs])
                 chapters = [{
                     'number': None,
-                    'title': metadata.get('title', 'Nội dung chính'),
+                    'title': metadata.get('title') or 'Nội dung chính',
                     'start_page': 1,
-                    'end_page': 1,
+                    'end_page': page_count,
                     'content': full_text,
                 }]
-            
+
             return {
-                'total_pages': len(paragraphs) // 30,  # Estimate: ~30 paragraphs per page
+                'total_pages': page_count,
                 'chapters': chapters,
                 'metadata': metadata,
                 'file_type': 'docx',
             }
-            
+
         except Exception as e:
-            logger.error(f"Error parsing DOCX {file_path}: {e}")
+            logger.error(f"Error parsing DOCX {describe(source)}: {e}")
             raise
-    
+
+    def _parse_document(self, file: Union[str, BinaryIO]) -> Tuple[Dict, List[Dict], int]:
+        """Extract paragraphs through the python-docx object model"""
+        from docx import Document  # Only needed when streaming is disabled
+
+        doc = Document(file)
+
+        # Extract metadata
+        core_props = doc.core_properties
+        metadata = {
+            'title': core_props.title or '',
+            'author': core_props.author or '',
+            'subject': core_props.subject or '',
+            'created': str(core_props.created) if core_props.created else '',
+        }
+
+        # Extract paragraphs (no page information: estimate ~30 paragraphs per page)
+        paragraphs = []
+        for para in doc.paragraphs:
+            text = para.text.strip()
+            if text:
+                paragraphs.append({
+                    'text': text,
+                    'style': para.style.name if para.style else None,
+                    'page': len(paragraphs) // 30 + 1,
+                })
+
+        return metadata, paragraphs, max(len(paragraphs) // 30, 1)
+
+    def _parse_streaming(self, file: Union[str, BinaryIO]) -> Tuple[Dict, List[Dict], int]:
+        """Extract paragraphs and tables by streaming the package XML"""
+        with zipfile.ZipFile(file) as package:
+            metadata = self._read_core_properties(package)
+            style_names = self._read_style_names(package)
+
+            paragraphs = []
+            page_breaks = 0
+            for block in self._iter_blocks(package, style_names):
+                if block['type'] == 'page_break':
+                    page_breaks += 1
+                    continue
+                paragraphs.append(block)
+
+        if page_breaks:
+            page_count = page_breaks + 1
+        else:
+            # No explicit breaks: fall back to ~30 blocks per page
+            for idx, para in enumerate(paragraphs):
+                para['page'] = idx // 30 + 1
+            page_count = max(len(paragraphs) // 30, 1)
+
+        return metadata, paragraphs, page_count
+
+    def _iter_blocks(self, package: zipfile.ZipFile, style_names: Dict[str, str]) -> Iterator[Dict]:
+        """
+        Yield body blocks in reading order
+
+        Paragraphs are yielded as {'type': 'paragraph', 'text', 'style', 'page'},
+        tables as {'type': 'table', ...} with one ' | '-separated line per row,
+        and explicit page breaks as {'type': 'page_break'}. Finished top-level
+        elements are cleared so memory stays bounded on long documents.
+        """
+        page = 1
+        para_stack: List[Dict] = []    # Open paragraphs (text boxes can nest them)
+        cell_stack: List[List[str]] = []   # Paragraph texts of open table cells
+        row_stack: List[List[str]] = []    # Cell texts of open table rows
+        table_stack: List[List[str]] = []  # Row lines of open tables
+
+        with package.open('word/document.xml') as xml_file:
+            for event, elem in ElementTree.iterparse(xml_file, events=('start', 'end')):
+                tag = elem.tag
+
+                if event == 'start':
+                    if tag == W_P:
+                        para_stack.append({'parts': [], 'style': None, 'page': None})
+                    elif tag == W_TBL:
+                        table_stack.append([])
+                    elif tag == W_TR:
+                        row_stack.append([])
+                    elif tag == W_TC:
+                        cell_stack.append([])
+                    continue
+
+                # 'end' events: the element and its children are complete
+                if tag == W_T:
+                    if para_stack and elem.text:
+                        para = para_stack[-1]
+                        if para['page'] is None:
+                            para['page'] = page
+                        para['parts'].append(elem.text)
+                elif tag == W_TAB:
+                    if para_stack:
+                        para_stack[-1]['parts'].append('\t')
+                elif tag == W_BR:
+                    if elem.get(W_TYPE) == 'page':
+                        page += 1
+                        yield {'type': 'page_break'}
+                    elif para_stack:
+                        para_stack[-1]['parts'].append('\n')
+                elif tag == W_CR:
+                    if para_stack:
+                        para_stack[-1]['parts'].append('\n')
+                elif tag == W_PSTYLE:
+                    if para_stack:
+                        style_id = elem.get(W_VAL)
+                        para_stack[-1]['style'] = style_names.get(style_id, style_id)
+                elif tag == W_PAGE_BREAK_BEFORE:
+                    if elem.get(W_VAL) not in ('0', 'false', 'off'):
+                        page += 1
+                        yield {'type': 'page_break'}
+                elif tag == W_P:
+                    para = para_stack.pop()
+                    text = ''.join(para['parts']).strip()
+                    if para_stack:
+                        # Text box paragraph: inline into the enclosing paragraph
+                        if text:
+                            para_stack[-1]['parts'].append('\n' + text)
+                    elif cell_stack:
+                        if text:
+                            cell_stack[-1].append(text)
+                    else:
+                        if text:
+                            yield {
+                                'type': 'paragraph',
+                                'text': text,
+                                'style': para['style'],
+                                'page': para['page'] or page,
+                            }
+                        elem.clear()
+                elif tag == W_TC:
+                    cell = cell_stack.pop()
+                    if row_stack:
+                        row_stack[-1].append(' '.join(cell))
+                elif tag == W_TR:
+                    cells = row_stack.pop()
+                    if table_stack and any(cells):
+                        table_stack[-1].append(' | '.join(c for c in cells if c))
+                elif tag == W_TBL:
+                    rows = table_stack.pop()
+                    text = '\n'.join(rows)
+                    if cell_stack:
+                        # Nested table: keep its text inside the enclosing cell
+                        if text:
+                            cell_stack[-1].append(text)
+                    else:
+                        if text:
+                            yield {
+                                'type': 'table',
+                                'text': text,
+                                'style': 'Table',
+                                'page': page,
+                            }
+                        elem.clear()
+
+    def _read_style_names(self, package: zipfile.ZipFile) -> Dict[str, str]:
+        """Map style IDs (w:pStyle values) to display names such as 'Heading 1'"""
+        try:
+            with package.open('word/styles.xml') as xml_file:
+                root = ElementTree.parse(xml_file).getroot()
+        except KeyError:
+            return {}
+
+        names = {}
+        for style in root.iter(_w('style')):
+            name = style.find(_w('name'))
+            style_id = style.get(_w('styleId'))
+            if style_id and name is not None:
+                names[style_id] = name.get(W_VAL, style_id)
+        return names
+
+    def _read_core_properties(self, package: zipfile.ZipFile) -> Dict:
+        """Read title/author/subject/created from docProps/core.xml"""
+        metadata = {'title': '', 'author': '', 'subject': '', 'created': ''}
+        try:
+            with package.open('docProps/core.xml') as xml_file:
+                root = ElementTree.parse(xml_file).getroot()
+        except KeyError:
+            return metadata
+
+        fields = {
+            'title': 'dc:title',
+            'author': 'dc:creator',
+            'subject': 'dc:subject',
+            'created': 'dcterms:created',
+        }
+        for key, path in fields.items():
+            node = root.find(path, CORE_NS)
+            if node is not None and node.text:
+                metadata[key] = node.text.strip()
+        return metadata
+
     def _detect_chapters(self, paragraphs: List[Dict]) -> List[Dict]:
         """Detect chapter headers in DOCX paragraphs"""
         chapters = []
         current_chapter = None
-        
-        for idx, para in enumerate(paragraphs):
+        current_parts: List[str] = []
+
+        for para in paragraphs:
             text = para['text']
-            style = para.get('style', '')
-            
-            # Check if this looks like a chapter header
-            is_header = (
-                style and ('Heading' in style or 'Title' in style)
-            ) or any(regex.match(text) for regex in self.chapter_regex)
-            
-            if is_header:
-                # Try to match chapter pattern
-                for regex in self.chapter_regex:
-                    match = regex.match(text)
-                    if match:
-                        chapter_num = match.group(1)
-                        
-                        # Save previous chapter
-                        if current_chapter:
-                            chapters.append(current_chapter)
-                        
-                        # Start new chapter
-                        current_chapter = {
-                            'number': self._parse_chapter_number(chapter_num),
-                            'title': text,
-                            'start_page': len(chapters) + 1,  # Estimate
-                            'end_page': len(chapters) + 1,
-                            'content': '',
-                        }
-                        break
-            
-            # Add paragraph to current chapter
+            page = para.get('page') or 1
+
+            # Paragraphs (not tables) matching a chapter pattern start a new chapter
+            heading = None
+            if para.get('type', 'paragraph') == 'paragraph':
+                heading = self.heading_detector.match(text)
+
+            if heading:
+                # Save previous chapter
+                if current_chapter:
+                    current_chapter['content'] = '\n\n'.join(current_parts)
+                    chapters.append(current_chapter)
+
+                # Start new chapter
+                current_chapter = {
+                    'number': heading.number,
+                    'title': text,
+                    'start_page': page,
+                    'end_page': page,
+                    'content': '',
+                }
+                current_parts = []
+
+            # Add paragraph to current chapter (chapter bodies are joined once)
             if current_chapter:
-                current_chapter['content'] += '\n\n' + text
-                current_chapter['end_page'] = len(chapters) + 1
-            elif chapters:  # Add to last chapter if exists
-                if chapters:
-                    chapters[-1]['content'] += '\n\n' + text
-        
+                current_parts.append(text)
+                current_chapter['end_page'] = page
+
         # Add final chapter
         if current_chapter:
+            current_chapter['content'] = '\n\n'.join(current_parts)
             chapters.append(current_chapter)
-        
-        return chapters
-    
-    def _parse_chapter_number(self, num_str: str) -> Optional[int]:
-        """Convert chapter number to int"""
-        try:
-            return int(num_str)
-        except ValueError:
-            return None
-
 
+        return chapters
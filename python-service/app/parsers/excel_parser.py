@@ -1,64 +1,164 @@
 """Excel Parser using openpyxl"""
 from openpyxl import load_workbook
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Tuple
 from loguru import logger
+from .sources import DocumentSource, as_file, describe
 
 
 class ExcelParser:
     """Parse Excel files and extract text"""
-    
-    def parse(self, file_path: str) -> Dict:
-        """Parse Excel and extract content from all sheets"""
+
+    def __init__(self, streaming: bool = True, rows_per_chapter: int = 0):
+        """
+        Args:
+            streaming: Open workbooks in read-only mode and iterate rows lazily
+                instead of building the full cell object model
+            rows_per_chapter: Split each sheet into chapters of at most this many
+                data rows (header row repeated in each); 0 = one chapter per sheet
+        """
+        self.streaming = streaming
+        self.rows_per_chapter = max(rows_per_chapter, 0)
+
+    def parse(self, source: DocumentSource) -> Dict:
+        """Parse Excel (path, bytes or binary file object) into one chapter per sheet (or per row range)"""
         try:
-            workbook = load_workbook(file_path, data_only=True)
-            logger.info(f"Opened Excel: {file_path}, {len(workbook.sheetnames)} sheets")
-            
-            sheets_data = []
-            all_text = []
-            
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                sheet_text = []
-                
-                # Extract all cell values
-                for row in sheet.iter_rows(values_only=True):
-                    row_text = []
-                    for cell in row:
-                        if cell is not None:
-                            row_text.append(str(cell))
-                    if row_text:
-                        sheet_text.append(' | '.join(row_text))
-                
-                sheet_content = '\n'.join(sheet_text)
-                sheets_data.append({
-                    'name': sheet_name,
-                    'content': sheet_content,
-                })
-                all_text.append(f"Sheet: {sheet_name}\n{sheet_content}")
-            
-            workbook.close()
-            
-            full_content = '\n\n---\n\n'.join(all_text)
-            
-            return {
-                'total_pages': len(workbook.sheetnames),
-                'chapters': [{
+            workbook = load_workbook(as_file(source), read_only=self.streaming, data_only=True)
+            logger.info(
+                f"Opened Excel: {describe(source)}, {len(workbook.sheetnames)} sheets "
+                f"(streaming={self.streaming})"
+            )
+
+            try:
+                metadata = {
+                    'title': workbook.properties.title or '',
+                    'author': workbook.properties.creator or '',
+                }
+
+                chapters = []
+                sheets_data = []
+                worksheets = workbook.worksheets  # Chartsheets have no rows
+
+                for sheet_number, sheet in enumerate(worksheets, start=1):
+                    sheet_chapters, row_count = self._parse_sheet(sheet, sheet_number)
+                    chapters.extend(sheet_chapters)
+                    sheets_data.append({
+                        'name': sheet.title,
+                        'rows': row_count,
+                        'chapters': len(sheet_chapters),
+                    })
+            finally:
+                # Read-only workbooks keep the zip archive open until closed
+                workbook.close()
+
+            if not chapters:
+                logger.warning("No content found in Excel workbook")
+                chapters = [{
                     'number': None,
                     'title': 'Excel Content',
                     'start_page': 1,
-                    'end_page': len(workbook.sheetnames),
-                    'content': full_content,
-                }],
-                'metadata': {
-                    'title': workbook.properties.title or '',
-                    'author': workbook.properties.creator or '',
-                },
+                    'end_page': max(len(worksheets), 1),
+                    'content': '',
+                }]
+
+            return {
+                'total_pages': len(worksheets),
+                'chapters': chapters,
+                'metadata': metadata,
                 'file_type': 'excel',
                 'sheets': sheets_data,
             }
-            
+
         except Exception as e:
-            logger.error(f"Error parsing Excel {file_path}: {e}")
+            logger.error(f"Error parsing Excel {describe(source)}: {e}")
             raise
 
+    def _parse_sheet(self, sheet, sheet_number: int) -> Tuple[List[Dict], int]:
+        """
+        Stream a sheet's rows into chapters
+
+        Only the formatted text of the current row is held besides the chapter
+        being built, so memory stays proportional to one row plus one chapter.
+
+        Returns:
+            Tuple of (chapters, number of non-empty rows)
+        """
+        chapters = []
+        header: Optional[str] = None
+        lines: List[str] = []
+        first_row = last_row = 0
+        data_rows = 0
+        row_count = 0
+
+        for row_number, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+            row_text = self._format_row(row)
+            if not row_text:
+                continue
+            row_count += 1
+
+            if header is None:
+                header = row_text
+                continue
+
+            if not lines:
+                first_row = row_number
+            lines.append(row_text)
+            last_row = row_number
+            data_rows += 1
+
+            if self.rows_per_chapter and data_rows >= self.rows_per_chapter:
+                chapters.append(
+                    self._build_chapter(sheet.title, sheet_number, header, lines, first_row, last_row)
+                )
+                lines = []
+                data_rows = 0
+
+        if lines or (header is not None and not chapters):
+            chapters.append(
+                self._build_chapter(sheet.title, sheet_number, header, lines, first_row, last_row)
+            )
+
+        return chapters, row_count
+
+    def _build_chapter(
+        self,
+        sheet_name: str,
+        sheet_number: int,
+        header: Optional[str],
+        lines: List[str],
+        first_row: int,
+        last_row: int,
+    ) -> Dict:
+        """Build a chapter dict for a sheet or a row range of a sheet"""
+        title = f"Sheet: {sheet_name}"
+        if self.rows_per_chapter and lines:
+            title = f"{title} (rows {first_row}-{last_row})"
+
+        content = '\n'.join(self._chapter_lines(title, header, lines))
+        return {
+            'number': sheet_number,
+            'title': title,
+            'start_page': sheet_number,
+            'end_page': sheet_number,
+            'content': content,
+        }
+
+    @staticmethod
+    def _chapter_lines(title: str, header: Optional[str], lines: List[str]) -> Iterable[str]:
+        """Yield chapter lines so the content is joined exactly once"""
+        yield title
+        if header is not None:
+            yield header
+        yield from lines
+
+    @staticmethod
+    def _format_row(row: tuple) -> str:
+        """
+        Format one row as 'a | b | c', skipping empty cells
 
+        Wide sheets often report thousands of trailing empty columns; those
+        cells are filtered out before any string is built for them.
+        """
+        return ' | '.join(
+            str(cell) for cell in row
+            if cell is not None and not (isinstance(cell, str) and not cell.strip())
+        )
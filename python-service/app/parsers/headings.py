@@ -0,0 +1,209 @@
+"""Shared chapter heading detection for PDF and DOCX parsers"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import re
+import unicodedata
+
+
+# One alternation for every supported heading form:
+#   CHƯƠNG 1 / Chương 1: ... / CHƯƠNG IV / BÀI 3. ... / Phần II - ...
+# Roman numerals are matched case-sensitively so words like "Bài di..." never
+# read as numbers, and only in the I/V/X forms textbooks use (I to XXXIX), so
+# lettered sections ("Phần A", "Phần C", "Phần D", "Phần M") are not headings.
+HEADING_PATTERN = re.compile(
+    r'^\s*(?P<keyword>chương|bài|phần)\s+'
+    r'(?P<number>\d{1,3}|(?-i:(?=[IVX])X{0,3}(?:IX|IV|V?I{0,3})))'
+    r'(?![\w])[\s.:)\-–—]*(?P<rest>.*)$',
+    re.IGNORECASE,
+)
+
+ROMAN_VALUES = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100, 'D': 500, 'M': 1000}
+
+# PyMuPDF span flag for bold text
+FONT_FLAG_BOLD = 16
+
+
+class HeadingMatch(NamedTuple):
+    """A detected chapter heading"""
+    keyword: str           # Lower-cased keyword: 'chương', 'bài' or 'phần'
+    number: Optional[int]  # Parsed Arabic or Roman numeral
+    text: str              # Full heading line
+    rest: str              # Text after the number (often the chapter title)
+
+
+class PageLine(NamedTuple):
+    """One text line of a PDF page with its dominant font metrics"""
+    text: str
+    size: float
+    bold: bool
+    position: float = -1.0  # Vertical middle as a fraction of the page height (-1 = unknown)
+
+
+def roman_to_int(numeral: str) -> Optional[int]:
+    """Convert a Roman numeral (I, IV, XII, ...) to int"""
+    total = 0
+    previous = 0
+    for char in reversed(numeral.upper()):
+        value = ROMAN_VALUES.get(char)
+        if value is None:
+            return None
+        if value < previous:
+            total -= value
+        else:
+            total += value
+            previous = value
+    return total or None
+
+
+def parse_chapter_number(num_str: str) -> Optional[int]:
+    """Convert an Arabic or Roman chapter number to int"""
+    try:
+        return int(num_str)
+    except ValueError:
+        return roman_to_int(num_str)
+
+
+class HeadingDetector:
+    """Detect chapter headings from text patterns and font metrics"""
+
+    def __init__(self, size_ratio: float = 1.15, top_lines: int = 10, max_length: int = 150):
+        """
+        Args:
+            size_ratio: Minimum font size relative to the page's body text for
+                a line to count as visually emphasized
+            top_lines: Lines at the top of a page where a pattern match alone is
+                enough (for PDFs without font variation)
+            max_length: Longer lines are treated as body text
+        """
+        self.size_ratio = size_ratio
+        self.top_lines = top_lines
+        self.max_length = max_length
+
+    def match(self, line: str) -> Optional[HeadingMatch]:
+        """Match a single line against the combined heading pattern"""
+        if not line or len(line) > self.max_length:
+            return None
+        if not unicodedata.is_normalized('NFC', line):
+            # Decomposed diacritics (NFD) would not match "Chương"/"Bài"/"Phần"
+            line = unicodedata.normalize('NFC', line)
+
+        match = HEADING_PATTERN.match(line)
+        if not match or not match.group('number'):
+            return None
+
+        return HeadingMatch(
+            keyword=match.group('keyword').lower(),
+            number=parse_chapter_number(match.group('number')),
+            text=line.strip(),
+            rest=match.group('rest').strip(),
+        )
+
+    def extract_page_lines(self, page_dict: Dict) -> Tuple[List[PageLine], float]:
+        """
+        Flatten PyMuPDF's structured page output into lines
+
+        Args:
+            page_dict: Result of page.get_text('dict')
+
+        Returns:
+            Tuple of (lines in reading order, body font size of the page), where
+            the body size is the character-weighted most common span size
+        """
+        lines: List[PageLine] = []
+        size_weights: Dict[float, int] = {}
+        height = page_dict.get('height') or 0.0
+
+        for block in page_dict.get('blocks', []):
+            if block.get('type', 0) != 0:  # Skip image blocks
+                continue
+            for line in block.get('lines', []):
+                parts = []
+                line_size = 0.0
+                line_bold = True
+                for span in line.get('spans', []):
+                    span_text = span.get('text', '')
+                    if not span_text:
+                        continue
+                    parts.append(span_text)
+                    if not span_text.strip():
+                        continue
+                    size = round(span.get('size', 0.0), 1)
+                    size_weights[size] = size_weights.get(size, 0) + len(span_text)
+                    line_size = max(line_size, size)
+                    line_bold = line_bold and (
+                        bool(span.get('flags', 0) & FONT_FLAG_BOLD)
+                        or 'bold' in span.get('font', '').lower()
+                    )
+                text = ''.join(parts)
+                bbox = line.get('bbox')
+                position = (bbox[1] + bbox[3]) / 2 / height if bbox and height else -1.0
+                if text.strip():
+                    lines.append(PageLine(text=text, size=line_size, bold=line_bold, position=position))
+                else:
+                    lines.append(PageLine(text='', size=0.0, bold=False, position=position))
+
+        body_size = max(size_weights, key=size_weights.get) if size_weights else 0.0
+        return lines, body_size
+
+    def is_emphasized(self, line: PageLine, body_size: float) -> bool:
+        """Larger or bolder than the page's body text"""
+        if not line.text.strip():
+            return False
+        if body_size and line.size >= body_size * self.size_ratio:
+            return True
+        return line.bold and line.size >= body_size
+
+    def detect_page_headings(
+        self,
+        lines: List[PageLine],
+        body_size: float,
+    ) -> List[Tuple[int, HeadingMatch, str]]:
+        """
+        Find chapter headings anywhere on a page in one pass
+
+        A pattern match counts when the line is visually emphasized, or when it
+        is among the first `top_lines` non-empty lines of the page.
+
+        Returns:
+            List of (line index, match, chapter title)
+        """
+        headings = []
+        seen_text = 0
+
+        for idx, line in enumerate(lines):
+            stripped = line.text.strip()
+            if not stripped:
+                continue
+            seen_text += 1
+
+            emphasized = self.is_emphasized(line, body_size)
+            if not emphasized and seen_text > self.top_lines:
+                continue
+
+            heading = self.match(stripped)
+            if not heading:
+                continue
+
+            headings.append((idx, heading, self._title(lines, idx, heading, emphasized, body_size)))
+
+        return headings
+
+    def _title(
+        self,
+        lines: List[PageLine],
+        idx: int,
+        heading: HeadingMatch,
+        emphasized: bool,
+        body_size: float,
+    ) -> str:
+        """Heading line, plus the next line when it continues the heading"""
+        for next_line in lines[idx + 1:]:
+            next_text = next_line.text.strip()
+            if not next_text:
+                continue
+            if self.match(next_text):
+                break
+            # "CHƯƠNG 1" alone on a line, or a title set in the same heading style
+            if not heading.rest or (emphasized and self.is_emphasized(next_line, body_size)):
+                return f"{heading.text} {next_text}"
+            break
+        return heading.text
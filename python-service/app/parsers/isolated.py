@@ -0,0 +1,114 @@
+"""
+Parsing in a child process that can be killed
+
+A malformed file can keep PyMuPDF, python-docx or openpyxl busy for
+minutes inside C code that no timeout or task cancellation reaches. Each
+parse runs in its own process instead, forked from a forkserver that has
+already imported the parser libraries (so starting one costs milliseconds),
+and the process is killed when the job's deadline passes or the job is
+cancelled.
+"""
+import asyncio
+import multiprocessing
+from typing import Dict, Optional
+from app.config import settings
+from app.parsers.sources import DOCX, EXCEL, PDF, DocumentSource, read_bytes
+
+# Imported once by the forkserver and inherited by every parse process
+PRELOAD = ['app.parsers.isolated', 'app.parsers.pdf_parser', 'app.parsers.docx_parser', 'app.parsers.excel_parser']
+
+_context: Optional[multiprocessing.context.BaseContext] = None
+
+
+def create_parser(file_type: str):
+    """New parser for a file type, importing its library on first use"""
+    if file_type == PDF:
+        from app.parsers.pdf_parser import PDFParser
+        return PDFParser(
+            normalize=settings.TEXT_NORMALIZATION,
+            boilerplate_ratio=settings.BOILERPLATE_MIN_PAGE_RATIO,
+        )
+    if file_type == DOCX:
+        from app.parsers.docx_parser import DOCXParser
+        return DOCXParser(streaming=settings.DOCX_STREAMING)
+    if file_type == EXCEL:
+        from app.parsers.excel_parser import ExcelParser
+        return ExcelParser(
+            streaming=settings.EXCEL_STREAMING,
+            rows_per_chapter=settings.EXCEL_ROWS_PER_CHAPTER,
+        )
+    raise ValueError(f"Unsupported file type: {file_type}")
+
+
+def warm_up():
+    """Start the forkserver (and import the parser libraries in it) now"""
+    from multiprocessing import forkserver
+    _get_context()
+    forkserver.ensure_running()
+
+
+async def parse_isolated(source: DocumentSource, file_type: str, timeout: float) -> Dict:
+    """
+    Parse a document in a child process
+
+    Args:
+        source: Document to parse (its bytes are sent to the child)
+        file_type: One of PDF, DOCX, EXCEL
+        timeout: Seconds before the child is killed
+
+    Returns:
+        The parser's result
+
+    Raises:
+        TimeoutError: If parsing took longer than `timeout`
+        ValueError: If the parser rejected the file
+        RuntimeError: If the child process died
+    """
+    context = _get_context()
+    receiver, sender = context.Pipe(duplex=True)
+    process = context.Process(target=_parse_child, args=(sender, file_type), daemon=True)
+    await asyncio.to_thread(process.start)
+    sender.close()
+    try:
+        data = await asyncio.to_thread(read_bytes, source)
+        await asyncio.to_thread(receiver.send_bytes, data)
+        del data
+
+        # Killing the child (on timeout or cancellation) ends the wait with EOF
+        if not await asyncio.to_thread(receiver.poll, timeout):
+            raise TimeoutError(f"Parsing took longer than {timeout:.1f}s")
+        try:
+            status, payload = await asyncio.to_thread(receiver.recv)
+        except EOFError:
+            process.join(1)
+            raise RuntimeError(f"Parser process died (exit code {process.exitcode})")
+    finally:
+        if process.is_alive():
+            process.kill()
+        await asyncio.to_thread(process.join)
+    # Not closed on errors: a helper thread may still be reading (closed when collected)
+    receiver.close()
+
+    if status == 'error':
+        raise ValueError(payload)
+    return payload
+
+
+def _parse_child(connection, file_type: str):
+    """Child process: receive the file bytes, send back ('ok', result) or ('error', message)"""
+    try:
+        data = connection.recv_bytes()
+        result = create_parser(file_type).parse(data)
+        connection.send(('ok', result))
+    except Exception as e:
+        connection.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+def _get_context() -> multiprocessing.context.BaseContext:
+    global _context
+    if _context is None:
+        _context = multiprocessing.get_context('forkserver')
+        _context.set_forkserver_preload(PRELOAD)
+    return _context
@@ -0,0 +1,217 @@
+"""Text normalization between parsing and chunking"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+import math
+import re
+import unicodedata
+
+
+# Zero-width characters, BOMs and soft hyphens left over from PDF extraction
+INVISIBLE_PATTERN = re.compile('[\u00ad\u200b\u200c\u200d\u2060\ufeff]')
+
+# Runs of spaces, tabs and exotic Unicode spaces inside a line
+SPACE_PATTERN = re.compile(r'[^\S\n]+')
+
+# A line that is only a page number: "12", "- 12 -", "Trang 12", "12/240", "Page 3 of 40"
+PAGE_NUMBER_PATTERN = re.compile(
+    r'^(?:trang|page)?\s*[-–—(\[]?\s*\d{1,4}\s*(?:(?:/|of|trên)\s*\d{1,4})?\s*[-–—)\]]?$',
+    re.IGNORECASE,
+)
+
+# Line starting a list item, never joined to the line above
+LIST_ITEM_PATTERN = re.compile(r'^(?:[-–•*+▪●○■□►✓]|\w{1,3}[.)]\s)')
+
+# Characters ending a sentence (or a label) at the end of a line
+SENTENCE_END = frozenset('.!?:;…"”»)]')
+
+# Page number at the start or end of a running header/footer, set off by a
+# separator or a "Trang"/"Page" label: "Giáo trình Python | 12", "Trang 3 - Khoa CNTT".
+# Only this number is masked when comparing lines across pages, so body lines
+# differing by a number ("Câu 1.", "Bài 3 ...") never compare equal.
+RUNNING_PAGE_PATTERN = re.compile(
+    r'(?:(?:^|[|·•\-–—]|\b(?:trang|page))\s*\d{1,4}(?:\s*(?:/|of|trên)\s*\d{1,4})?\s*$'
+    r'|^\s*(?:(?:trang|page)\s*)?\d{1,4}(?:\s*(?:/|of|trên)\s*\d{1,4})?\s*[|·•\-–—])',
+    re.IGNORECASE,
+)
+
+# Characters per token, as in the chunker's token estimate
+CHARS_PER_TOKEN = 4
+
+
+class TextNormalizer:
+    """
+    Clean up the text lines of one document's pages
+
+    Create one per document: running headers and footers are found by
+    counting, over every page, the lines in the page's top and bottom
+    margins (`observe`), then each page is cleaned in a single pass (`join`):
+
+    - NFC normalization, so "Chương" decomposed (NFD) and composed are the
+      same text and hash the same
+    - zero-width characters and soft hyphens removed, whitespace collapsed
+    - running headers/footers and page numbers dropped (`strip_boilerplate`)
+    - lines wrapped in the middle of a sentence rejoined, and words
+      hyphenated across a line break put back together
+
+    A page is never stripped down to nothing (e.g. slides or forms that
+    repeat the same short page).
+    """
+
+    def __init__(
+        self,
+        edge_lines: int = 2,
+        margin: float = 0.12,
+        min_ratio: float = 0.5,
+        min_pages: int = 3,
+    ):
+        """
+        Args:
+            edge_lines: Non-empty lines at the top and at the bottom of a page
+                that may be a running header or footer
+            margin: Fraction of the page height at the top and at the bottom
+                where those lines must sit (when line positions are known)
+            min_ratio: Fraction of the pages a line must repeat on to be boilerplate
+            min_pages: Documents with fewer pages are never stripped of boilerplate
+        """
+        self.edge_lines = edge_lines
+        self.margin = margin
+        self.min_ratio = min_ratio
+        self.min_pages = min_pages
+        self._edge_counts: Counter = Counter()
+        self._pages = 0
+        self._boilerplate: Optional[frozenset] = None
+        self._stats = {'chars_before': 0, 'chars_after': 0, 'boilerplate_lines': 0, 'rejoined_lines': 0}
+
+    def clean_line(self, line: str) -> str:
+        """NFC, invisible characters removed, whitespace collapsed and trimmed"""
+        if not unicodedata.is_normalized('NFC', line):
+            line = unicodedata.normalize('NFC', line)
+        return SPACE_PATTERN.sub(' ', INVISIBLE_PATTERN.sub('', line)).strip()
+
+    def observe(self, lines: Sequence[str], positions: Optional[Sequence[float]] = None):
+        """
+        Count the page's edge lines (pass every page before `strip_boilerplate`)
+
+        Args:
+            lines: Cleaned lines of the page
+            positions: Vertical middle of each line as a fraction of the page
+                height (None or negative values: unknown)
+        """
+        self._pages += 1
+        self._edge_counts.update({self._key(lines[idx]) for idx in self._edges(lines, positions)})
+
+    def strip_boilerplate(
+        self,
+        lines: Sequence[str],
+        positions: Optional[Sequence[float]] = None,
+    ) -> List[Optional[str]]:
+        """The page's lines, with running headers, footers and page numbers replaced by None"""
+        if self._boilerplate is None:
+            threshold = max(self.min_pages, math.ceil(self._pages * self.min_ratio))
+            self._boilerplate = frozenset(
+                key for key, count in self._edge_counts.items() if count >= threshold
+            )
+
+        edges = self._edges(lines, positions)
+        filled = [idx for idx, line in enumerate(lines) if line]
+        dropped = [
+            idx for idx in edges
+            # Page numbers are only looked for on the first and last line
+            if (idx in (filled[0], filled[-1]) and PAGE_NUMBER_PATTERN.match(lines[idx]))
+            or self._key(lines[idx]) in self._boilerplate
+        ]
+        if len(dropped) == len(filled):
+            return list(lines)  # Nothing but "boilerplate": keep the page
+
+        stripped: List[Optional[str]] = list(lines)
+        for idx in dropped:
+            stripped[idx] = None
+        self._stats['boilerplate_lines'] += len(dropped)
+        return stripped
+
+    def join(self, lines: Iterable[Optional[str]], count: bool = True) -> str:
+        """
+        Join cleaned lines into text, in one pass
+
+        Blank lines become a single paragraph break; a line is appended to
+        the previous one when that one stops mid-sentence and this one
+        continues it in lower case. None entries (boilerplate) are skipped.
+
+        Args:
+            lines: Cleaned lines
+            count: Count rejoined lines in `stats` (False when joining lines
+                already counted, e.g. a part of a page joined before)
+        """
+        rejoined = 0
+        parts: List[str] = []
+        previous = ''
+        paragraph_break = False
+        for line in lines:
+            if line is None:
+                continue
+            if not line:
+                paragraph_break = bool(parts)
+                continue
+
+            if paragraph_break:
+                parts.append('\n\n')
+            elif previous:
+                if previous[-1] == '-' and len(previous) > 1 and previous[-2].isalpha() and line[0].islower():
+                    # Word hyphenated across the break: drop the hyphen
+                    parts[-1] = previous[:-1]
+                    parts.append(line)
+                    previous = line
+                    rejoined += 1
+                    continue
+                if (
+                    previous[-1] not in SENTENCE_END
+                    and line[0].islower()
+                    and not previous.isupper()  # Headings set in capitals
+                    and not LIST_ITEM_PATTERN.match(line)
+                ):
+                    parts.append(' ')
+                    rejoined += 1
+                else:
+                    parts.append('\n')
+            parts.append(line)
+            previous = line
+            paragraph_break = False
+
+        if count:
+            self._stats['rejoined_lines'] += rejoined
+        return ''.join(parts)
+
+    def record(self, raw_chars: int, text: str):
+        """Record a piece of the parsed document: its raw length and its normalized text (for `stats`)"""
+        self._stats['chars_before'] += raw_chars
+        self._stats['chars_after'] += len(text)
+
+    def stats(self) -> Dict:
+        """Characters and (estimated) tokens saved, and what was removed"""
+        saved = max(self._stats['chars_before'] - self._stats['chars_after'], 0)
+        return {
+            **self._stats,
+            'chars_saved': saved,
+            'tokens_saved': saved // CHARS_PER_TOKEN,
+            'boilerplate_patterns': len(self._boilerplate or ()),
+        }
+
+    def _edges(self, lines: Sequence[str], positions: Optional[Sequence[float]] = None) -> List[int]:
+        """
+        Indexes of the first and last `edge_lines` non-empty lines, of those
+        in the top or bottom margin when line positions are known
+        """
+        filled = [idx for idx, line in enumerate(lines) if line]
+        head = filled[:self.edge_lines]
+        tail = [idx for idx in filled[-self.edge_lines:] if idx not in head]
+        if positions is None:
+            return head + tail
+        return (
+            [idx for idx in head if 0 <= positions[idx] <= self.margin]
+            + [idx for idx in tail if positions[idx] >= 1 - self.margin]
+        )
+
+    @staticmethod
+    def _key(line: str) -> str:
+        """Line as compared across pages: case folded, a running page number masked"""
+        return RUNNING_PAGE_PATTERN.sub('#', line.casefold(), count=1)
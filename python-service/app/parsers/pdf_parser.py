@@ -1,57 +1,53 @@
 """PDF Parser using PyMuPDF"""
 import fitz  # PyMuPDF
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
+from .headings import HeadingDetector
+from .normalize import TextNormalizer
+from .sources import DocumentSource, describe, read_bytes
 
 
 class PDFParser:
     """Parse PDF documents and extract structure"""
-    
-    def __init__(self):
-        self.chapter_patterns = [
-            r'^CHƯƠNG\s+(\d+)',  # CHƯƠNG 1
-            r'^Chương\s+(\d+)',   # Chương 1
-            r'^CHƯƠNG\s+(\d+):', # CHƯƠNG 1:
-            r'^Chương\s+(\d+):',  # Chương 1:
-            r'^CHƯƠNG\s+([IVX]+)',  # CHƯƠNG I, II, III
-            r'^BÀI\s+(\d+)',      # BÀI 1
-            r'^Bài\s+(\d+)',      # Bài 1
-        ]
-        import re
-        self.chapter_regex = [re.compile(pattern, re.IGNORECASE) for pattern in self.chapter_patterns]
-    
-    def parse(self, file_path: str) -> Dict:
+
+    def __init__(self, normalize: bool = True, boilerplate_ratio: float = 0.5):
+        """
+        Args:
+            normalize: Clean up page text before it is chunked (see TextNormalizer)
+            boilerplate_ratio: Fraction of the pages a top/bottom line must
+                repeat on to be dropped as a running header or footer
+        """
+        self.normalize = normalize
+        self.boilerplate_ratio = boilerplate_ratio
+        self.heading_detector = HeadingDetector()
+
+    def parse(self, source: DocumentSource) -> Dict:
         """
-        Parse PDF and extract:
+        Parse PDF (path, bytes or binary file object) and extract:
         - Text content
         - Chapters with page numbers
         - Metadata (title, author, etc.)
         """
         try:
-            doc = fitz.open(file_path)
-            logger.info(f"Opened PDF: {file_path}, {len(doc)} pages")
-            
+            if isinstance(source, str):
+                doc = fitz.open(source)
+            else:
+                doc = fitz.open(stream=read_bytes(source), filetype='pdf')
+            logger.info(f"Opened PDF: {describe(source)}, {len(doc)} pages")
+
             # Extract metadata
             metadata = doc.metadata
             title = metadata.get('title', '')
             author = metadata.get('author', '')
-            
-            # Extract text page by page
-            pages_text = []
-            for page_num, page in enumerate(doc, start=1):
-                text = page.get_text()
-                pages_text.append({
-                    'page': page_num,
-                    'text': text,
-                })
-            
-            # Detect chapters
-            chapters = self._detect_chapters(pages_text)
-            
+
+            # Extract text and detect chapters
+            normalizer = TextNormalizer(min_ratio=self.boilerplate_ratio) if self.normalize else None
+            pages_text, chapters = self._extract_pages(doc, normalizer)
+
             # If no chapters detected, treat entire document as one chapter
             if not chapters:
                 logger.warning("No chapters detected, treating as single document")
-                full_text = '\n\n'.join([p['text'] for p in pages_text])
+                full_text = '\n\n'.join(pages_text)
                 chapters = [{
                     'number': None,
                     'title': title or 'Nội dung chính',
@@ -59,10 +55,10 @@ class PDFParser:
                     'end_page': len(pages_text),
                     'content': full_text,
                 }]
-            
+
             doc.close()
-            
-            return {
+
+            result = {
                 'total_pages': len(pages_text),
                 'chapters': chapters,
                 'metadata': {
@@ -73,78 +69,123 @@ class PDFParser:
                 },
                 'file_type': 'pdf',
             }
-            
+            if normalizer is not None:
+                result['normalization'] = normalizer.stats()
+            return result
+
         except Exception as e:
-            logger.error(f"Error parsing PDF {file_path}: {e}")
+            logger.error(f"Error parsing PDF {describe(source)}: {e}")
             raise
-    
-    def _detect_chapters(self, pages_text: List[Dict]) -> List[Dict]:
-        """Detect chapter headers in PDF pages"""
+
+    def _extract_pages(self, doc, normalizer: Optional[TextNormalizer] = None) -> Tuple[List[str], List[Dict]]:
+        """
+        Extract page text and split it into chapters
+
+        Each page is read once as structured text ('dict'), which gives both
+        the plain text and the font size/weight used to recognize headings
+        anywhere on the page. Headings in the middle of a page split that
+        page between the previous and the new chapter.
+
+        With a normalizer, every page's lines are cleaned as they are read,
+        and chapters are assembled once all pages are read, since running
+        headers and footers are only known after counting them on every
+        page. Headings found on such lines don't start chapters. Stats are
+        measured on the text that is chunked: the chapters, or the pages
+        when there are none.
+
+        Returns:
+            Tuple of (text of each page, chapters)
+        """
+        pages = []
+        for page in doc:
+            page_dict = page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT)
+            lines, body_size = self.heading_detector.extract_page_lines(page_dict)
+            headings = self.heading_detector.detect_page_headings(lines, body_size)
+            if normalizer is not None:
+                line_texts = [normalizer.clean_line(line.text) for line in lines]
+                positions = [line.position for line in lines]
+                normalizer.observe(line_texts, positions)
+                raw_sizes = [len(line.text) + 1 for line in lines]  # With its line break
+            else:
+                line_texts = [line.text for line in lines]
+                positions = raw_sizes = None
+            pages.append((line_texts, positions, raw_sizes, headings))
+
         chapters = []
         current_chapter = None
-        
-        for page_data in pages_text:
-            page_num = page_data['page']
-            text = page_data['text']
-            
-            # Check first few lines for chapter header
-            lines = text.split('\n')[:10]  # Check first 10 lines
-            for line in lines:
-                line_clean = line.strip()
-                if not line_clean:
-                    continue
-                
-                # Try to match chapter patterns
-                for regex in self.chapter_regex:
-                    match = regex.match(line_clean)
-                    if match:
-                        chapter_num = match.group(1)
-                        
-                        # Save previous chapter if exists
-                        if current_chapter:
-                            current_chapter['end_page'] = page_num - 1
-                            chapters.append(current_chapter)
-                        
-                        # Extract chapter title (next line or same line)
-                        title = line_clean
-                        if len(lines) > lines.index(line) + 1:
-                            next_line = lines[lines.index(line) + 1].strip()
-                            if next_line and not any(r.match(next_line) for r in self.chapter_regex):
-                                title = f"{line_clean} {next_line}"
-                        
-                        # Start new chapter
-                        current_chapter = {
-                            'number': self._parse_chapter_number(chapter_num),
-                            'title': title,
-                            'start_page': page_num,
-                            'end_page': page_num,  # Will be updated
-                            'content': '',
-                        }
-                        break
-            
-            # Add page text to current chapter
+        current_parts: List[str] = []
+        pages_text = []
+        pages_raw_size = []
+
+        for page_num, (line_texts, positions, raw_sizes, headings) in enumerate(pages, start=1):
+            if normalizer is not None:
+                line_texts = normalizer.strip_boilerplate(line_texts, positions)
+                headings = [heading for heading in headings if line_texts[heading[0]] is not None]
+                pages_text.append(normalizer.join(line_texts))
+                pages_raw_size.append(max(sum(raw_sizes) - 1, 0))
+            else:
+                pages_text.append('\n'.join(line_texts))
+
+            segment_start = 0
+            for line_idx, heading, chapter_title in headings:
+                # Text above the heading belongs to the previous chapter
+                if current_chapter:
+                    segment = self._segment(normalizer, line_texts, raw_sizes, segment_start, line_idx)
+                    if segment.strip():
+                        current_parts.append(segment)
+                        current_chapter['end_page'] = page_num
+                    current_chapter['content'] = '\n\n'.join(current_parts)
+                    chapters.append(current_chapter)
+
+                # Start new chapter
+                current_chapter = {
+                    'number': heading.number,
+                    'title': chapter_title,
+                    'start_page': page_num,
+                    'end_page': page_num,  # Will be updated
+                    'content': '',
+                }
+                current_parts = []
+                segment_start = line_idx
+
+            # Add the rest of the page to the current chapter
             if current_chapter:
-                current_chapter['content'] += '\n\n' + text
-            elif chapters:  # If we have chapters but no current, add to last chapter
-                if chapters:
-                    chapters[-1]['content'] += '\n\n' + text
-        
+                segment = self._segment(normalizer, line_texts, raw_sizes, segment_start, len(line_texts))
+                if segment.strip():
+                    current_parts.append(segment)
+                current_chapter['end_page'] = page_num
+            pages[page_num - 1] = None  # Lines are not needed any more
+
         # Add final chapter
         if current_chapter:
-            current_chapter['end_page'] = pages_text[-1]['page']
+            current_chapter['content'] = '\n\n'.join(current_parts)
             chapters.append(current_chapter)
-        
-        return chapters
-    
-    def _parse_chapter_number(self, num_str: str) -> Optional[int]:
-        """Convert chapter number string to int"""
-        try:
-            # Try direct conversion
-            return int(num_str)
-        except ValueError:
-            # Handle Roman numerals
-            roman_map = {'I': 1, 'II': 2, 'III': 3, 'IV': 4, 'V': 5, 'VI': 6, 'VII': 7, 'VIII': 8, 'IX': 9, 'X': 10}
-            return roman_map.get(num_str.upper())
-        return None
+        elif normalizer is not None:
+            # No chapters: the pages themselves become the document's content
+            for raw_size, page_text in zip(pages_raw_size, pages_text):
+                if page_text.strip():
+                    normalizer.record(raw_size, page_text)
 
+        return pages_text, chapters
 
+    @staticmethod
+    def _segment(
+        normalizer: Optional[TextNormalizer],
+        line_texts: List[Optional[str]],
+        raw_sizes: Optional[List[int]],
+        start: int,
+        end: int,
+    ) -> str:
+        """
+        Text of a page's lines [start:end]
+
+        With a normalizer, the lines are joined without counting rejoins
+        again (the whole page was joined already) and the segment is recorded
+        in the normalization stats, as text that will be chunked.
+        """
+        if normalizer is None:
+            return '\n'.join(line_texts[start:end])
+        text = normalizer.join(line_texts[start:end], count=False)
+        if text.strip():
+            normalizer.record(max(sum(raw_sizes[start:end]) - 1, 0), text)
+        return text
@@ -0,0 +1,115 @@
+"""Document sources accepted by the parsers"""
+import io
+import os
+import zipfile
+from typing import BinaryIO, Optional, Union
+
+# A file path, the raw file bytes, or a seekable binary file object
+DocumentSource = Union[str, bytes, BinaryIO]
+
+PDF = 'pdf'
+DOCX = 'docx'
+EXCEL = 'excel'
+
+CONTENT_TYPES = {
+    'application/pdf': PDF,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': DOCX,
+    'application/msword': DOCX,
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': EXCEL,
+    'application/vnd.ms-excel': EXCEL,
+}
+
+EXTENSIONS = {
+    '.pdf': PDF,
+    '.docx': DOCX,
+    '.doc': DOCX,
+    '.xlsx': EXCEL,
+    '.xls': EXCEL,
+}
+
+
+def as_file(source: DocumentSource) -> Union[str, BinaryIO]:
+    """Path, or a binary file object rewound to the start (bytes are wrapped)"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if not isinstance(source, str):
+        source.seek(0)
+    return source
+
+
+def read_bytes(source: DocumentSource) -> bytes:
+    """Whole content of a source (for readers that need a buffer)"""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    source.seek(0)
+    return source.read()
+
+
+def describe(source: DocumentSource) -> str:
+    """Short label for log messages"""
+    if isinstance(source, str):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        return f"<{len(source)} bytes in memory>"
+    return "<upload stream>"
+
+
+def detect_type(
+    source: DocumentSource,
+    filename: Optional[str] = None,
+    content_type: Optional[str] = None,
+) -> str:
+    """
+    Document kind from the declared content type, then the file extension,
+    then the leading bytes (PDF header or the layout of an OOXML zip)
+
+    Returns:
+        One of PDF, DOCX, EXCEL
+
+    Raises:
+        ValueError: If the type can't be determined or isn't supported
+    """
+    if content_type:
+        kind = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+        if kind:
+            return kind
+
+    name = filename or (source if isinstance(source, str) else '')
+    extension = os.path.splitext(name)[1].lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+
+    kind = _sniff(source)
+    if kind:
+        return kind
+    raise ValueError(f"Unsupported file type: {extension or content_type or 'unknown'}")
+
+
+def _sniff(source: DocumentSource) -> Optional[str]:
+    file = as_file(source)
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            head = f.read(8)
+    else:
+        head = file.read(8)
+        file.seek(0)
+
+    if head.startswith(b'%PDF'):
+        return PDF
+    if head.startswith(b'PK'):
+        try:
+            with zipfile.ZipFile(file) as package:
+                names = package.namelist()
+        except zipfile.BadZipFile:
+            return None
+        finally:
+            if not isinstance(file, str):
+                file.seek(0)
+        if any(name.startswith('word/') for name in names):
+            return DOCX
+        if any(name.startswith('xl/') for name in names):
+            return EXCEL
+    return None
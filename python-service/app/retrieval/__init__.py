@@ -0,0 +1,16 @@
+"""Similarity retrieval over processed chunks"""
+from .subject_index import SearchFilters, SubjectIndex
+from .result_cache import RetrievalCache
+from .service import RetrievalService, get_retrieval_service
+from .clusters import ClusterService, SubjectClusters, get_cluster_service
+
+__all__ = [
+    'SearchFilters',
+    'SubjectIndex',
+    'RetrievalCache',
+    'RetrievalService',
+    'get_retrieval_service',
+    'SubjectClusters',
+    'ClusterService',
+    'get_cluster_service',
+]
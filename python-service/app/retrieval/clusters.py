@@ -0,0 +1,387 @@
+"""Per-subject topic clusters for coverage-balanced chunk sampling"""
+import asyncio
+import copy
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+from app.config import embedding_space, settings
+from .index_store import subject_file_name
+from .subject_index import SubjectIndex, normalize_rows
+
+
+def spherical_kmeans(
+    matrix: np.ndarray,
+    k: int,
+    iterations: int = 20,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    K-means on L2-normalized rows using cosine similarity
+
+    Initialization is k-means++; every Lloyd iteration is one (n x k)
+    similarity product plus one (k x n) @ (n x d) centroid update.
+
+    Returns:
+        Tuple of (normalized float32 centroids (k, d), int32 labels (n,))
+    """
+    n = matrix.shape[0]
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+
+    # k-means++ seeding on cosine distance
+    centroids = np.empty((k, matrix.shape[1]), dtype=np.float32)
+    centroids[0] = matrix[rng.integers(n)]
+    closest = 1.0 - matrix @ centroids[0]
+    for c in range(1, k):
+        weights = np.clip(closest, 0, None) ** 2
+        total = weights.sum()
+        pick = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids[c] = matrix[pick]
+        closest = np.minimum(closest, 1.0 - matrix @ centroids[c])
+
+    labels = np.zeros(n, dtype=np.int32)
+    for iteration in range(iterations):
+        new_labels = np.argmax(matrix @ centroids.T, axis=1).astype(np.int32)
+        if iteration and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        one_hot = np.zeros((k, n), dtype=np.float32)
+        one_hot[labels, np.arange(n)] = 1.0
+        sums = one_hot @ matrix
+        empty = one_hot.sum(axis=1) == 0
+        if empty.any():
+            # Re-seed empty clusters with the points farthest from their centroid
+            fit = np.einsum('ij,ij->i', matrix, centroids[labels])
+            sums[empty] = matrix[np.argsort(fit)[:int(empty.sum())]]
+        centroids = normalize_rows(sums)
+
+    return centroids, labels
+
+
+class SubjectClusters:
+    """
+    Cluster assignments and centroids of one subject's chunks
+
+    Rows are kept in parallel arrays. Per-cluster sampling orders (chunks of
+    each chapter interleaved round-robin) are precomputed, so drawing N
+    samples costs O(N) regardless of subject size.
+    """
+
+    def __init__(
+        self,
+        subject_id: str,
+        centroids: np.ndarray,
+        counts: np.ndarray,
+        chunk_ids: np.ndarray,
+        document_ids: np.ndarray,
+        chapters: np.ndarray,
+        labels: np.ndarray,
+        scores: np.ndarray,
+        built_rows: int,
+        generation: int = 0,
+        space: Optional[str] = None,
+    ):
+        self.subject_id = subject_id
+        self.centroids = centroids      # (k, d) float32, normalized
+        self.counts = counts            # (k,) int64 rows assigned per centroid
+        self.chunk_ids = chunk_ids      # (n,) str
+        self.document_ids = document_ids  # (n,) str
+        self.chapters = chapters        # (n,) int32, -1 when unknown
+        self.labels = labels            # (n,) int32 cluster per row
+        self.scores = scores            # (n,) float32 similarity to own centroid
+        self.built_rows = built_rows    # Rows at the last full build
+        self.generation = generation    # Index generation the clusters reflect
+        self.space = space              # Embedding space of the centroids (None: not recorded)
+        self.tombstones = 0             # ... and its tombstoned documents (not persisted)
+        self._orders: List[np.ndarray] = []
+        self._build_orders()
+
+    @classmethod
+    def build(cls, index: SubjectIndex, max_k: int, iterations: int, space: Optional[str] = None) -> 'SubjectClusters':
+        """Full k-means over a subject index (tombstoned rows left out)"""
+        tombstones = index.tombstones
+        if index.dead_rows:
+            index = index.compacted()
+        n = index.size
+        k = int(np.clip(round(np.sqrt(n / 2)), 1, max_k)) if n else 0
+        if n:
+            centroids, labels = spherical_kmeans(index.matrix, k, iterations)
+            scores = np.einsum('ij,ij->i', index.matrix, centroids[labels]).astype(np.float32)
+            counts = np.bincount(labels, minlength=centroids.shape[0]).astype(np.int64)
+        else:
+            centroids = np.zeros((0, 0), dtype=np.float32)
+            labels = np.zeros(0, dtype=np.int32)
+            scores = np.zeros(0, dtype=np.float32)
+            counts = np.zeros(0, dtype=np.int64)
+
+        clusters = cls(
+            subject_id=index.subject_id,
+            centroids=centroids,
+            counts=counts,
+            chunk_ids=np.asarray(index.chunk_ids, dtype=str),
+            document_ids=np.asarray(index.document_ids, dtype=str)[index.row_documents] if n else np.zeros(0, dtype=str),
+            chapters=np.array(index.chapter_numbers, dtype=np.int32),
+            labels=labels,
+            scores=scores,
+            built_rows=n,
+            generation=index.generation,
+            space=space,
+        )
+        clusters.tombstones = tombstones
+        return clusters
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    def sync(self, index: SubjectIndex):
+        """
+        Bring the clusters in line with an index generation without re-clustering
+
+        Rows whose chunk is gone from the index (or tombstoned) are dropped;
+        new chunks are assigned to their nearest centroid and centroids
+        updated by running mean.
+        """
+        live = index.live_mask()
+        live_rows = range(index.size) if live is None else np.flatnonzero(live).tolist()
+        indexed = {index.chunk_ids[row] for row in live_rows}
+        keep = np.fromiter((chunk_id in indexed for chunk_id in self.chunk_ids), dtype=bool, count=self.size)
+        if not keep.all():
+            self._remove_rows(keep)
+
+        known = set(self.chunk_ids.tolist())
+        new_rows = np.fromiter(
+            (row for row in live_rows if index.chunk_ids[row] not in known), dtype=np.int64
+        )
+        if len(new_rows):
+            self._add_rows(index, new_rows)
+        self.generation = index.generation
+        self.tombstones = index.tombstones
+        self._build_orders()
+
+    def _add_rows(self, index: SubjectIndex, rows: np.ndarray):
+        matrix = np.asarray(index.matrix[rows], dtype=np.float32)
+        similarities = matrix @ self.centroids.T
+        labels = np.argmax(similarities, axis=1).astype(np.int32)
+        scores = similarities[np.arange(len(rows)), labels].astype(np.float32)
+
+        # Running mean of the (normalized) members, renormalized
+        k = self.centroids.shape[0]
+        one_hot = np.zeros((k, len(rows)), dtype=np.float32)
+        one_hot[labels, np.arange(len(rows))] = 1.0
+        sums = self.centroids * self.counts[:, None].astype(np.float32) + one_hot @ matrix
+        self.centroids = normalize_rows(sums)
+        self.counts = self.counts + np.bincount(labels, minlength=k)
+
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.asarray(index.chunk_ids, dtype=str)[rows]])
+        self.document_ids = np.concatenate([
+            self.document_ids, np.asarray(index.document_ids, dtype=str)[index.row_documents[rows]]
+        ])
+        self.chapters = np.concatenate([self.chapters, index.chapter_numbers[rows]])
+        self.labels = np.concatenate([self.labels, labels])
+        self.scores = np.concatenate([self.scores, scores])
+
+    def _remove_rows(self, keep: np.ndarray):
+        self.counts = self.counts - np.bincount(self.labels[~keep], minlength=self.counts.shape[0])
+        for name in ('chunk_ids', 'document_ids', 'chapters', 'labels', 'scores'):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def sample(self, n: int, seed: Optional[int] = None) -> List[Tuple[str, int, float]]:
+        """
+        Draw up to n chunks spread evenly across clusters (and chapters within them)
+
+        Returns:
+            List of (chunk ID, cluster, similarity to centroid)
+        """
+        orders = [order for order in self._orders if len(order)]
+        if not orders or n <= 0:
+            return []
+
+        rng = np.random.default_rng(seed)
+        rotation = int(rng.integers(len(orders)))
+        orders = orders[rotation:] + orders[:rotation]
+        offsets = [int(rng.integers(len(order))) for order in orders]
+        taken = [0] * len(orders)
+
+        picked = []
+        n = min(n, self.size)
+        while len(picked) < n:
+            for c, order in enumerate(orders):
+                if taken[c] < len(order) and len(picked) < n:
+                    picked.append(order[(offsets[c] + taken[c]) % len(order)])
+                    taken[c] += 1
+
+        return [(str(self.chunk_ids[i]), int(self.labels[i]), float(self.scores[i])) for i in picked]
+
+    def save(self, path: str):
+        """Persist atomically (write to a temp file, then rename)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez(
+            temp_path,
+            subject_id=np.asarray(self.subject_id),
+            centroids=self.centroids,
+            counts=self.counts,
+            chunk_ids=self.chunk_ids,
+            document_ids=self.document_ids,
+            chapters=self.chapters,
+            labels=self.labels,
+            scores=self.scores,
+            built_rows=np.asarray(self.built_rows),
+            generation=np.asarray(self.generation),
+            space=np.asarray(self.space or ''),
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SubjectClusters':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                subject_id=str(data['subject_id']),
+                centroids=data['centroids'],
+                counts=data['counts'],
+                chunk_ids=data['chunk_ids'],
+                document_ids=data['document_ids'],
+                chapters=data['chapters'],
+                labels=data['labels'],
+                scores=data['scores'],
+                built_rows=int(data['built_rows']),
+                generation=int(data['generation']) if 'generation' in data else 0,
+                space=(str(data['space']) or None) if 'space' in data else None,
+            )
+
+    def _build_orders(self):
+        """Per cluster: row indices with chapters interleaved round-robin"""
+        k = self.centroids.shape[0]
+        rng = np.random.default_rng(0)
+        orders = []
+        for c in range(k):
+            rows = np.flatnonzero(self.labels == c)
+            if not len(rows):
+                orders.append(rows)
+                continue
+            rows = rows[rng.permutation(len(rows))]
+            by_chapter: Dict[int, List[int]] = {}
+            for row in rows:
+                by_chapter.setdefault(int(self.chapters[row]), []).append(int(row))
+            groups = list(by_chapter.values())
+            interleaved = [
+                group[i]
+                for i in range(max(len(group) for group in groups))
+                for group in groups
+                if i < len(group)
+            ]
+            orders.append(np.asarray(interleaved, dtype=np.int64))
+        self._orders = orders
+
+
+class ClusterService:
+    """
+    Keeps per-subject clusters in line with the subject index and serves
+    balanced samples
+
+    Clusters are built on first use (or loaded from INDEX_DIR) and, whenever
+    the index has moved to a new generation, synced with it incrementally;
+    a full re-clustering happens once a subject has grown by
+    CLUSTER_REBUILD_GROWTH since the last build.
+    """
+
+    def __init__(self, retrieval):
+        self.retrieval = retrieval
+        self.directory = os.path.join(settings.INDEX_DIR, 'clusters')
+        self._clusters: Dict[str, SubjectClusters] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def sample(
+        self,
+        subject_id: str,
+        n: int,
+        seed: Optional[int] = None,
+        include_content: bool = True,
+    ) -> Dict:
+        """
+        Up to n chunks of a subject spread across its topic clusters
+
+        Returns:
+            Dict with 'clusters' (count) and 'results' (id, cluster, score
+            = similarity to the cluster centroid and, optionally, content)
+        """
+        clusters = await self.get(subject_id)
+        sampled = clusters.sample(n, seed)
+        cluster_of = {chunk_id: cluster for chunk_id, cluster, _ in sampled}
+        results = await self.retrieval._hydrate(
+            [(chunk_id, score) for chunk_id, _, score in sampled], include_content
+        )
+        for result in results:
+            result['cluster'] = cluster_of[result['id']]
+        return {
+            'subject_id': subject_id,
+            'clusters': int(clusters.centroids.shape[0]),
+            'results': results,
+        }
+
+    async def get(self, subject_id: str) -> SubjectClusters:
+        """Clusters of a subject, synced with its current index generation"""
+        index = await self.retrieval.get_index(subject_id)
+        lock = self._locks.setdefault(subject_id, asyncio.Lock())
+        async with lock:
+            clusters = self._clusters.get(subject_id)
+            if clusters is None:
+                clusters = await asyncio.to_thread(self._load, subject_id)
+            if clusters is None or (clusters.generation, clusters.tombstones) != index.version:
+                clusters = await asyncio.to_thread(self._sync, subject_id, clusters, index)
+            self._clusters[subject_id] = clusters
+            return clusters
+
+    def _load(self, subject_id: str) -> Optional[SubjectClusters]:
+        path = self._path(subject_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            return SubjectClusters.load(path)
+        except Exception as e:
+            logger.warning(f"⚠️ [CLUSTERS] Could not load {path}: {e}")
+            return None
+
+    def _sync(self, subject_id: str, clusters: Optional[SubjectClusters], index: SubjectIndex) -> SubjectClusters:
+        """Incremental update when possible, full build otherwise (runs in a thread)"""
+        space = embedding_space()
+        if (
+            clusters is not None
+            and clusters.centroids.shape[0]
+            and clusters.centroids.shape[1] == index.dimensions
+            and clusters.space in (None, space)
+        ):
+            # Work on a copy: requests may be sampling the current object meanwhile
+            clusters = copy.copy(clusters)
+            clusters.sync(index)
+            clusters.space = space
+            if clusters.size <= clusters.built_rows * settings.CLUSTER_REBUILD_GROWTH:
+                clusters.save(self._path(subject_id))
+                return clusters
+
+        clusters = SubjectClusters.build(index, settings.CLUSTER_MAX_K, settings.CLUSTER_ITERATIONS, space)
+        clusters.save(self._path(subject_id))
+        logger.info(
+            f"🧭 [CLUSTERS] Built {clusters.centroids.shape[0]} clusters over "
+            f"{clusters.size} chunks for subject {subject_id}"
+        )
+        return clusters
+
+    def _path(self, subject_id: str) -> str:
+        return os.path.join(self.directory, f"{subject_file_name(subject_id)}.npz")
+
+
+_cluster_service: Optional[ClusterService] = None
+
+
+def get_cluster_service() -> ClusterService:
+    """Process-wide cluster service"""
+    global _cluster_service
+    if _cluster_service is None:
+        from .service import get_retrieval_service
+
+        _cluster_service = ClusterService(get_retrieval_service())
+    return _cluster_service
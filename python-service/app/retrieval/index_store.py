@@ -0,0 +1,271 @@
+"""On-disk subject indexes shared read-only by worker processes"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+import numpy as np
+from loguru import logger
+from app.config import embedding_space, settings
+from .subject_index import SubjectIndex
+
+CURRENT = 'CURRENT'
+MANIFEST = 'manifest.json'
+LOCK = 'writer.lock'
+
+
+class IndexStore:
+    """
+    Immutable, memory-mapped generations of each subject's index
+
+    Layout per subject:
+
+        <directory>/<subject>/CURRENT          generation number, replaced atomically
+        <directory>/<subject>/writer.lock      flock held while publishing
+        <directory>/<subject>/gen-000042/      one immutable generation:
+            manifest.json                      IDs, document types, shape, embedding space
+            matrix.npy                         (rows, dims) float32, L2-normalized
+            row_documents.npy, chapters.npy    int32 per row
+        <directory>/<subject>/tombstones-000042  document IDs removed from that
+                                               generation, one per line (append-only)
+
+    Readers never lock: they read CURRENT and memory-map that generation's
+    arrays, so every worker shares the same page-cache copy of the vectors.
+    Publishing is serialized per subject by an exclusive file lock; a new
+    generation is fully written under a temporary name before CURRENT is
+    switched to it. Old generations are removed after publishing; workers
+    still mapping them keep valid mappings until they reopen.
+
+    Removing documents doesn't rewrite a generation: their IDs are appended
+    to its tombstone log, which readers apply to their open index (see
+    refresh_tombstones). Publishing writes only live rows, so the next
+    generation (a merge or a compaction) starts with an empty log.
+
+    A generation built in another embedding space (before a model or size
+    change) is treated as missing, so the subject is rebuilt in the new one.
+    """
+
+    def __init__(self, directory: str, keep_generations: int = 2, space: Optional[str] = None):
+        """
+        Args:
+            directory: Root directory of the store
+            keep_generations: Generations kept on disk per subject (>= 1)
+            space: Embedding space of the vectors (see app.config.embedding_space)
+        """
+        self.directory = directory
+        self.keep_generations = max(keep_generations, 1)
+        self.space = space
+        os.makedirs(directory, exist_ok=True)
+
+    def current_generation(self, subject_id: str) -> Optional[int]:
+        """Published generation of a subject, or None if it was never published"""
+        try:
+            with open(os.path.join(self._subject_dir(subject_id), CURRENT)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def open(self, subject_id: str) -> Optional[SubjectIndex]:
+        """Memory-map the current generation of a subject (None if there is none in this space)"""
+        for _ in range(3):
+            generation = self.current_generation(subject_id)
+            if generation is None:
+                return None
+            try:
+                return self._open_generation(subject_id, generation)
+            except FileNotFoundError:
+                # Pruned between reading CURRENT and opening it: read CURRENT again
+                continue
+        return None
+
+    def tombstone(
+        self,
+        subject_id: str,
+        document_ids: Iterable[str],
+        generation: Optional[int] = None,
+    ) -> Optional[int]:
+        """
+        Append documents to the current generation's tombstone log
+
+        Must be called inside `writer(subject_id)`, so no generation is
+        published meanwhile and no entry is lost.
+
+        Args:
+            subject_id: Subject ID
+            document_ids: Documents to hide
+            generation: Only if this is still the current generation
+
+        Returns:
+            The generation the documents were tombstoned in (None if nothing was written)
+        """
+        current = self.current_generation(subject_id)
+        if current is None or (generation is not None and generation != current):
+            return None
+        generation = current
+        lines = ''.join(f'{document_id}\n' for document_id in document_ids)
+        with open(self._tombstone_path(subject_id, generation), 'a', encoding='utf-8') as f:
+            f.write(lines)
+        return generation
+
+    def refresh_tombstones(self, index: SubjectIndex) -> int:
+        """
+        Apply tombstones logged since the index was opened or last refreshed
+
+        One stat() when nothing changed; otherwise only the new part of the
+        log is read.
+
+        Returns:
+            Number of rows hidden
+        """
+        path = self._tombstone_path(index.subject_id, index.generation)
+        try:
+            if os.stat(path).st_size <= index.tombstone_offset:
+                return 0
+            with open(path, 'rb') as f:
+                f.seek(index.tombstone_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        complete = data[:data.rfind(b'\n') + 1]  # A line being appended right now waits for the next call
+        index.tombstone_offset += len(complete)
+        return index.tombstone(complete.decode('utf-8').split())
+
+    @contextmanager
+    def writer(self, subject_id: str) -> Iterator[None]:
+        """Exclusive, cross-process right to publish a subject's next generation"""
+        subject_dir = self._subject_dir(subject_id)
+        os.makedirs(subject_dir, exist_ok=True)
+        with open(os.path.join(subject_dir, LOCK), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, index: SubjectIndex) -> SubjectIndex:
+        """
+        Write an index as the subject's next generation and make it current
+
+        Must be called inside `writer(index.subject_id)`. Tombstoned rows are
+        left out.
+
+        Returns:
+            The published index, memory-mapped from the store
+        """
+        if index.dead_rows:
+            index = index.compacted()
+        subject_id = index.subject_id
+        subject_dir = self._subject_dir(subject_id)
+        generation = (self.current_generation(subject_id) or 0) + 1
+
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=subject_dir)
+        try:
+            dims = index.dimensions
+            np.save(os.path.join(staging, 'matrix.npy'), np.ascontiguousarray(index.matrix, dtype=np.float32))
+            np.save(os.path.join(staging, 'row_documents.npy'), np.asarray(index.row_documents, dtype=np.int32))
+            np.save(os.path.join(staging, 'chapters.npy'), np.asarray(index.chapter_numbers, dtype=np.int32))
+            with open(os.path.join(staging, MANIFEST), 'w') as f:
+                json.dump({
+                    'subject_id': subject_id,
+                    'generation': generation,
+                    'created_at': time.time(),
+                    'rows': index.size,
+                    'dims': dims,
+                    'space': self.space,
+                    'chunk_ids': list(index.chunk_ids),
+                    'document_ids': list(index.document_ids),
+                    'document_types': list(index.document_types),
+                }, f)
+            os.rename(staging, os.path.join(subject_dir, _generation_name(generation)))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        pointer = os.path.join(subject_dir, f'.{CURRENT}.{os.getpid()}')
+        with open(pointer, 'w') as f:
+            f.write(f'{generation}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer, os.path.join(subject_dir, CURRENT))
+
+        self._prune(subject_id, generation)
+        logger.info(f"📦 [INDEX] Published generation {generation} of subject {subject_id}: {index.size} chunks")
+        return self._open_generation(subject_id, generation)
+
+    def _open_generation(self, subject_id: str, generation: int) -> Optional[SubjectIndex]:
+        path = os.path.join(self._subject_dir(subject_id), _generation_name(generation))
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get('space', self.space) != self.space:
+            return None  # Generations published before spaces were recorded are taken as current
+
+        if manifest['rows'] == 0:
+            # Nothing to map
+            matrix = np.zeros((0, manifest['dims']), dtype=np.float32)
+            row_documents = np.zeros(0, dtype=np.int32)
+            chapters = np.zeros(0, dtype=np.int32)
+        else:
+            matrix = np.load(os.path.join(path, 'matrix.npy'), mmap_mode='r')
+            row_documents = np.load(os.path.join(path, 'row_documents.npy'), mmap_mode='r')
+            chapters = np.load(os.path.join(path, 'chapters.npy'), mmap_mode='r')
+
+        index = SubjectIndex(
+            subject_id=subject_id,
+            chunk_ids=manifest['chunk_ids'],
+            row_documents=row_documents,
+            document_ids=manifest['document_ids'],
+            document_types=manifest['document_types'],
+            chapter_numbers=chapters,
+            matrix=matrix,
+            generation=generation,
+        )
+        self.refresh_tombstones(index)
+        return index
+
+    def _prune(self, subject_id: str, current: int):
+        subject_dir = self._subject_dir(subject_id)
+        for name in os.listdir(subject_dir):
+            match = re.fullmatch(r'(gen|tombstones)-(\d+)', name)
+            if match and int(match.group(2)) <= current - self.keep_generations:
+                path = os.path.join(subject_dir, name)
+                if match.group(1) == 'gen':
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+
+    def _tombstone_path(self, subject_id: str, generation: int) -> str:
+        return os.path.join(self._subject_dir(subject_id), f'tombstones-{generation:06d}')
+
+    def _subject_dir(self, subject_id: str) -> str:
+        return os.path.join(self.directory, subject_file_name(subject_id))
+
+
+def subject_file_name(subject_id: str) -> str:
+    """
+    File name for a subject's on-disk data: a readable prefix plus a hash of the ID
+
+    The hash keeps IDs that differ only in unsafe characters ("a/b", "a_b")
+    apart, and no ID ("..", "/") can name a path outside the directory.
+    """
+    prefix = re.sub(r'[^A-Za-z0-9_-]', '_', subject_id)[:40]
+    return f"{prefix}-{hashlib.sha256(subject_id.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _generation_name(generation: int) -> str:
+    return f'gen-{generation:06d}'
+
+
+_index_store: Optional[IndexStore] = None
+
+
+def get_index_store() -> IndexStore:
+    """Process-wide store of subject indexes under INDEX_DIR"""
+    global _index_store
+    if _index_store is None:
+        _index_store = IndexStore(os.path.join(settings.INDEX_DIR, 'subjects'), space=embedding_space())
+    return _index_store
@@ -0,0 +1,75 @@
+"""Maximal Marginal Relevance: relevant chunks that don't repeat each other"""
+from typing import List, Optional
+import numpy as np
+
+
+def mmr_select(
+    candidates: np.ndarray,
+    relevance: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+    chapters: Optional[np.ndarray] = None,
+    chapter_quota: Optional[int] = None,
+) -> List[int]:
+    """
+    Pick k candidates, each maximizing
+    lambda_mult * relevance - (1 - lambda_mult) * (max similarity to those already picked)
+
+    The candidate Gram matrix is built column by column: each pick adds one
+    (n,) similarity column (one matrix-vector product) and updates every
+    candidate's running max-similarity with one vectorized maximum, so a
+    selection costs k products instead of the n x n x d full Gram.
+
+    Args:
+        candidates: (n, dims) L2-normalized candidate vectors
+        relevance: (n,) similarity of each candidate to the query
+        k: Number of picks
+        lambda_mult: 1 = plain relevance order, 0 = maximum diversity
+        chapters: (n,) int chapter number per candidate (-1 = unknown)
+        chapter_quota: At most this many picks per known chapter
+
+    Returns:
+        Positions into `candidates`, in pick order
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    candidates = np.asarray(candidates, dtype=np.float32)
+    weighted = lambda_mult * np.asarray(relevance, dtype=np.float32)
+    max_similarity = None
+    available = np.ones(n, dtype=bool)
+    quota_left = {}
+    if chapter_quota is not None and chapters is not None:
+        chapters = np.asarray(chapters)
+        quota_left = {chapter: chapter_quota for chapter in np.unique(chapters).tolist() if chapter >= 0}
+
+    picks: List[int] = []
+    while len(picks) < k:
+        if max_similarity is None:
+            scores = weighted.copy()
+        else:
+            scores = weighted - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        if not available[pick]:
+            break  # Everything left is excluded by the quotas
+        picks.append(pick)
+        available[pick] = False
+
+        if quota_left:
+            chapter = int(chapters[pick])
+            if chapter in quota_left:
+                quota_left[chapter] -= 1
+                if quota_left[chapter] == 0:
+                    available &= chapters != chapter
+
+        # Next column of the Gram matrix, folded into the running maximum
+        column = candidates @ candidates[pick]
+        if max_similarity is None:
+            max_similarity = column
+        else:
+            np.maximum(max_similarity, column, out=max_similarity)
+
+    return picks
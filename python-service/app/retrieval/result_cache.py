@@ -0,0 +1,112 @@
+"""Cache of ranked retrieval results, invalidated per subject"""
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+# (chunk IDs, scores) in rank order
+CachedResult = Tuple[Tuple[str, ...], Tuple[float, ...]]
+
+
+class RetrievalCache:
+    """
+    LRU cache of ranked chunk IDs and scores
+
+    Keys start with the subject ID; a per-subject key set lets a completed or
+    deleted document drop exactly that subject's entries. Memory is bounded
+    by an entry count and an estimated byte size.
+    """
+
+    # Rough per-entry overhead: tuples, floats, key and bookkeeping
+    ENTRY_OVERHEAD = 200
+    PER_RESULT = 120
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: 'OrderedDict[Tuple, Tuple[CachedResult, float, int]]' = OrderedDict()
+        self._by_subject: Dict[str, Set[Tuple]] = {}
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(
+        subject_id: str,
+        version: Hashable,
+        query_key: str,
+        k: int,
+        filters_key: Hashable,
+        mode: str = 'similarity',
+    ) -> Tuple:
+        """
+        Key of a ranking; including the index version (generation and
+        tombstones) keeps workers from serving stale results
+        """
+        return (subject_id, version, query_key, k, filters_key, mode)
+
+    def get(self, key: Tuple) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self._stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats['hits'] += 1
+        return entry[0]
+
+    def put(self, key: Tuple, results: List[Tuple[str, float]]):
+        if key in self._entries:
+            self._remove(key)
+
+        value: CachedResult = (
+            tuple(chunk_id for chunk_id, _ in results),
+            tuple(score for _, score in results),
+        )
+        size = self.ENTRY_OVERHEAD + self.PER_RESULT * len(results)
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+        self._by_subject.setdefault(key[0], set()).add(key)
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self._stats['evictions'] += 1
+
+    def invalidate_subject(self, subject_id: Optional[str]) -> int:
+        """Drop every entry of a subject (all entries when subject_id is None)"""
+        if subject_id is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._by_subject.clear()
+            self._bytes = 0
+        else:
+            keys = self._by_subject.pop(subject_id, set())
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[2]
+            removed = len(keys)
+        if removed:
+            self._stats['invalidations'] += removed
+        return removed
+
+    def stats(self) -> Dict:
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[2]
+        subject_keys = self._by_subject.get(key[0])
+        if subject_keys is not None:
+            subject_keys.discard(key)
+            if not subject_keys:
+                del self._by_subject[key[0]]
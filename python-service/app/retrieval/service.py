@@ -0,0 +1,493 @@
+"""Retrieval over a subject's chunks with cached results"""
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Sequence, Set, Union
+import numpy as np
+from loguru import logger
+from app.config import settings
+from app.database.client import get_database_client
+from app.embeddings import get_query_cache
+from app.events import DOCUMENT_DELETED, subscribe_subject_changes
+from .index_store import get_index_store
+from .result_cache import RetrievalCache
+from .subject_index import SearchFilters, SubjectIndex
+
+
+class RetrievalService:
+    """
+    Search a subject's chunks by similarity
+
+    Subject indexes live in a shared on-disk store (see IndexStore): each
+    worker memory-maps the current generation, and reloads when another
+    worker publishes a new one. Ranked results are cached per (subject,
+    index version, query, k, filters), so a new generation or tombstone
+    makes older entries unreachable in every worker.
+
+    When a document is deleted in this worker, it is tombstoned: hidden in
+    this worker at once and, through the store's tombstone log, in the
+    others on their next search. When a document completes, only its rows
+    are loaded from MySQL and merged into a new generation; a re-processed
+    document is tombstoned first, so no worker serves its old rows while the
+    merge runs. Once INDEX_COMPACTION_THRESHOLD of a subject's rows are
+    tombstoned, a background task rewrites the index without them.
+    """
+
+    def __init__(self):
+        self.db = get_database_client()
+        self.query_cache = get_query_cache()
+        self.store = get_index_store()
+        self.cache = RetrievalCache(
+            max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+            max_bytes=settings.RETRIEVAL_CACHE_MAX_BYTES,
+            ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+        )
+        self._indexes: Dict[str, SubjectIndex] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._stale: Set[str] = set()  # Changed here since last published: rebuild
+        self._completed: Dict[str, Set[str]] = {}  # Documents completed here since last published: merge
+        self._compacting: Set[str] = set()
+        self._verified: Set[str] = set()  # Store checked against MySQL by this process
+        subscribe_subject_changes(self._on_subject_change)
+
+    async def search(
+        self,
+        subject_id: str,
+        k: int,
+        query: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+        filters: Optional[SearchFilters] = None,
+        include_content: bool = True,
+        mode: str = 'similarity',
+        mmr_lambda: float = 0.5,
+        fetch_k: Optional[int] = None,
+        chapter_quota: Optional[int] = None,
+    ) -> Dict:
+        """
+        Top-k chunks of a subject for a query text or vector
+
+        With mode='mmr', the k results are picked from the top `fetch_k` by
+        Maximal Marginal Relevance, so near-duplicate chunks (e.g. overlapping
+        neighbours) don't crowd out other material; `chapter_quota` caps the
+        results per chapter.
+
+        Returns:
+            Dict with 'results' (id, score and, optionally, content/metadata)
+            and 'cached' (whether the ranking came from the result cache)
+        """
+        filters = filters or SearchFilters()
+        index = await self.get_index(subject_id)
+        if mode == 'mmr':
+            fetch_k = min(fetch_k or settings.RETRIEVAL_MMR_FETCH_K, settings.RETRIEVAL_MMR_MAX_FETCH_K)
+            mode_key = f'mmr:{mmr_lambda}:{fetch_k}:{chapter_quota}'
+        elif mode == 'similarity':
+            mode_key = mode
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+        cache_key = RetrievalCache.make_key(
+            subject_id, index.version, self._query_key(query, query_embedding), k, filters.cache_key(), mode_key
+        )
+
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            ranked = list(zip(*cached))
+        else:
+            if query is not None:
+                vector = await self.query_cache.get(query)
+            else:
+                vector = np.asarray(query_embedding, dtype=np.float32)
+            if mode == 'mmr':
+                ranked = index.search_mmr(
+                    vector, k, filters, fetch_k=fetch_k, lambda_mult=mmr_lambda, chapter_quota=chapter_quota
+                )
+            else:
+                ranked = index.search(vector, k, filters)
+            self.cache.put(cache_key, ranked)
+
+        return {
+            'subject_id': subject_id,
+            'cached': cached is not None,
+            'results': await self._hydrate(ranked, include_content),
+        }
+
+    async def search_batch(
+        self,
+        subject_id: str,
+        k: int,
+        queries: Sequence[Union[str, List[float]]],
+        filters: Optional[SearchFilters] = None,
+        include_content: bool = True,
+        dedupe: bool = False,
+    ) -> Dict:
+        """
+        Top-k chunks of a subject for each of several query texts or vectors
+
+        Rankings are shared with `search` through the result cache. The
+        remaining query texts are embedded with one call and every remaining
+        query is scored in a single (Q, N) matrix product; content for all
+        results is fetched with one query.
+
+        With `dedupe`, a chunk is returned for one query only: the one it
+        scores highest for (the earlier query on ties). Each query still
+        gets up to k results, from its top k * Q.
+
+        Args:
+            subject_id: Subject ID
+            k: Results per query
+            queries: Query texts and/or query vectors
+            filters: Optional restrictions, shared by every query
+            include_content: Add chunk content and metadata
+            dedupe: Never return a chunk for more than one query
+
+        Returns:
+            Dict with 'results' (one list per query, in order) and 'cached'
+            (per query, whether its ranking came from the result cache)
+        """
+        filters = filters or SearchFilters()
+        index = await self.get_index(subject_id)
+        fetch_k = k * len(queries) if dedupe else k
+        keys = [
+            RetrievalCache.make_key(
+                subject_id,
+                index.version,
+                self._query_key(query, None) if isinstance(query, str) else self._query_key(None, query),
+                fetch_k,
+                filters.cache_key(),
+            )
+            for query in queries
+        ]
+
+        cached = [self.cache.get(key) for key in keys]
+        rankings = [list(zip(*entry)) if entry is not None else None for entry in cached]
+        missing = [i for i, ranking in enumerate(rankings) if ranking is None]
+        if missing:
+            texts = [queries[i] for i in missing if isinstance(queries[i], str)]
+            embedded = iter(await self.query_cache.get_many(texts) if texts else [])
+            vectors = [
+                next(embedded) if isinstance(queries[i], str) else np.asarray(queries[i], dtype=np.float32)
+                for i in missing
+            ]
+            if len({vector.shape for vector in vectors}) > 1:
+                raise ValueError("Query vectors have different dimensions")
+            for i, ranked in zip(missing, index.search_batch(np.vstack(vectors), fetch_k, filters)):
+                self.cache.put(keys[i], ranked)
+                rankings[i] = ranked
+
+        if dedupe:
+            rankings = _dedupe(rankings, k)
+        return {
+            'subject_id': subject_id,
+            'cached': [entry is not None for entry in cached],
+            'results': await self._hydrate_many(rankings, include_content),
+        }
+
+    async def get_index(self, subject_id: str) -> SubjectIndex:
+        """Current index of a subject (concurrent loads of one subject are shared)"""
+        index = self._indexes.get(subject_id)
+        if (
+            index is not None
+            and subject_id not in self._stale
+            and subject_id not in self._completed
+            and index.generation == self.store.current_generation(subject_id)
+        ):
+            if self.store.refresh_tombstones(index):
+                self._maybe_compact(index)
+            return index
+
+        pending = self._loading.get(subject_id)
+        if pending is not None:
+            return await pending
+        return await self._load(subject_id)
+
+    def stats(self) -> Dict:
+        return {
+            'result_cache': self.cache.stats(),
+            'indexes': {
+                subject_id: {
+                    'chunks': index.live_size,
+                    'tombstoned': index.dead_rows,
+                    'generation': index.generation,
+                }
+                for subject_id, index in self._indexes.items()
+            },
+        }
+
+    async def _load(self, subject_id: str) -> SubjectIndex:
+        future = asyncio.get_running_loop().create_future()
+        self._loading[subject_id] = future
+        rebuild = subject_id in self._stale
+        documents = self._completed.pop(subject_id, set())
+        self._stale.discard(subject_id)  # Changes from here on mark it again
+        try:
+            index = await asyncio.to_thread(self._open_or_build, subject_id, rebuild, documents)
+            # Only keep it if no change arrived while loading
+            if subject_id not in self._stale and subject_id not in self._completed:
+                self._indexes[subject_id] = index
+            logger.info(
+                f"📚 [RETRIEVAL] Loaded index for subject {subject_id}: "
+                f"{index.live_size} chunks, generation {index.generation}"
+            )
+            self._maybe_compact(index)
+            future.set_result(index)
+            return index
+        except BaseException as e:
+            # Keep the pending work for the next attempt
+            if rebuild:
+                self._stale.add(subject_id)
+            if documents:
+                self._completed.setdefault(subject_id, set()).update(documents)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        finally:
+            if self._loading.get(subject_id) is future:
+                del self._loading[subject_id]
+
+    def _open_or_build(self, subject_id: str, rebuild: bool, documents: Set[str] = frozenset()) -> SubjectIndex:
+        """
+        Map the published index, merge completed documents into it, or
+        rebuild it from MySQL, and publish the result
+
+        A published index is checked against the database once per process
+        (chunk count), which catches changes made while no worker was running;
+        so is every merge.
+
+        Args:
+            subject_id: Subject ID
+            rebuild: Reload the whole subject from MySQL
+            documents: Completed documents whose rows must be (re)loaded
+        """
+        if not rebuild and not documents:
+            index = self.store.open(subject_id)
+            if index is not None and (
+                subject_id in self._verified
+                or index.live_size == self.db.count_subject_chunks(subject_id)
+            ):
+                self._verified.add(subject_id)
+                return index
+
+        with self.store.writer(subject_id):
+            if not rebuild:
+                # Another worker may have published while we waited for the lock
+                index = self.store.open(subject_id)
+                expected = self.db.count_subject_chunks(subject_id)
+                if index is not None and documents:
+                    index.tombstone(documents)  # Also drops documents that no longer have rows
+                    addition = SubjectIndex.from_rows(
+                        subject_id, self.db.load_subject_embeddings(subject_id, sorted(documents))
+                    )
+                    merged = index.with_documents(addition)
+                    if merged.size == expected:
+                        self._verified.add(subject_id)
+                        return self.store.publish(merged)
+                    logger.info(f"📚 [RETRIEVAL] Index of subject {subject_id} was out of date: rebuilding")
+                elif index is not None and index.live_size == expected:
+                    self._verified.add(subject_id)
+                    return index
+            rows = self.db.load_subject_embeddings(subject_id)
+            index = self.store.publish(SubjectIndex.from_rows(subject_id, rows))
+
+        self._verified.add(subject_id)
+        return index
+
+    async def _refresh(
+        self,
+        subject_id: str,
+        replaced: Optional[SubjectIndex] = None,
+        document_id: Optional[str] = None,
+    ):
+        """
+        Rebuild or merge and publish a changed subject so other workers pick it up
+
+        Args:
+            subject_id: Subject ID
+            replaced: Index that held the old rows of a re-processed document
+            document_id: That document
+        """
+        try:
+            if replaced is not None:
+                # Unless the merge already published a newer generation
+                await self._tombstone(subject_id, document_id, replaced.generation)
+            pending = self._loading.get(subject_id)
+            if pending is not None:
+                await asyncio.shield(pending)
+            if (subject_id in self._stale or subject_id in self._completed) and subject_id not in self._loading:
+                await self._load(subject_id)
+        except Exception as e:
+            logger.error(f"❌ [RETRIEVAL] Failed to republish index of subject {subject_id}: {e}")
+
+    async def _tombstone(self, subject_id: str, document_id: str, generation: Optional[int] = None):
+        """Log a removed document in the store so every worker hides its rows"""
+        def write():
+            with self.store.writer(subject_id):
+                return self.store.tombstone(subject_id, [document_id], generation)
+
+        try:
+            generation = await asyncio.to_thread(write)
+        except Exception as e:
+            logger.error(f"❌ [RETRIEVAL] Failed to tombstone document {document_id}: {e}")
+            self._stale.add(subject_id)  # Rebuilt on the next search instead
+            return
+        index = self._indexes.get(subject_id)
+        if index is not None and index.generation == generation:
+            self._maybe_compact(index)
+
+    def _maybe_compact(self, index: SubjectIndex):
+        """Start a background compaction once enough of an index is tombstoned"""
+        subject_id = index.subject_id
+        if (
+            not index.dead_rows
+            or index.tombstone_ratio < settings.INDEX_COMPACTION_THRESHOLD
+            or subject_id in self._compacting
+        ):
+            return
+        self._compacting.add(subject_id)
+        asyncio.get_running_loop().create_task(self._compact(subject_id))
+
+    async def _compact(self, subject_id: str):
+        try:
+            index = await asyncio.to_thread(self._rewrite, subject_id)
+            if (
+                index is not None
+                and subject_id not in self._stale
+                and subject_id not in self._completed
+                and subject_id not in self._loading
+            ):
+                self._indexes[subject_id] = index
+        except Exception as e:
+            logger.error(f"❌ [RETRIEVAL] Failed to compact index of subject {subject_id}: {e}")
+        finally:
+            self._compacting.discard(subject_id)
+
+    def _rewrite(self, subject_id: str) -> Optional[SubjectIndex]:
+        """Publish the current generation without its tombstoned rows (None if not needed anymore)"""
+        with self.store.writer(subject_id):
+            index = self.store.open(subject_id)
+            if index is None or not index.dead_rows or index.tombstone_ratio < settings.INDEX_COMPACTION_THRESHOLD:
+                return None  # Another worker compacted or merged meanwhile
+            dropped = index.dead_rows
+            compacted = self.store.publish(index)
+        logger.info(
+            f"🧹 [RETRIEVAL] Compacted index of subject {subject_id}: dropped {dropped} tombstoned rows, "
+            f"{compacted.size} left, generation {compacted.generation}"
+        )
+        return compacted
+
+    def _on_subject_change(self, subject_id: Optional[str], document_id: Optional[str], change: str):
+        removed = self.cache.invalidate_subject(subject_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if subject_id is None:
+            self._stale.update(self._indexes)
+            self._indexes.clear()
+            self._verified.clear()
+        elif (
+            subject_id not in self._indexes
+            and subject_id not in self._loading
+            and self.store.current_generation(subject_id) is None
+        ):
+            # Never published: the first search builds it from MySQL
+            self._verified.discard(subject_id)
+        elif loop is None or document_id is None:
+            # Rebuilt in the background, or on the next search without an event loop
+            self._stale.add(subject_id)
+            self._indexes.pop(subject_id, None)
+            if loop is not None:
+                loop.create_task(self._refresh(subject_id))
+        else:
+            index = self._indexes.get(subject_id)
+            indexed = index is not None and index.contains_document(document_id)
+            if indexed:
+                index.tombstone([document_id])  # Hidden here right away
+            if change == DOCUMENT_DELETED:
+                # Logged even if this worker doesn't hold it: a newer generation may
+                loop.create_task(self._tombstone(subject_id, document_id))
+            else:
+                self._completed.setdefault(subject_id, set()).add(document_id)
+                loop.create_task(self._refresh(subject_id, index if indexed else None, document_id))
+        logger.info(
+            f"♻️ [RETRIEVAL] Subject {subject_id or '*'} changed (document {document_id} {change}): "
+            f"dropped {removed} cached results"
+        )
+
+    async def _hydrate(self, ranked: List, include_content: bool) -> List[Dict]:
+        return (await self._hydrate_many([ranked], include_content))[0]
+
+    async def _hydrate_many(self, rankings: List[List], include_content: bool) -> List[List[Dict]]:
+        """Results of several rankings, with the content of all their chunks fetched at once"""
+        if not include_content:
+            return [[{'id': chunk_id, 'score': score} for chunk_id, score in ranked] for ranked in rankings]
+
+        chunk_ids = list(dict.fromkeys(chunk_id for ranked in rankings for chunk_id, _ in ranked))
+        rows = await asyncio.to_thread(self.db.fetch_chunks, chunk_ids)
+        hydrated = []
+        for ranked in rankings:
+            results = []
+            for chunk_id, score in ranked:
+                row = rows.get(chunk_id)
+                if row is None:  # Deleted since it was ranked
+                    continue
+                results.append({
+                    'id': chunk_id,
+                    'score': score,
+                    'content': row['content'],
+                    'documentId': row['documentId'],
+                    'type': row['type'],
+                    'originalFileName': row['originalFileName'] or 'Unknown',
+                    'chunkIndex': row['chunkIndex'],
+                    'chapterNumber': row['chapterNumber'],
+                    'chapterTitle': row['chapterTitle'],
+                    'pageStart': row['pageStart'],
+                    'pageEnd': row['pageEnd'],
+                })
+            hydrated.append(results)
+        return hydrated
+
+    def _query_key(self, query: Optional[str], query_embedding: Optional[List[float]]) -> str:
+        """Normalized query text, or a hash of the float32 query vector"""
+        if query is not None:
+            return 't:' + self.query_cache.normalize(query)
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        return 'v:' + hashlib.sha1(vector.tobytes()).hexdigest()
+
+
+def _dedupe(rankings: List[List], k: int) -> List[List]:
+    """
+    Give each chunk to the query it scores highest for, up to k per query
+
+    Pairs are taken best score first, so every query's list stays in score order.
+    """
+    pairs = sorted(
+        ((score, query, chunk_id) for query, ranked in enumerate(rankings) for chunk_id, score in ranked),
+        key=lambda pair: -pair[0],
+    )
+    taken = set()
+    results = [[] for _ in rankings]
+    for score, query, chunk_id in pairs:
+        if chunk_id in taken or len(results[query]) >= k:
+            continue
+        taken.add(chunk_id)
+        results[query].append((chunk_id, score))
+    return results
+
+
+_retrieval_service: Optional[RetrievalService] = None
+
+
+def get_retrieval_service() -> RetrievalService:
+    """
+    Process-wide retrieval service
+
+    Also created by the write side (processing, deletes) before it publishes
+    a subject change, so the shared index store follows every worker's
+    writes, including workers that never served a search.
+    """
+    global _retrieval_service
+    if _retrieval_service is None:
+        _retrieval_service = RetrievalService()
+    return _retrieval_service
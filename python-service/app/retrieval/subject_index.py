@@ -0,0 +1,413 @@
+"""In-memory vector index of one subject's chunks"""
+import json
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from .mmr import mmr_select
+
+
+class SearchFilters:
+    """Optional restrictions applied before ranking"""
+
+    __slots__ = ('document_types', 'document_ids', 'chapter_numbers', 'min_score')
+
+    def __init__(
+        self,
+        document_types: Optional[Sequence[str]] = None,
+        document_ids: Optional[Sequence[str]] = None,
+        chapter_numbers: Optional[Sequence[int]] = None,
+        min_score: Optional[float] = None,
+    ):
+        self.document_types = tuple(sorted(set(document_types))) if document_types else None
+        self.document_ids = tuple(sorted(set(document_ids))) if document_ids else None
+        self.chapter_numbers = tuple(sorted(set(chapter_numbers))) if chapter_numbers else None
+        self.min_score = min_score
+
+    def cache_key(self) -> Tuple:
+        """Canonical, hashable form (order of the filter lists does not matter)"""
+        return (self.document_types, self.document_ids, self.chapter_numbers, self.min_score)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows in place so a dot product is the cosine similarity"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class SubjectIndex:
+    """
+    Normalized float32 embedding matrix of a subject's completed chunks
+
+    Document IDs and types are stored once per document; rows refer to them
+    by ordinal so filters are vectorized comparisons over int arrays.
+
+    Removed or replaced documents are tombstoned: one bit per document in
+    `dead_documents`, expanded to a row mask on the next search and ANDed
+    into the filters. The rows stay in the (possibly memory-mapped) matrix
+    until the index is compacted into a new generation.
+    """
+
+    def __init__(
+        self,
+        subject_id: str,
+        chunk_ids: List[str],
+        row_documents: np.ndarray,
+        document_ids: List[str],
+        document_types: List[str],
+        chapter_numbers: np.ndarray,
+        matrix: np.ndarray,
+        generation: int = 0,
+    ):
+        """
+        Args:
+            subject_id: Subject ID
+            chunk_ids: Chunk ID per row
+            row_documents: int32 document ordinal per row
+            document_ids: Document ID per ordinal
+            document_types: Document type per ordinal
+            chapter_numbers: int32 chapter number per row (-1 when unknown)
+            matrix: (rows, dims) float32 matrix with L2-normalized rows
+                (may be a read-only memory map)
+            generation: Published generation in the index store (0 = unpublished)
+        """
+        self.subject_id = subject_id
+        self.chunk_ids = chunk_ids
+        self.row_documents = row_documents
+        self.document_ids = document_ids
+        self.document_types = document_types
+        self.chapter_numbers = chapter_numbers
+        self.matrix = matrix
+        self.generation = generation
+        self.dead_documents = np.zeros(len(document_ids), dtype=bool)
+        self.tombstones = 0  # Tombstoned documents
+        self.dead_rows = 0  # Their rows, still in the matrix
+        self.tombstone_offset = 0  # Bytes of the store's tombstone log applied (see IndexStore)
+        self._ordinals: Optional[Dict[str, int]] = None
+        self._document_rows: Optional[np.ndarray] = None
+        self._live_mask: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_rows(cls, subject_id: str, rows: List[Dict]) -> 'SubjectIndex':
+        """Build from DatabaseClient.load_subject_embeddings rows"""
+        chunk_ids = []
+        row_documents = []
+        chapter_numbers = []
+        document_ordinals: Dict[str, int] = {}
+        document_types: List[str] = []
+        vectors = []
+
+        for row in rows:
+            embedding = row['embedding']
+            if isinstance(embedding, (str, bytes)):
+                embedding = json.loads(embedding)
+            if not embedding:
+                continue
+
+            document_id = row['documentId']
+            ordinal = document_ordinals.get(document_id)
+            if ordinal is None:
+                ordinal = document_ordinals[document_id] = len(document_ordinals)
+                document_types.append(row.get('documentType') or '')
+
+            chunk_ids.append(row['id'])
+            row_documents.append(ordinal)
+            chapter = row.get('chapterNumber')
+            chapter_numbers.append(-1 if chapter is None else chapter)
+            vectors.append(embedding)
+
+        dims = len(vectors[0]) if vectors else 0
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dims)
+
+        return cls(
+            subject_id=subject_id,
+            chunk_ids=chunk_ids,
+            row_documents=np.asarray(row_documents, dtype=np.int32),
+            document_ids=list(document_ordinals),
+            document_types=document_types,
+            chapter_numbers=np.asarray(chapter_numbers, dtype=np.int32),
+            matrix=normalize_rows(matrix),
+        )
+
+    def with_documents(self, other: 'SubjectIndex') -> 'SubjectIndex':
+        """
+        New index with `other`'s documents added, replacing any of them
+        already present here (tombstoned documents are dropped as well)
+
+        Args:
+            other: Index of the added documents (rows already normalized)
+        """
+        dims = other.dimensions if self.size == 0 else self.dimensions
+        if other.size and other.dimensions != dims:
+            raise ValueError(
+                f"Added documents have {other.dimensions} dimensions, index for subject "
+                f"{self.subject_id} has {dims}"
+            )
+
+        replaced = set(other.document_ids)
+        kept = self._keep_documents(
+            [i for i, d in enumerate(self.document_ids) if d not in replaced and not self.dead_documents[i]]
+        )
+        return SubjectIndex(
+            subject_id=self.subject_id,
+            chunk_ids=kept.chunk_ids + list(other.chunk_ids),
+            row_documents=np.concatenate([
+                kept.row_documents,
+                np.asarray(other.row_documents, dtype=np.int32) + len(kept.document_ids),
+            ]),
+            document_ids=kept.document_ids + list(other.document_ids),
+            document_types=kept.document_types + list(other.document_types),
+            chapter_numbers=np.concatenate([
+                kept.chapter_numbers,
+                np.asarray(other.chapter_numbers, dtype=np.int32),
+            ]).astype(np.int32),
+            matrix=np.concatenate([
+                kept.matrix.reshape(-1, dims),
+                np.asarray(other.matrix, dtype=np.float32).reshape(-1, dims),
+            ]),
+        )
+
+    def compacted(self) -> 'SubjectIndex':
+        """New in-memory index without the tombstoned documents' rows"""
+        return self._keep_documents([i for i in range(len(self.document_ids)) if not self.dead_documents[i]])
+
+    def _keep_documents(self, kept_documents: List[int]) -> 'SubjectIndex':
+        """Copy of the index restricted to some document ordinals (renumbered in order)"""
+        keep = np.isin(self.row_documents, kept_documents)
+        ordinals = np.full(len(self.document_ids), -1, dtype=np.int32)
+        ordinals[kept_documents] = np.arange(len(kept_documents), dtype=np.int32)
+        return SubjectIndex(
+            subject_id=self.subject_id,
+            chunk_ids=[c for c, k in zip(self.chunk_ids, keep.tolist()) if k],
+            row_documents=ordinals[np.asarray(self.row_documents)[keep]],
+            document_ids=[self.document_ids[i] for i in kept_documents],
+            document_types=[self.document_types[i] for i in kept_documents],
+            chapter_numbers=np.asarray(self.chapter_numbers, dtype=np.int32)[keep],
+            matrix=np.asarray(self.matrix, dtype=np.float32)[keep],
+        )
+
+    def tombstone(self, document_ids: Iterable[str]) -> int:
+        """
+        Hide documents' rows from search
+
+        Constant work per document: one bit is set, and the row mask is
+        rebuilt lazily on the next search. IDs not in the index are ignored.
+
+        Returns:
+            Number of rows hidden
+        """
+        if self._ordinals is None:
+            self._ordinals = {document_id: i for i, document_id in enumerate(self.document_ids)}
+        hidden = 0
+        for document_id in document_ids:
+            ordinal = self._ordinals.get(document_id)
+            if ordinal is None or self.dead_documents[ordinal]:
+                continue
+            if self._document_rows is None:
+                self._document_rows = np.bincount(
+                    np.asarray(self.row_documents, dtype=np.int64), minlength=len(self.document_ids)
+                )
+            self.dead_documents[ordinal] = True
+            self.tombstones += 1
+            hidden += int(self._document_rows[ordinal])
+        if hidden:
+            self.dead_rows += hidden
+            self._live_mask = None
+        return hidden
+
+    def contains_document(self, document_id: str) -> bool:
+        """Whether a document has live rows in the index"""
+        if self._ordinals is None:
+            self._ordinals = {document_id: i for i, document_id in enumerate(self.document_ids)}
+        ordinal = self._ordinals.get(document_id)
+        return ordinal is not None and not self.dead_documents[ordinal]
+
+    def live_mask(self) -> Optional[np.ndarray]:
+        """Boolean mask of rows not tombstoned, or None when nothing is"""
+        if not self.dead_rows:
+            return None
+        if self._live_mask is None:
+            self._live_mask = ~self.dead_documents[self.row_documents]
+        return self._live_mask
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def live_size(self) -> int:
+        """Rows that are searchable (not tombstoned)"""
+        return self.size - self.dead_rows
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return self.dead_rows / self.size if self.size else 0.0
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """(generation, tombstoned documents): changes whenever search results can"""
+        return self.generation, self.tombstones
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def search(self, query: np.ndarray, k: int, filters: Optional[SearchFilters] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k chunks by cosine similarity
+
+        Args:
+            query: Query vector (any norm)
+            k: Number of results
+            filters: Optional restrictions
+
+        Returns:
+            List of (chunk ID, score), best first
+        """
+        rows, scores = self.top_rows(query, k, filters)
+        return [(self.chunk_ids[row], float(score)) for row, score in zip(rows.tolist(), scores.tolist())]
+
+    def search_mmr(
+        self,
+        query: np.ndarray,
+        k: int,
+        filters: Optional[SearchFilters] = None,
+        fetch_k: int = 200,
+        lambda_mult: float = 0.5,
+        chapter_quota: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        k diverse chunks: Maximal Marginal Relevance over the top `fetch_k`
+
+        Args:
+            query: Query vector (any norm)
+            k: Number of results
+            filters: Optional restrictions
+            fetch_k: Candidates taken by similarity before diversifying
+            lambda_mult: Relevance weight (1 = plain similarity order)
+            chapter_quota: At most this many results per chapter
+
+        Returns:
+            List of (chunk ID, cosine score) in selection order
+        """
+        rows, scores = self.top_rows(query, max(fetch_k, k), filters)
+        picks = mmr_select(
+            np.asarray(self.matrix[rows]),
+            scores,
+            k,
+            lambda_mult=lambda_mult,
+            chapters=np.asarray(self.chapter_numbers)[rows],
+            chapter_quota=chapter_quota,
+        )
+        return [(self.chunk_ids[rows[pick]], float(scores[pick])) for pick in picks]
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Top-k chunks for each of several queries, scored with one matrix product
+
+        Args:
+            queries: (Q, dims) query vectors (any norm)
+            k: Number of results per query
+            filters: Optional restrictions, shared by every query
+
+        Returns:
+            One list of (chunk ID, score) per query, best first
+        """
+        return [
+            [(self.chunk_ids[row], float(score)) for row, score in zip(rows.tolist(), scores.tolist())]
+            for rows, scores in self.top_rows_batch(queries, k, filters)
+        ]
+
+    def top_rows(
+        self,
+        query: np.ndarray,
+        k: int,
+        filters: Optional[SearchFilters] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row numbers and cosine scores of the top-k chunks, best first
+
+        Rows below `filters.min_score` are left out.
+        """
+        return self.top_rows_batch(np.asarray(query, dtype=np.float32).reshape(1, -1), k, filters)[0]
+
+    def top_rows_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        filters: Optional[SearchFilters] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Row numbers and cosine scores of the top-k chunks of every query
+
+        All Q queries are scored in a single (Q, N) product against the
+        matrix (one BLAS call), then each row is cut to its top k with
+        argpartition and only those k are sorted.
+
+        Returns:
+            One (rows, scores) pair per query, best first, without rows
+            below `filters.min_score`
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        if self.size == 0 or k <= 0 or len(queries) == 0:
+            return [empty] * len(queries)
+        if queries.ndim != 2 or queries.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Query has {queries.shape[-1]} dimensions, index for subject "
+                f"{self.subject_id} has {self.dimensions}"
+            )
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (queries / norms) @ self.matrix.T
+
+        mask = self.filter_mask(filters)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            available = int(mask.sum())
+        else:
+            available = self.size
+        k = min(k, available)
+        if k == 0:
+            return [empty] * len(queries)
+
+        top = np.argpartition(scores, self.size - k, axis=1)[:, self.size - k:]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        min_score = filters.min_score if filters else None
+        results = []
+        for rows, row_scores in zip(top, top_scores):
+            if min_score is not None:
+                keep = row_scores >= min_score
+                rows, row_scores = rows[keep], row_scores[keep]
+            results.append((rows, row_scores))
+        return results
+
+    def filter_mask(self, filters: Optional[SearchFilters]) -> Optional[np.ndarray]:
+        """Boolean row mask of live rows matching the filters, or None when nothing is excluded"""
+        masks = [self.live_mask()]
+        if filters is not None:
+            if filters.document_types:
+                allowed = [i for i, t in enumerate(self.document_types) if t in filters.document_types]
+                masks.append(np.isin(self.row_documents, allowed))
+            if filters.document_ids:
+                wanted = set(filters.document_ids)
+                allowed = [i for i, d in enumerate(self.document_ids) if d in wanted]
+                masks.append(np.isin(self.row_documents, allowed))
+            if filters.chapter_numbers:
+                masks.append(np.isin(self.chapter_numbers, filters.chapter_numbers))
+
+        mask = None
+        for part in masks:
+            if part is not None:
+                mask = part if mask is None else mask & part
+        return mask
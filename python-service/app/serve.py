@@ -0,0 +1,40 @@
+"""Production server: several uvicorn worker processes
+
+Usage:
+    python -m app.serve
+
+Workers share subject indexes through the memory-mapped store in INDEX_DIR
+(see app.retrieval.index_store), so adding workers adds cores, not copies of
+the vectors. Use `python -m app.main` for single-process development with
+auto-reload.
+"""
+import os
+import uvicorn
+from loguru import logger
+from app.config import settings
+
+
+def resolve_workers() -> int:
+    """Configured worker count (WORKERS=0 means one per CPU)"""
+    return settings.WORKERS if settings.WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def main():
+    workers = resolve_workers()
+    # Workers re-read settings from the environment: pin the resolved count so
+    # each one takes its share of the process-wide embedding rate limits
+    os.environ['WORKERS'] = str(workers)
+    logger.info(f"🚀 [SERVE] Starting {workers} workers on {settings.API_HOST}:{settings.API_PORT}")
+
+    uvicorn.run(
+        "app.main:app",
+        host=settings.API_HOST,
+        port=settings.API_PORT,
+        workers=workers,
+        reload=False,
+        log_level=settings.LOG_LEVEL.lower(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""Admission control for document processing: bounded lanes and backpressure"""
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Tuple
+from starlette.responses import JSONResponse
+from app.config import settings
+
+PRIORITY = 'priority'  # /process-sync and small uploads
+BULK = 'bulk'
+
+# Retry-After bounds (seconds) and the guess used before any job has finished
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 600
+DEFAULT_JOB_SECONDS = 30.0
+
+# Completions older than this don't count towards the drain rate
+DRAIN_WINDOW_SECONDS = 120.0
+
+
+class AdmissionRejected(Exception):
+    """The job was refused; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    An admitted job's place in its lane
+
+    `async with ticket:` waits for a processing slot and frees it (and the
+    job's per-user/per-subject counts) on exit. A ticket that is never
+    entered must be released with `cancel()`.
+    """
+
+    __slots__ = ('controller', 'lane', 'user_id', 'subject_id', 'state', 'admitted_at', 'started_at')
+
+    def __init__(self, controller: 'AdmissionController', lane: str, user_id: Optional[str], subject_id: Optional[str]):
+        self.controller = controller
+        self.lane = lane
+        self.user_id = user_id
+        self.subject_id = subject_id
+        self.state = 'queued'  # queued -> running -> done
+        self.admitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+    async def __aenter__(self) -> 'Ticket':
+        await self.controller._acquire(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.controller._release(self)
+
+    def cancel(self):
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Bounded queues in front of document processing
+
+    Jobs are admitted into one of two lanes and run at most `max_running`
+    at a time. The priority lane (synchronous requests, small files) is
+    served first, and `priority_slots` running slots are kept out of reach
+    of bulk jobs, so a burst of large uploads never blocks it.
+
+    Admission is refused at once (AdmissionRejected, sent as 429) when the
+    lane's queue is full or the user/subject already has `max_per_user` /
+    `max_per_subject` bulk jobs in flight. The suggested Retry-After is the
+    time the backlog ahead of the request needs at the observed drain rate,
+    so clients back off more as the overload grows and the service keeps
+    finishing jobs at full speed instead of thrashing.
+
+    Each worker process has its own controller, and every limit is that
+    worker's share (`get_admission_controller`). The per-user and
+    per-subject counts are not shared between workers. A user whose jobs
+    pile up on one worker is refused before reaching the service-wide limit.
+    """
+
+    def __init__(
+        self,
+        max_running: int,
+        max_queued: int,
+        max_queued_priority: int,
+        max_per_user: int,
+        max_per_subject: int,
+        priority_slots: int = 1,
+    ):
+        self.max_running = max(max_running, 1)
+        self.priority_slots = min(max(priority_slots, 0), self.max_running - 1)
+        self.max_queued = {BULK: max(max_queued, 0), PRIORITY: max(max_queued_priority, 0)}
+        self.max_per_user = max_per_user
+        self.max_per_subject = max_per_subject
+
+        self._running: Dict[str, int] = {BULK: 0, PRIORITY: 0}
+        self._queued: Dict[str, int] = {BULK: 0, PRIORITY: 0}
+        self._waiters: Dict[str, Deque[Tuple[Ticket, asyncio.Future]]] = {BULK: deque(), PRIORITY: deque()}
+        self._per_user: Counter = Counter()
+        self._per_subject: Counter = Counter()
+        self._completions: Deque[Tuple[float, float]] = deque()  # (finished at, seconds running)
+        self._stats = {'admitted': 0, 'rejected': 0, 'completed': 0}
+
+    def lane_for(self, size: Optional[int], sync: bool = False) -> str:
+        """Priority for synchronous requests and uploads up to ADMISSION_SMALL_FILE_SIZE"""
+        if sync or (size is not None and size <= settings.ADMISSION_SMALL_FILE_SIZE):
+            return PRIORITY
+        return BULK
+
+    def check(self, lane: str):
+        """
+        Refuse early when the lane's queue is full (before reading the upload)
+
+        Raises:
+            AdmissionRejected: If the lane cannot take another job
+        """
+        if self._queued[lane] >= self.max_queued[lane] and not self._can_start(lane):
+            self._stats['rejected'] += 1
+            raise AdmissionRejected(
+                f"Too many queued {lane} jobs ({self._queued[lane]})",
+                self.retry_after(self._queued[lane]),
+            )
+
+    def admit(self, lane: str, user_id: Optional[str] = None, subject_id: Optional[str] = None) -> Ticket:
+        """
+        Take a place in a lane
+
+        Raises:
+            AdmissionRejected: If the lane is full or the user/subject is over its limit
+        """
+        self.check(lane)
+        if lane == BULK:
+            if user_id and self._per_user[user_id] >= self.max_per_user:
+                self._stats['rejected'] += 1
+                raise AdmissionRejected(
+                    f"Too many jobs in flight for user {user_id} ({self._per_user[user_id]})",
+                    self.retry_after(self._per_user[user_id]),
+                )
+            if subject_id and self._per_subject[subject_id] >= self.max_per_subject:
+                self._stats['rejected'] += 1
+                raise AdmissionRejected(
+                    f"Too many jobs in flight for subject {subject_id} ({self._per_subject[subject_id]})",
+                    self.retry_after(self._per_subject[subject_id]),
+                )
+            if user_id:
+                self._per_user[user_id] += 1
+            if subject_id:
+                self._per_subject[subject_id] += 1
+
+        self._queued[lane] += 1
+        self._stats['admitted'] += 1
+        return Ticket(self, lane, user_id if lane == BULK else None, subject_id if lane == BULK else None)
+
+    def drain_rate(self) -> Optional[float]:
+        """Jobs finished per second recently (None before any job has finished)"""
+        now = time.monotonic()
+        while self._completions and self._completions[0][0] < now - DRAIN_WINDOW_SECONDS:
+            self._completions.popleft()
+        if len(self._completions) >= 2:
+            span = now - self._completions[0][0]
+            if span > 0:
+                return len(self._completions) / span
+        if self._completions:
+            # Too few to measure a rate: assume every slot finishes at the job's pace
+            return self.max_running / max(self._completions[-1][1], 0.1)
+        return None
+
+    def retry_after(self, backlog: int) -> int:
+        """Seconds until `backlog` jobs should have drained"""
+        rate = self.drain_rate() or self.max_running / DEFAULT_JOB_SECONDS
+        return int(min(max(math.ceil(max(backlog, 1) / rate), MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+    def stats(self) -> Dict:
+        rate = self.drain_rate()
+        return {
+            **self._stats,
+            'running': dict(self._running),
+            'queued': dict(self._queued),
+            'limits': {
+                'max_running': self.max_running,
+                'priority_slots': self.priority_slots,
+                'max_queued': dict(self.max_queued),
+                'max_per_user': self.max_per_user,
+                'max_per_subject': self.max_per_subject,
+            },
+            'drain_rate_per_minute': round(rate * 60, 2) if rate else None,
+        }
+
+    def _can_start(self, lane: str) -> bool:
+        if self._running[BULK] + self._running[PRIORITY] >= self.max_running:
+            return False
+        if lane == BULK:
+            return not self._waiters[PRIORITY] and self._running[BULK] < self.max_running - self.priority_slots
+        return True
+
+    async def _acquire(self, ticket: Ticket):
+        lane = ticket.lane
+        if not self._waiters[lane] and self._can_start(lane):
+            self._start(ticket)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append((ticket, future))
+        try:
+            await future
+        except BaseException:
+            # Cancelled while waiting (or right after getting the slot): give it up
+            if not future.done():
+                future.cancel()
+            if (ticket, future) in self._waiters[lane]:
+                self._waiters[lane].remove((ticket, future))
+            self._release(ticket)
+            raise
+
+    def _start(self, ticket: Ticket):
+        self._queued[ticket.lane] -= 1
+        self._running[ticket.lane] += 1
+        ticket.state = 'running'
+        ticket.started_at = time.monotonic()
+
+    def _release(self, ticket: Ticket):
+        if ticket.state == 'done':
+            return
+        if ticket.state == 'running':
+            self._running[ticket.lane] -= 1
+            now = time.monotonic()
+            self._completions.append((now, now - ticket.started_at))
+            self._stats['completed'] += 1
+        else:
+            self._queued[ticket.lane] -= 1
+        ticket.state = 'done'
+
+        for counter, key in ((self._per_user, ticket.user_id), (self._per_subject, ticket.subject_id)):
+            if key:
+                counter[key] -= 1
+                if counter[key] <= 0:
+                    del counter[key]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiting tickets, priority lane first"""
+        for lane in (PRIORITY, BULK):
+            waiters = self._waiters[lane]
+            while waiters and self._can_start(lane):
+                ticket, future = waiters.popleft()
+                if future.done():
+                    continue
+                self._start(ticket)
+                future.set_result(None)
+
+
+class AdmissionGate:
+    """
+    ASGI middleware refusing uploads while their lane is full, before the
+    request body is read (the lane is guessed from Content-Length)
+
+    Per-user and per-subject limits need the form fields, so they are
+    checked by the endpoints through AdmissionController.admit().
+    """
+
+    def __init__(self, app, paths: Dict[str, bool]):
+        """
+        Args:
+            app: Wrapped ASGI application
+            paths: Gated POST paths, mapped to whether they are synchronous
+        """
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in self.paths:
+            length = dict(scope['headers']).get(b'content-length', b'')
+            admission = get_admission_controller()
+            lane = admission.lane_for(int(length) if length.isdigit() else None, sync=self.paths[scope['path']])
+            try:
+                admission.check(lane)
+            except AdmissionRejected as e:
+                response = JSONResponse(
+                    status_code=429,
+                    content={'detail': e.reason},
+                    headers={'Retry-After': str(e.retry_after)},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+_admission: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Process-wide admission controller (its share of the service's limits)
+
+    Every ADMISSION_* limit is for the whole service and divided by WORKERS
+    (resolved by `app.serve`; set it to the worker count when starting the
+    workers another way), with at least one job per worker.
+    """
+    global _admission
+    if _admission is None:
+        workers = max(settings.WORKERS, 1)
+        _admission = AdmissionController(
+            max_running=max(settings.ADMISSION_MAX_RUNNING // workers, 1),
+            max_queued=max(settings.ADMISSION_MAX_QUEUED // workers, 1),
+            max_queued_priority=max(settings.ADMISSION_MAX_QUEUED_PRIORITY // workers, 1),
+            max_per_user=max(settings.ADMISSION_MAX_PER_USER // workers, 1),
+            max_per_subject=max(settings.ADMISSION_MAX_PER_SUBJECT // workers, 1),
+            priority_slots=math.ceil(settings.ADMISSION_PRIORITY_SLOTS / workers),
+        )
+    return _admission
@@ -0,0 +1,419 @@
+"""Portable bundles of processed documents: chunks plus embeddings, no re-embedding
+
+Usage:
+    python -m app.services.bundles export --subject SUBJECT_ID -o toan-6.npz
+    python -m app.services.bundles export --document DOC_ID [--document DOC_ID ...] -o docs.npz
+    python -m app.services.bundles import toan-6.npz [--subject SUBJECT_ID] [--replace]
+
+A bundle is a zip of .npy members (readable with `numpy.load`) plus a
+manifest.json:
+
+    manifest.json          format, version, documents, vocabularies, and the
+                           sha256 and size of every other member
+    embeddings.npy         (chunks, dims) float32
+    document.npy           int32 document ordinal per chunk (into manifest documents)
+    chunk_index.npy        int32
+    chapter_number.npy     int32, -1 = NULL (same for page_start, page_end, token_count)
+    chunk_type.npy         uint8 code into manifest vocabularies.chunk_type
+    embedding_model.npy    uint8 code into manifest vocabularies.embedding_model
+    content.npy            UTF-8 bytes of every chunk's text, concatenated
+    content_offsets.npy    int64 byte offsets (chunks + 1); same for chapter_title
+
+Chunk IDs are not carried over: imported chunks get new IDs.
+"""
+import argparse
+import hashlib
+import io
+import json
+import sys
+import time
+import uuid
+import zipfile
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from loguru import logger
+from app.chunking import vectors_json
+from app.config import embedding_space
+from app.database.client import get_database_client
+from app.retrieval.index_store import get_index_store
+from app.retrieval.subject_index import SubjectIndex, normalize_rows
+
+FORMAT = 'edugenie-chunk-bundle'
+VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Nullable int columns, stored as int32 with -1 for NULL: bundle name -> chunks column
+INT_COLUMNS = {
+    'chunk_index': 'chunkIndex',
+    'chapter_number': 'chapterNumber',
+    'page_start': 'pageStart',
+    'page_end': 'pageEnd',
+    'token_count': 'tokenCount',
+}
+# Low-cardinality string columns, stored as uint8 codes into a vocabulary
+CODED_COLUMNS = {
+    'chunk_type': 'chunkType',
+    'embedding_model': 'embeddingModel',
+}
+# Free text columns, stored as a UTF-8 blob plus offsets
+TEXT_COLUMNS = {
+    'content': 'content',
+    'chapter_title': 'chapterTitle',
+}
+DOCUMENT_FIELDS = ('id', 'subjectId', 'type', 'originalFileName', 'mimeType', 'fileSize', 'contentHash')
+
+BundleTarget = Union[str, BinaryIO]
+
+
+class Bundle:
+    """Decoded bundle contents (columns are aligned by chunk)"""
+
+    def __init__(self, manifest: Dict, arrays: Dict[str, np.ndarray]):
+        self.manifest = manifest
+        self.arrays = arrays
+
+    @property
+    def documents(self) -> List[Dict]:
+        return self.manifest['documents']
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self.arrays['embeddings']
+
+    def __len__(self) -> int:
+        return len(self.arrays['document'])
+
+    def texts(self, column: str) -> List[str]:
+        blob = self.arrays[column].tobytes()
+        offsets = self.arrays[f'{column}_offsets'].tolist()
+        return [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def ints(self, column: str) -> List[Optional[int]]:
+        return [None if value < 0 else value for value in self.arrays[column].tolist()]
+
+    def codes(self, column: str) -> List[Optional[str]]:
+        vocabulary = self.manifest['vocabularies'][column]
+        return [vocabulary[code] for code in self.arrays[column].tolist()]
+
+
+def export_bundle(
+    target: BundleTarget,
+    document_ids: Optional[Sequence[str]] = None,
+    subject_id: Optional[str] = None,
+) -> Dict:
+    """
+    Write the completed documents matching the selection as a bundle
+
+    Args:
+        target: Output path or writable binary file
+        document_ids: Documents to export
+        subject_id: Subject whose documents to export (combined with
+            document_ids when both are given)
+
+    Returns:
+        Summary with document and chunk counts and the manifest checksum
+
+    Raises:
+        ValueError: If nothing is selected, nothing matches, or the
+            documents' embeddings have different dimensions
+    """
+    if not document_ids and not subject_id:
+        raise ValueError("Select documents or a subject to export")
+
+    db = get_database_client()
+    documents = db.load_export_documents(document_ids=document_ids, subject_id=subject_id)
+    if not documents:
+        raise ValueError("No completed documents match the selection")
+
+    ints = {name: [] for name in INT_COLUMNS}
+    codes = {name: [] for name in CODED_COLUMNS}
+    vocabularies: Dict[str, List[Optional[str]]] = {name: [] for name in CODED_COLUMNS}
+    texts = {name: [] for name in TEXT_COLUMNS}
+    row_documents: List[int] = []
+    vectors: List[np.ndarray] = []
+    exported = []
+
+    for ordinal, document in enumerate(documents):
+        chunks = db.load_export_chunks(document['id'])
+        for chunk in chunks:
+            vectors.append(np.asarray(json.loads(chunk['embedding']), dtype=np.float32))
+            row_documents.append(ordinal)
+            for name, column in INT_COLUMNS.items():
+                value = chunk[column]
+                ints[name].append(-1 if value is None else value)
+            for name, column in CODED_COLUMNS.items():
+                codes[name].append(_code(vocabularies[name], chunk[column]))
+            for name, column in TEXT_COLUMNS.items():
+                texts[name].append(chunk[column] or '')
+        exported.append({**{field: document[field] for field in DOCUMENT_FIELDS}, 'chunks': len(chunks)})
+
+    dims = {len(vector) for vector in vectors}
+    if len(dims) > 1:
+        raise ValueError(f"Embeddings of the selected documents have different dimensions: {sorted(dims)}")
+    embeddings = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    del vectors
+
+    arrays = {
+        'embeddings': embeddings,
+        'document': np.asarray(row_documents, dtype=np.int32),
+    }
+    for name, values in ints.items():
+        arrays[name] = np.asarray(values, dtype=np.int32)
+    for name, values in codes.items():
+        arrays[name] = np.asarray(values, dtype=np.uint8)
+    for name, values in texts.items():
+        arrays[name], arrays[f'{name}_offsets'] = _pack_texts(values)
+
+    manifest = {
+        'format': FORMAT,
+        'version': VERSION,
+        'created_at': time.time(),
+        'chunks': len(row_documents),
+        'dims': embeddings.shape[1],
+        'documents': exported,
+        'vocabularies': vocabularies,
+        'files': {},
+    }
+    with zipfile.ZipFile(target, 'w') as bundle:
+        for name, array in arrays.items():
+            manifest['files'][f'{name}.npy'] = _write_array(bundle, f'{name}.npy', array)
+        manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8')
+        bundle.writestr(MANIFEST, manifest_bytes, compress_type=zipfile.ZIP_DEFLATED)
+
+    logger.info(
+        f"📦 [BUNDLE] Exported {len(exported)} documents, {manifest['chunks']} chunks "
+        f"({embeddings.nbytes / 1024 / 1024:.1f} MB of embeddings)"
+    )
+    return {
+        'documents': len(exported),
+        'chunks': manifest['chunks'],
+        'dims': manifest['dims'],
+        'manifest_sha256': hashlib.sha256(manifest_bytes).hexdigest(),
+    }
+
+
+def read_bundle(source: BundleTarget) -> Bundle:
+    """
+    Read and verify a bundle
+
+    Raises:
+        ValueError: If it is not a bundle, its version is unsupported, a
+            member's checksum does not match or the columns are inconsistent
+    """
+    try:
+        bundle = zipfile.ZipFile(source)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Not a bundle: {e}")
+
+    with bundle:
+        try:
+            manifest = json.loads(bundle.read(MANIFEST))
+        except KeyError:
+            raise ValueError("Not a bundle: manifest.json is missing")
+        if manifest.get('format') != FORMAT:
+            raise ValueError(f"Not a bundle: unknown format {manifest.get('format')!r}")
+        if manifest.get('version') != VERSION:
+            raise ValueError(f"Unsupported bundle version {manifest.get('version')}")
+
+        arrays = {}
+        for filename, expected in manifest['files'].items():
+            data = bundle.read(filename)
+            if len(data) != expected['bytes'] or hashlib.sha256(data).hexdigest() != expected['sha256']:
+                raise ValueError(f"Checksum mismatch for {filename}: bundle is corrupted")
+            arrays[filename[:-len('.npy')]] = np.load(io.BytesIO(data), allow_pickle=False)
+
+    result = Bundle(manifest, arrays)
+    rows = manifest['chunks']
+    columns = ['document', *INT_COLUMNS, *CODED_COLUMNS]
+    if (
+        any(len(arrays[name]) != rows for name in columns)
+        or arrays['embeddings'].shape != (rows, manifest['dims'])
+        or any(len(arrays[f'{name}_offsets']) != rows + 1 for name in TEXT_COLUMNS)
+    ):
+        raise ValueError("Bundle columns have inconsistent lengths")
+    if rows and int(arrays['document'].max()) >= len(manifest['documents']):
+        raise ValueError("Bundle chunks refer to missing documents")
+    return result
+
+
+def import_bundle(
+    source: BundleTarget,
+    subject_id: Optional[str] = None,
+    replace: bool = False,
+) -> Dict:
+    """
+    Load a bundle into MySQL and the index store, without embedding calls
+
+    Documents are inserted (as COMPLETED) if missing; chunks are bulk
+    inserted with their stored embeddings. Each affected subject's index is
+    then published straight from the bundle's matrix, merged into the
+    current generation, instead of being rebuilt from the JSON in MySQL.
+
+    Args:
+        source: Bundle path or binary file
+        subject_id: Import every document into this subject instead of the
+            one recorded in the bundle
+        replace: Replace the chunks of documents that already have some
+            (otherwise those documents are skipped)
+
+    Returns:
+        Summary with imported and skipped document IDs and chunk count
+    """
+    bundle = read_bundle(source)
+    documents = [
+        {field: document.get(field) for field in DOCUMENT_FIELDS}
+        for document in bundle.documents
+    ]
+    if subject_id:
+        for document in documents:
+            document['subjectId'] = subject_id
+
+    chunk_ids = [str(uuid.uuid4()) for _ in range(len(bundle))]
+    ordinals = bundle.arrays['document'].tolist()
+    columns = {name: bundle.ints(name) for name in INT_COLUMNS}
+    columns.update({name: bundle.codes(name) for name in CODED_COLUMNS})
+    columns.update({name: bundle.texts(name) for name in TEXT_COLUMNS})
+    embeddings_json = vectors_json(bundle.embeddings)
+
+    chunks = []
+    for row, ordinal in enumerate(ordinals):
+        content = columns['content'][row]
+        chunks.append({
+            'id': chunk_ids[row],
+            'document_id': documents[ordinal]['id'],
+            'chapter_number': columns['chapter_number'][row],
+            'chapter_title': columns['chapter_title'][row],
+            'page_start': columns['page_start'][row],
+            'page_end': columns['page_end'][row],
+            'content': content,
+            'content_length': len(content),
+            'token_count': columns['token_count'][row],
+            'embedding': embeddings_json[row],
+            'embedding_model': columns['embedding_model'][row],
+            'chunk_index': columns['chunk_index'][row],
+            'chunk_type': columns['chunk_type'][row] or 'TEXT',
+        })
+    del embeddings_json
+
+    db = get_database_client()
+    result = db.import_documents(documents, chunks, replace=replace)
+
+    # Publish each affected subject's index from the bundle's vectors (if they
+    # are in the service's embedding space; otherwise search reads the space's
+    # vectors from MySQL once they have been backfilled)
+    imported = set(result['imported'])
+    document_subjects = [d['subjectId'] if d['id'] in imported else None for d in documents]
+    row_subjects = [document_subjects[ordinal] for ordinal in ordinals]
+    imported_rows = sum(subject is not None for subject in row_subjects)
+    in_space = all(tag == embedding_space() for tag in columns['embedding_model'])
+    for subject in sorted(set(filter(None, document_subjects))):
+        selected = np.flatnonzero([row_subject == subject for row_subject in row_subjects])
+        _publish_imported(subject, _subject_rows(bundle, documents, chunk_ids, subject, selected) if in_space else None)
+
+    logger.info(
+        f"📦 [BUNDLE] Imported {len(result['imported'])} documents ({imported_rows} chunks), "
+        f"skipped {len(result['skipped'])}"
+    )
+    return {**result, 'chunks': imported_rows}
+
+
+def _subject_rows(
+    bundle: Bundle,
+    documents: List[Dict],
+    chunk_ids: List[str],
+    subject_id: str,
+    selected: np.ndarray,
+) -> SubjectIndex:
+    """Index of the imported rows (bundle row numbers) of one subject"""
+    bundle_ordinals = bundle.arrays['document'][selected]
+    used, row_documents = np.unique(bundle_ordinals, return_inverse=True)
+    return SubjectIndex(
+        subject_id=subject_id,
+        chunk_ids=[chunk_ids[i] for i in selected.tolist()],
+        row_documents=row_documents.astype(np.int32),
+        document_ids=[documents[i]['id'] for i in used.tolist()],
+        document_types=[documents[i]['type'] or '' for i in used.tolist()],
+        chapter_numbers=bundle.arrays['chapter_number'][selected].astype(np.int32),
+        matrix=normalize_rows(bundle.embeddings[selected].astype(np.float32)),
+    )
+
+
+def _publish_imported(subject_id: str, addition: Optional[SubjectIndex]):
+    """
+    Publish a subject's index with the imported rows merged in
+
+    Falls back to a rebuild from MySQL when the published index did not
+    match the database before the import, or without `addition`.
+    """
+    db = get_database_client()
+    store = get_index_store()
+    with store.writer(subject_id):
+        expected = db.count_subject_chunks(subject_id)
+        current = store.open(subject_id)
+        if addition is None:
+            merged = None
+        elif current is not None:
+            merged = current.with_documents(addition)
+        else:
+            merged = addition
+        if merged is None or merged.size != expected:
+            logger.info(f"📦 [BUNDLE] Rebuilding the index of subject {subject_id} from MySQL")
+            merged = SubjectIndex.from_rows(subject_id, db.load_subject_embeddings(subject_id))
+        store.publish(merged)
+
+
+def _code(vocabulary: List[Optional[str]], value: Optional[str]) -> int:
+    try:
+        return vocabulary.index(value)
+    except ValueError:
+        if len(vocabulary) == 256:
+            raise ValueError("Too many distinct values for a coded bundle column")
+        vocabulary.append(value)
+        return len(vocabulary) - 1
+
+
+def _pack_texts(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _write_array(bundle: zipfile.ZipFile, filename: str, array: np.ndarray) -> Dict:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    data = buffer.getvalue()
+    # Float vectors barely compress: store them, deflate the rest
+    compression = zipfile.ZIP_STORED if array.dtype == np.float32 else zipfile.ZIP_DEFLATED
+    bundle.writestr(filename, data, compress_type=compression)
+    return {'sha256': hashlib.sha256(data).hexdigest(), 'bytes': len(data)}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Write documents to a bundle')
+    export_parser.add_argument('--subject', help='Export every completed document of this subject')
+    export_parser.add_argument('--document', action='append', default=[], help='Document ID (repeatable)')
+    export_parser.add_argument('-o', '--output', required=True, help='Bundle file to write')
+
+    import_parser = commands.add_parser('import', help='Load a bundle')
+    import_parser.add_argument('bundle', help='Bundle file to read')
+    import_parser.add_argument('--subject', help='Import into this subject instead of the recorded one')
+    import_parser.add_argument('--replace', action='store_true', help='Replace chunks of existing documents')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'export':
+            result = export_bundle(args.output, document_ids=args.document, subject_id=args.subject)
+        else:
+            result = import_bundle(args.bundle, subject_id=args.subject, replace=args.replace)
+    except ValueError as e:
+        parser.exit(1, f"error: {e}\n")
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
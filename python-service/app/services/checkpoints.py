@@ -0,0 +1,315 @@
+"""On-disk checkpoints of background jobs, for resuming after a restart"""
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from loguru import logger
+from app.chunking import ChunkRecord, ChunkSet
+from app.config import settings
+from app.parsers.sources import DocumentSource, as_file
+
+JOB = 'job.json'
+SOURCE = 'source'
+LOCK = 'lock'
+PARSED = 'parsed.json.gz'
+CHUNKS = 'chunks.json.gz'
+EMBEDDINGS = 'embeddings'
+
+
+class Checkpoint:
+    """
+    Durable state of one background job
+
+    Layout:
+
+        <directory>/<document_id>-<ID hash>-<file hash>/
+            job.json              request fields, file hash, pipeline fingerprint
+            source                the uploaded file
+            lock                  flock held by the process running the job
+            parsed.json.gz        parser output (chapters and metadata)
+            chunks.json.gz        chunk spans into the parsed chapters
+            embeddings/000100.npy float32 vectors of the batch starting at chunk 100
+
+    Every file is written under a temporary name and renamed into place, so
+    a crash leaves either the whole stage or nothing. A job directory whose
+    lock nobody holds belongs to a job whose process died. Stages are only
+    reused while the pipeline fingerprint (file hash plus chunking and
+    embedding settings) is unchanged.
+    """
+
+    def __init__(self, path: str, lock_fd: int):
+        self.path = path
+        self._lock_fd: Optional[int] = lock_fd
+        with open(os.path.join(path, JOB)) as f:
+            self.meta: Dict = json.load(f)
+
+    @property
+    def document_id(self) -> str:
+        return self.meta['document_id']
+
+    @property
+    def source_path(self) -> str:
+        return os.path.join(self.path, SOURCE)
+
+    def bind(self, fingerprint: str):
+        """Drop stages written under another pipeline fingerprint, then record this one"""
+        if self.meta.get('fingerprint') == fingerprint:
+            return
+        if self.meta.get('fingerprint') is not None:
+            logger.info(f"♻️ [CHECKPOINT] Settings changed since {self.document_id} was checkpointed: starting over")
+        for name in (PARSED, CHUNKS):
+            _remove(os.path.join(self.path, name))
+        shutil.rmtree(os.path.join(self.path, EMBEDDINGS), ignore_errors=True)
+        self.meta['fingerprint'] = fingerprint
+        _write_json(os.path.join(self.path, JOB), self.meta)
+
+    def save_parsed(self, parsed: Dict):
+        _write_gzip_json(os.path.join(self.path, PARSED), parsed)
+
+    def load_parsed(self) -> Optional[Dict]:
+        return _read_gzip_json(os.path.join(self.path, PARSED))
+
+    def save_chunks(self, chunks: ChunkSet, chapters: List[Dict]):
+        """Chunk spans, each pointing into its chapter's text by position in `chapters`"""
+        by_text = {id(chapter.get('content')): index for index, chapter in enumerate(chapters)}
+        _write_gzip_json(os.path.join(self.path, CHUNKS), [
+            [
+                by_text[id(record.source)],
+                record.start,
+                record.end,
+                record.chapter_number,
+                record.chapter_title,
+                record.page_start,
+                record.page_end,
+                record.chunk_index,
+                record.token_count,
+            ]
+            for record in chunks
+        ])
+
+    def load_chunks(self, chapters: List[Dict]) -> Optional[ChunkSet]:
+        rows = _read_gzip_json(os.path.join(self.path, CHUNKS))
+        if rows is None:
+            return None
+        return ChunkSet([
+            ChunkRecord(chapters[chapter]['content'], start, end, number, title, page_start, page_end, index, tokens)
+            for chapter, start, end, number, title, page_start, page_end, index, tokens in rows
+        ])
+
+    def save_embeddings(self, start: int, vectors) -> None:
+        """Vectors of the embedding batch beginning at chunk `start`"""
+        directory = os.path.join(self.path, EMBEDDINGS)
+        os.makedirs(directory, exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix='.staging-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.vstack(vectors).astype(np.float32, copy=False))
+            os.replace(staging, os.path.join(directory, f'{start:06d}.npy'))
+        except BaseException:
+            _remove(staging)
+            raise
+
+    def load_embeddings(self) -> Dict[int, np.ndarray]:
+        """Completed embedding batches, by first chunk"""
+        directory = os.path.join(self.path, EMBEDDINGS)
+        batches = {}
+        for name in os.listdir(directory) if os.path.isdir(directory) else ():
+            if re.fullmatch(r'\d{6}\.npy', name):
+                batches[int(name[:6])] = np.load(os.path.join(directory, name))
+        return batches
+
+    def remove(self):
+        """Delete the checkpoint (the job has ended one way or another)"""
+        if self._lock_fd is not None:
+            _remove_locked(self.path, self._lock_fd)
+            self._lock_fd = None
+
+    def release(self):
+        """Give up the job without deleting it (another process may resume it)"""
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class CheckpointStore:
+    """Job checkpoints in a local directory (see Checkpoint)"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, document_id: str, source: DocumentSource, **fields) -> Optional[Checkpoint]:
+        """
+        Checkpoint a new job: copy its file and request fields to disk
+
+        Stages left by an interrupted run of the same file are kept and
+        reused; checkpoints of other files of the document are removed.
+
+        Args:
+            document_id: Document ID
+            source: The uploaded file
+            **fields: Request fields needed to run the job again
+
+        Returns:
+            The locked checkpoint, or None if a live job holds it already
+        """
+        file = as_file(source)
+        digest = hashlib.sha256()
+        f = open(file, 'rb') if isinstance(file, str) else file
+        try:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        finally:
+            if isinstance(file, str):
+                f.close()
+        file_hash = digest.hexdigest()
+
+        prefix = _safe_name(document_id) + '-'
+        path = os.path.join(self.directory, prefix + file_hash[:16])
+        for name in os.listdir(self.directory):
+            other = os.path.join(self.directory, name)
+            if name.startswith(prefix) and other != path:
+                stale = self._lock(other)
+                if stale is not None:
+                    _remove_locked(other, stale)
+
+        if os.path.isdir(path):
+            lock_fd = self._lock(path)
+            if lock_fd is None:
+                return None  # A live job of the same file
+            try:
+                checkpoint = Checkpoint(path, lock_fd)
+                logger.info(f"♻️ [CHECKPOINT] Reusing the checkpoint of an interrupted run of {document_id}")
+                return checkpoint
+            except (OSError, ValueError):
+                _remove_locked(path, lock_fd)
+
+        # Written under a temporary name, so a job directory is always complete
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+        lock_fd = self._lock(staging)
+        try:
+            with open(os.path.join(staging, SOURCE), 'wb') as out:
+                if isinstance(file, str):
+                    with open(file, 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                else:
+                    file.seek(0)
+                    shutil.copyfileobj(file, out)
+            _write_json(os.path.join(staging, JOB), {
+                'document_id': document_id,
+                'file_hash': file_hash,
+                'created_at': time.time(),
+                'fingerprint': None,
+                **fields,
+            })
+            try:
+                os.rename(staging, path)
+            except OSError:
+                _remove_locked(staging, lock_fd)
+                return None  # Created by another worker meanwhile
+            return Checkpoint(path, lock_fd)
+        except BaseException:
+            _remove_locked(staging, lock_fd)
+            raise
+        finally:
+            if not isinstance(file, str):
+                file.seek(0)
+
+    def orphaned(self) -> Iterator[Checkpoint]:
+        """
+        Checkpoints of jobs whose process died, locked for the caller
+
+        Leftovers of a crash while a checkpoint was being created are removed.
+        """
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            lock_fd = self._lock(path)
+            if lock_fd is None:
+                continue  # A live job
+            try:
+                if name.startswith('.staging-'):
+                    raise ValueError("incomplete")
+                checkpoint = Checkpoint(path, lock_fd)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ [CHECKPOINT] Removing unusable checkpoint {name}: {e}")
+                _remove_locked(path, lock_fd)
+                continue
+            yield checkpoint
+
+    def _lock(self, path: str) -> Optional[int]:
+        """Exclusive flock on a job directory (None if another job holds it)"""
+        try:
+            fd = os.open(os.path.join(path, LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            return None  # Removed meanwhile
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+
+def _remove_locked(path: str, lock_fd: int):
+    """Delete a job directory, then drop the lock held on it"""
+    shutil.rmtree(path, ignore_errors=True)
+    os.close(lock_fd)
+
+
+def _safe_name(document_id: str) -> str:
+    """Readable prefix plus a hash of the ID, so no two documents share a name or a prefix"""
+    prefix = re.sub(r'[^A-Za-z0-9_]', '_', document_id)[:40]
+    return f"{prefix}-{hashlib.sha256(document_id.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _write_json(path: str, data):
+    fd, staging = tempfile.mkstemp(prefix='.staging-', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(staging, path)
+
+
+def _write_gzip_json(path: str, data):
+    fd, staging = tempfile.mkstemp(prefix='.staging-', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as f:
+            f.write(json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'))
+        os.replace(staging, path)
+    except BaseException:
+        _remove(staging)
+        raise
+
+
+def _read_gzip_json(path: str):
+    try:
+        with gzip.open(path, 'rb') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_checkpoint_store: Optional[CheckpointStore] = None
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Process-wide checkpoint store, created on first use"""
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        _checkpoint_store = CheckpointStore(settings.CHECKPOINT_DIR)
+    return _checkpoint_store
@@ -0,0 +1,124 @@
+"""NDJSON streaming of stored chunks with keyset pagination"""
+import asyncio
+import base64
+import binascii
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+import numpy as np
+from app.config import settings
+from app.database.client import CHUNK_COLUMNS, get_database_client
+
+# Returned when the caller doesn't choose: everything but the embedding
+DEFAULT_FIELDS = [column for column in CHUNK_COLUMNS if column != 'embedding']
+
+EMBEDDING_FORMATS = ('base64', 'float')
+
+Cursor = Tuple[str, int, str]
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """
+    Columns for a comma-separated `fields` parameter (None = DEFAULT_FIELDS)
+
+    Raises:
+        ValueError: If a field is unknown
+    """
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in CHUNK_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(CHUNK_COLUMNS)}")
+    return selected
+
+
+def encode_cursor(row: dict) -> str:
+    """Opaque cursor positioned after a row"""
+    key = json.dumps([row['documentId'], row['chunkIndex'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if not cursor:
+        return None
+    try:
+        document_id, chunk_index, chunk_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(document_id), int(chunk_index), str(chunk_id)
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+async def stream_chunks(
+    fields: List[str],
+    document_id: Optional[str] = None,
+    subject_id: Optional[str] = None,
+    cursor: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+    embedding_format: str = 'base64',
+) -> AsyncIterator[bytes]:
+    """
+    NDJSON lines: one chunk object per line, then one `{"next_cursor": ...}`
+    line (null once the end is reached)
+
+    Rows are read one page (CHUNK_STREAM_PAGE_SIZE) at a time, so memory
+    stays constant however many chunks are streamed. The key fields (id,
+    documentId, chunkIndex) are always included. Embeddings, when selected,
+    are float32 little-endian bytes in base64, or float arrays with
+    embedding_format="float".
+
+    Args:
+        fields: Columns to return (see parse_fields)
+        document_id: Stream this document's chunks
+        subject_id: Stream the chunks of this subject's completed documents
+        cursor: Resume after this position
+        limit: Stop after this many chunks (None = all)
+        embedding_format: 'base64' or 'float'
+    """
+    db = get_database_client()
+    include_embedding = 'embedding' in fields
+    remaining = limit
+    last = None
+    exhausted = False
+
+    while remaining is None or remaining > 0:
+        page_size = settings.CHUNK_STREAM_PAGE_SIZE if remaining is None else min(remaining, settings.CHUNK_STREAM_PAGE_SIZE)
+        rows = await asyncio.to_thread(
+            db.fetch_chunk_page,
+            fields,
+            document_id=document_id,
+            subject_id=subject_id,
+            after=cursor,
+            limit=page_size,
+        )
+        lines = []
+        for row in rows:
+            if include_embedding:
+                row['embedding'] = _encode_embedding(row['embedding'], embedding_format)
+            lines.append(json.dumps({field: row[field] for field in row}, ensure_ascii=False))
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+        if rows:
+            last = rows[-1]
+            cursor = (last['documentId'], last['chunkIndex'], last['id'])
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < page_size:
+            exhausted = True
+            break
+
+    next_cursor = None if exhausted or last is None else encode_cursor(last)
+    yield (json.dumps({'next_cursor': next_cursor}) + '\n').encode('utf-8')
+
+
+def _encode_embedding(value, embedding_format: str):
+    if value is None:
+        return None
+    vector = np.asarray(json.loads(value) if isinstance(value, (str, bytes)) else value, dtype='<f4')
+    if embedding_format == 'float':
+        return vector.tolist()
+    return base64.b64encode(vector.tobytes()).decode('ascii')
@@ -1,142 +1,387 @@
 """Main document processing service"""
-import os
+import asyncio
+import hashlib
 import shutil
-from typing import Dict, Optional
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, Optional
+import numpy as np
 from loguru import logger
-from app.parsers import PDFParser, DOCXParser, ExcelParser
-from app.chunking import SmartChunker
-from app.embeddings import OpenAIEmbedder
-from app.database.client import DatabaseClient
+from app.parsers.isolated import create_parser, parse_isolated, warm_up as warm_up_isolated
+from app.parsers.sources import DOCX, EXCEL, PDF, DocumentSource, as_file, describe, detect_type
+from app.chunking import ChunkSet, SmartChunker
+from app.embeddings import get_embedder
+from app.database.client import get_database_client
+from app.events import DOCUMENT_COMPLETED, publish_subject_change
+from app.retrieval import get_retrieval_service
+from app.services.checkpoints import Checkpoint
+from app.services.jobs import Job, JobCancelled
 from app.config import settings
+from app.logging_config import log_stage
 
 
 class DocumentProcessor:
     """Main service for processing documents"""
     
     def __init__(self):
-        self.pdf_parser = PDFParser()
-        self.docx_parser = DOCXParser()
-        self.excel_parser = ExcelParser()
+        # Parsers (and their libraries) are created on the first file of each type
+        self._parsers: Dict[str, object] = {}
         self.chunker = SmartChunker(
             chunk_size=settings.CHUNK_SIZE,
             chunk_overlap=settings.CHUNK_OVERLAP,
         )
-        self.embedder = OpenAIEmbedder()
-        self.db = DatabaseClient()
+        self.embedder = get_embedder()
+        self.db = get_database_client()
+        # Subscribes to subject changes: completed documents are merged into the shared index store
+        get_retrieval_service()
     
     async def process_document(
         self,
-        file_path: str,
+        source: DocumentSource,
         document_id: str,
         subject_id: str,
         document_type: str,
         user_id: Optional[str] = None,
         original_filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+        job: Optional[Job] = None,
+        checkpoint: Optional[Checkpoint] = None,
     ) -> Dict:
         """
         Process a document: parse → chunk → embed → save
         
         Args:
-            file_path: Path to uploaded file
+            source: Uploaded file (path, bytes or binary file object)
             document_id: Document ID from NestJS
             subject_id: Subject ID
             document_type: Document type
             user_id: User ID
             original_filename: Original file name
+            content_type: Declared MIME type of the upload
+            job: Deadline and cancellation checkpoints (None = run to the end)
+            checkpoint: On-disk job state: completed stages and embedding
+                batches are restored from it and new ones written to it
         
         Returns:
             Dict with processing results
+        
+        Raises:
+            JobCancelled: If the job was cancelled or timed out (the document
+                status is left to the caller)
         """
-        logger.info(f"🔍 [PROCESSOR] Starting processing for document {document_id}")
-        logger.info(f"📁 [PROCESSOR] File path: {file_path}")
+        logger.info(f"🔍 [PROCESSOR] Starting processing")
+        logger.info(f"📁 [PROCESSOR] File: {original_filename or describe(source)}, content type: {content_type}")
         logger.info(f"📋 [PROCESSOR] Subject ID: {subject_id}, Type: {document_type}")
         
+        timings: Dict[str, float] = {}  # Seconds per pipeline stage
+        
         try:
-            # 1. Parse document
-            logger.info(f"📖 [PROCESSOR] Step 1: Parsing document...")
-            parsed_data = await self._parse_document(file_path)
-            logger.info(f"✅ [PROCESSOR] Parsed document: {len(parsed_data['chapters'])} chapters")
-            logger.info(f"📊 [PROCESSOR] Total content length: {sum(len(ch.get('content', '')) for ch in parsed_data['chapters'])} chars")
+            file_type = detect_type(source, original_filename, content_type)
             
-            # 2. Chunk chapters
-            logger.info(f"✂️ [PROCESSOR] Step 2: Chunking chapters...")
-            all_chunks = []
-            for idx, chapter in enumerate(parsed_data['chapters']):
-                logger.info(f"📑 [PROCESSOR] Chunking chapter {idx + 1}/{len(parsed_data['chapters'])}: {chapter.get('title', 'Untitled')}")
-                chunks = self.chunker.chunk_chapter(chapter)
-                all_chunks.extend(chunks)
-                logger.info(f"✅ [PROCESSOR] Chapter {idx + 1} → {len(chunks)} chunks")
+            content_hash = None
+            if checkpoint is not None:
+                # Stages of an interrupted run are only reused under the same settings
+                content_hash = await asyncio.to_thread(self._fingerprint, source, file_type)
+                await asyncio.to_thread(checkpoint.bind, content_hash)
             
-            logger.info(f"✅ [PROCESSOR] Created total {len(all_chunks)} chunks")
+            # 0. Identical file already processed? Clone its chunks instead
+            if settings.DEDUP_ENABLED:
+                with _stage('dedup', timings):
+                    if content_hash is None:
+                        content_hash = await asyncio.to_thread(self._fingerprint, source, file_type)
+                    try:
+                        duplicate = await asyncio.to_thread(self.db.clone_duplicate_chunks, document_id, content_hash)
+                    except Exception as e:
+                        # Dedup is an optimization: never fail the upload because of it
+                        logger.warning(f"⚠️ [PROCESSOR] Duplicate lookup failed, processing normally: {e}")
+                        duplicate = None
+                    if duplicate:
+                        logger.info(
+                            f"♻️ [PROCESSOR] Duplicate of {duplicate['source_document_id']}: "
+                            f"cloned {duplicate['chunks_count']} chunks"
+                        )
+                        # As after a save: rows of a previous run are tombstoned, the clone merged
+                        publish_subject_change(subject_id, document_id, DOCUMENT_COMPLETED)
+                        return {
+                            'status': 'success',
+                            'document_id': document_id,
+                            'chunks_count': duplicate['chunks_count'],
+                            'deduplicated_from': duplicate['source_document_id'],
+                            'timings': timings,
+                        }
+                    await asyncio.to_thread(self.db.set_content_hash, document_id, content_hash)
             
-            # Limit chunks if too many
-            if len(all_chunks) > settings.MAX_CHUNKS_PER_DOCUMENT:
-                logger.warning(
-                    f"Limiting chunks from {len(all_chunks)} to {settings.MAX_CHUNKS_PER_DOCUMENT}"
+            # 1. Parse document
+            _check(job)
+            with _stage('parse', timings):
+                parsed_data = await asyncio.to_thread(checkpoint.load_parsed) if checkpoint else None
+                if parsed_data is not None:
+                    logger.info(f"⏩ [PROCESSOR] Step 1: Parsed document restored from checkpoint")
+                else:
+                    logger.info(f"📖 [PROCESSOR] Step 1: Parsing document...")
+                    parsed_data = await self._parse_document(source, file_type, job)
+                    await _save_checkpoint(checkpoint and checkpoint.save_parsed, parsed_data)
+                chapters = parsed_data['chapters']
+                logger.info(f"✅ [PROCESSOR] Parsed document: {len(chapters)} chapters")
+                normalization = parsed_data.get('normalization')
+                if normalization:
+                    logger.info(
+                        f"🧹 [PROCESSOR] Normalized text: {normalization['chars_saved']} chars "
+                        f"(~{normalization['tokens_saved']} tokens) saved, "
+                        f"{normalization['boilerplate_lines']} header/footer lines dropped, "
+                        f"{normalization['rejoined_lines']} wrapped lines rejoined"
+                    )
+                logger.opt(lazy=True).debug(
+                    "📊 [PROCESSOR] Total content length: {} chars",
+                    lambda: sum(len(ch.get('content', '')) for ch in chapters),
                 )
-                all_chunks = all_chunks[:settings.MAX_CHUNKS_PER_DOCUMENT]
-            
-            # 3. Generate embeddings (batch for efficiency)
-            logger.info(f"🧮 [PROCESSOR] Step 3: Generating embeddings for {len(all_chunks)} chunks...")
-            chunk_texts = [chunk['content'] for chunk in all_chunks]
             
-            # Process in batches of 10 to avoid rate limits
-            batch_size = 10
-            embeddings = []
-            total_batches = (len(chunk_texts) + batch_size - 1) // batch_size
-            
-            for i in range(0, len(chunk_texts), batch_size):
-                batch = chunk_texts[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
-                logger.info(f"🔄 [PROCESSOR] Generating embeddings batch {batch_num}/{total_batches} ({len(batch)} chunks)...")
-                batch_embeddings = await self.embedder.embed_batch(batch)
-                embeddings.extend(batch_embeddings)
-                logger.info(f"✅ [PROCESSOR] Batch {batch_num} complete: {len(batch_embeddings)} embeddings generated")
+            # 2. Chunk chapters
+            with _stage('chunk', timings):
+                all_chunks = await asyncio.to_thread(checkpoint.load_chunks, chapters) if checkpoint else None
+                if all_chunks is not None:
+                    logger.info(f"⏩ [PROCESSOR] Step 2: {len(all_chunks)} chunks restored from checkpoint")
+                else:
+                    all_chunks = self._chunk(chapters, job)
+                    await _save_checkpoint(checkpoint and checkpoint.save_chunks, all_chunks, chapters)
             
-            logger.info(f"✅ [PROCESSOR] Generated total {len(embeddings)} embeddings")
+            # 3. Generate embeddings (batch for efficiency)
+            _check(job)
+            with _stage('embed', timings):
+                logger.info(f"🧮 [PROCESSOR] Step 3: Generating embeddings for {len(all_chunks)} chunks...")
+                embeddings = await self._embed(all_chunks.texts(), job, checkpoint)
+                
+                # One contiguous float32 matrix for the whole document
+                all_chunks.set_embeddings(embeddings)
+                del embeddings
+                
+                logger.info(
+                    f"✅ [PROCESSOR] Generated total {len(all_chunks)} embeddings "
+                    f"({all_chunks.nbytes / 1024:.0f} KB)"
+                )
+
+            # 4. Save to database: one transaction, rolled back if the job is
+            # cancelled before its commit (cancelling doesn't interrupt it)
+            _check(job)
+            with _stage('save', timings), (job.atomic() if job else nullcontext()):
+                logger.info(f"💾 [PROCESSOR] Step 4: Saving {len(all_chunks)} chunks to database...")
+                saved_count = await asyncio.to_thread(
+                    self.db.save_chunks,
+                    document_id=document_id,
+                    chunks=all_chunks,
+                    subject_id=subject_id,
+                    document_type=document_type,
+                    user_id=user_id,
+                    original_filename=original_filename,
+                    before_commit=job.begin_commit if job else None,
+                )
             
-            # Add embeddings to chunks
-            for idx, chunk in enumerate(all_chunks):
-                chunk['embedding'] = embeddings[idx]
+            # New searchable content, published from the event loop (listeners
+            # schedule index refreshes on it), not from the DB worker thread
+            publish_subject_change(subject_id, document_id, DOCUMENT_COMPLETED)
             
-            # 4. Save to database
-            logger.info(f"💾 [PROCESSOR] Step 4: Saving {len(all_chunks)} chunks to database...")
-            logger.info(f"📋 [PROCESSOR] Document ID: {document_id}, Subject ID: {subject_id}")
-            saved_count = self.db.save_chunks(
-                document_id=document_id,
-                chunks=all_chunks,
-                subject_id=subject_id,
-                document_type=document_type,
-                user_id=user_id,
-                original_filename=original_filename,
+            logger.bind(timings=timings).info(
+                f"✅ [PROCESSOR] Successfully processed: saved {saved_count}/{len(all_chunks)} chunks "
+                f"in {sum(timings.values()):.2f}s"
             )
             
-            logger.info(f"✅ [PROCESSOR] Successfully processed document {document_id}")
-            logger.info(f"📊 [PROCESSOR] Saved {saved_count}/{len(all_chunks)} chunks to database")
-            
             return {
                 'status': 'success',
                 'document_id': document_id,
                 'chunks_count': saved_count,
-                'chapters_count': len(parsed_data['chapters']),
+                'chapters_count': len(chapters),
                 'metadata': parsed_data.get('metadata', {}),
+                'normalization': parsed_data.get('normalization'),
+                'timings': timings,
             }
             
+        except JobCancelled:
+            raise
         except Exception as e:
-            logger.error(f"❌ Error processing document {document_id}: {e}")
-            self.db._update_document_status(document_id, 'FAILED', error=str(e))
+            logger.error(f"❌ Error processing document: {e}")
+            try:
+                await asyncio.to_thread(self.db._update_document_status, document_id, 'FAILED', error=str(e))
+            except Exception as update_error:
+                logger.error(f"❌ [PROCESSOR] Failed to update document status: {update_error}")
             raise
     
-    async def _parse_document(self, file_path: str) -> Dict:
-        """Parse document based on file type"""
-        file_ext = os.path.splitext(file_path)[1].lower()
+    def _chunk(self, chapters, job: Optional[Job] = None) -> ChunkSet:
+        """Chunk every chapter, capped at MAX_CHUNKS_PER_DOCUMENT"""
+        logger.info(f"✂️ [PROCESSOR] Step 2: Chunking {len(chapters)} chapters...")
+        all_chunks = ChunkSet()
+        for idx, chapter in enumerate(chapters):
+            _check(job)
+            chunks = self.chunker.chunk_chapter(chapter)
+            all_chunks.extend(chunks)
+            # Arguments are only formatted if DEBUG is enabled
+            logger.debug(
+                "📑 [PROCESSOR] Chapter {}/{} ({}) → {} chunks",
+                idx + 1, len(chapters), chapter.get('title', 'Untitled'), len(chunks),
+            )
+        
+        logger.info(f"✅ [PROCESSOR] Created total {len(all_chunks)} chunks")
+        
+        # Limit chunks if too many
+        if len(all_chunks) > settings.MAX_CHUNKS_PER_DOCUMENT:
+            logger.warning(
+                f"Limiting chunks from {len(all_chunks)} to {settings.MAX_CHUNKS_PER_DOCUMENT}"
+            )
+            all_chunks.truncate(settings.MAX_CHUNKS_PER_DOCUMENT)
+        return all_chunks
+    
+    async def _embed(self, texts, job: Optional[Job] = None, checkpoint: Optional[Checkpoint] = None):
+        """
+        Embeddings of every text, as one float32 matrix
         
-        if file_ext == '.pdf':
-            return self.pdf_parser.parse(file_path)
-        elif file_ext in ['.docx', '.doc']:
-            return self.docx_parser.parse(file_path)
-        elif file_ext in ['.xlsx', '.xls']:
-            return self.excel_parser.parse(file_path)
+        Texts go out in EMBEDDING_BATCH_SIZE batches, all submitted at once:
+        the shared batcher merges them with other jobs' texts into full-size
+        API calls under the rate-limit scheduler. Each finished batch is
+        checkpointed, and batches restored from the checkpoint are not sent
+        again. Texts not yet sent are dropped from the batcher if the job stops.
+        """
+        batch_size = max(settings.EMBEDDING_BATCH_SIZE, 1)
+        done: Dict[int, np.ndarray] = {}
+        if checkpoint is not None:
+            for start, vectors in (await asyncio.to_thread(checkpoint.load_embeddings)).items():
+                # Batches of another batch size (setting changed) don't line up: redo them
+                if start % batch_size == 0 and len(vectors) == len(texts[start:start + batch_size]):
+                    done[start] = vectors
+            if done:
+                logger.info(
+                    f"⏩ [PROCESSOR] {sum(len(vectors) for vectors in done.values())}/{len(texts)} "
+                    f"embeddings restored from checkpoint"
+                )
+        
+        async def embed(start: int):
+            vectors = np.vstack(await self.embedder.embed_batch(texts[start:start + batch_size]))
+            await _save_checkpoint(checkpoint and checkpoint.save_embeddings, start, vectors)
+            done[start] = vectors
+        
+        tasks = [
+            asyncio.ensure_future(embed(start))
+            for start in range(0, len(texts), batch_size)
+            if start not in done
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout=job.remaining() if job else None)
+        except asyncio.TimeoutError:
+            _check(job)  # Deadline reached: JobCancelled
+            raise
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        return np.vstack([done[start] for start in sorted(done)]) if done else []
+    
+    def _fingerprint(self, source: DocumentSource, file_type: str) -> str:
+        """
+        sha256 of the file bytes plus every setting that shapes the stored chunks
+        
+        Changing the embedding model, dimensions, chunking or normalization
+        settings yields a new fingerprint, so files processed under old
+        settings are not reused.
+        """
+        digest = hashlib.sha256()
+        if isinstance(source, (bytes, bytearray)):
+            digest.update(source)
         else:
-            raise ValueError(f"Unsupported file type: {file_ext}")
+            file = as_file(source)
+            f = open(file, 'rb') if isinstance(file, str) else file
+            try:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            finally:
+                if isinstance(file, str):
+                    f.close()
+                else:
+                    file.seek(0)
+        
+        pipeline = '|'.join(str(value) for value in (
+            file_type,
+            settings.OPENAI_EMBEDDING_MODEL,
+            settings.OPENAI_EMBEDDING_DIMENSIONS,
+            settings.CHUNK_SIZE,
+            settings.CHUNK_OVERLAP,
+            settings.MAX_CHUNKS_PER_DOCUMENT,
+            settings.DOCX_STREAMING,
+            settings.EXCEL_STREAMING,
+            settings.EXCEL_ROWS_PER_CHAPTER,
+            settings.TEXT_NORMALIZATION,
+            settings.BOILERPLATE_MIN_PAGE_RATIO,
+        ))
+        digest.update(pipeline.encode('utf-8'))
+        return digest.hexdigest()
+    
+    async def _parse_document(self, source: DocumentSource, file_type: str, job: Optional[Job] = None) -> Dict:
+        """
+        Parse document with the parser for its detected type
+        
+        With PARSE_IN_SUBPROCESS the parser runs in a child process that is
+        killed at the job's deadline or when the job is cancelled.
+        """
+        if not settings.PARSE_IN_SUBPROCESS:
+            return self._get_parser(file_type).parse(source)
+        
+        try:
+            return await parse_isolated(
+                source,
+                file_type,
+                timeout=job.remaining() if job else settings.PROCESSING_TIMEOUT,
+            )
+        except TimeoutError:
+            _check(job)  # Deadline reached: JobCancelled
+            raise
+    
+    def warm_up(self):
+        """Create every parser (or the parse forkserver) now instead of on the first file"""
+        if settings.PARSE_IN_SUBPROCESS:
+            warm_up_isolated()
+            return
+        for file_type in (PDF, DOCX, EXCEL):
+            self._get_parser(file_type)
+    
+    def _get_parser(self, file_type: str):
+        """Parser for a file type, importing its library on first use"""
+        parser = self._parsers.get(file_type)
+        if parser is None:
+            parser = self._parsers[file_type] = create_parser(file_type)
+        return parser
+
+
+async def _save_checkpoint(save: Optional[Callable], *args):
+    """Write a checkpoint stage; a failed write only costs the ability to resume"""
+    if save is None:
+        return
+    try:
+        await asyncio.to_thread(save, *args)
+    except Exception as e:
+        logger.warning(f"⚠️ [PROCESSOR] Checkpoint write failed: {e}")
+
+
+def _check(job: Optional[Job]):
+    """Cancellation and deadline checkpoint (no-op without a job)"""
+    if job is not None:
+        job.check()
+
+
+@contextmanager
+def _stage(name: str, timings: Dict[str, float]) -> Iterator[None]:
+    """Tag logs with a pipeline stage and record its wall time"""
+    started = time.perf_counter()
+    try:
+        with log_stage(name):
+            yield
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+_processor: Optional[DocumentProcessor] = None
+
 
+def get_processor() -> DocumentProcessor:
+    """Process-wide document processor, created on first use"""
+    global _processor
+    if _processor is None:
+        _processor = DocumentProcessor()
+    return _processor
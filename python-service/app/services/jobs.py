@@ -0,0 +1,261 @@
+"""In-flight processing jobs: deadlines, cancellation and slot reclaiming"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+from loguru import logger
+from app.config import settings
+from app.services.admission import Ticket
+
+T = TypeVar('T')
+
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed out'
+SUPERSEDED = 'superseded'  # The same document was uploaded again
+
+
+class JobCancelled(Exception):
+    """A job was cancelled, superseded or ran past its deadline"""
+
+    def __init__(self, document_id: str, reason: str):
+        super().__init__(f"Processing {reason}")
+        self.document_id = document_id
+        self.reason = reason
+
+
+class Job:
+    """
+    One document being processed
+
+    The deadline (PROCESSING_TIMEOUT) starts when the job gets a processing
+    slot, not when it is queued. Work stops at the next checkpoint after a
+    cancellation: the job's task is cancelled outright, except inside
+    `atomic()` where only the flag is set and the code must call
+    `begin_commit()` before committing, so a transaction is either rolled
+    back or completes, never half-applied.
+    """
+
+    def __init__(self, document_id: str, subject_id: Optional[str], lane: str):
+        self.document_id = document_id
+        self.subject_id = subject_id
+        self.lane = lane
+        self.state = 'queued'  # queued -> running -> done
+        self.queued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.cancelled: Optional[str] = None
+        self.committing = False
+        self.reclaimed = False
+        self.task: Optional[asyncio.Task] = None
+        self.ticket: Optional[Ticket] = None
+        self._atomic = False
+        self._lock = threading.Lock()  # begin_commit() runs in a DB worker thread
+
+    def start(self, timeout: float):
+        self.state = 'running'
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + timeout
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (the full timeout while queued)"""
+        if self.deadline is None:
+            return float(settings.PROCESSING_TIMEOUT)
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        """
+        Checkpoint between units of work
+
+        Raises:
+            JobCancelled: If the job was cancelled or its deadline has passed
+        """
+        if self.cancelled is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancelled = TIMED_OUT
+        if self.cancelled is not None:
+            raise JobCancelled(self.document_id, self.cancelled)
+
+    def begin_commit(self):
+        """
+        Last checkpoint before a commit; later cancellations are refused
+
+        Raises:
+            JobCancelled: If the job was cancelled or its deadline has passed
+        """
+        with self._lock:
+            self.check()
+            self.committing = True
+
+    @contextmanager
+    def atomic(self) -> Iterator[None]:
+        """Cancellation only sets the flag (checked by begin_commit) while inside"""
+        self._atomic = True
+        try:
+            yield
+        finally:
+            self._atomic = False
+
+    def cancel(self, reason: str = CANCELLED) -> bool:
+        """
+        Stop the job at its next checkpoint
+
+        Returns:
+            False if the job is already committing its results
+        """
+        with self._lock:
+            if self.committing:
+                return False
+            if self.cancelled is None:
+                self.cancelled = reason
+        if not self._atomic and self.task is not None and not self.task.done():
+            self.task.cancel()
+        return True
+
+    def info(self) -> Dict:
+        now = time.monotonic()
+        return {
+            'document_id': self.document_id,
+            'subject_id': self.subject_id,
+            'lane': self.lane,
+            'state': self.state,
+            'cancelled': self.cancelled,
+            'seconds_queued': round((self.started_at or now) - self.queued_at, 1),
+            'seconds_running': round(now - self.started_at, 1) if self.started_at else None,
+            'seconds_left': round(self.deadline - now, 1) if self.deadline else None,
+        }
+
+
+class JobRegistry:
+    """
+    Processing jobs by document ID, with a watchdog enforcing deadlines
+
+    The watchdog cancels jobs past their deadline. A job that still hasn't
+    stopped `grace` seconds later (stuck in blocking code that no
+    checkpoint reaches) has its admission slot released anyway, so stuck
+    jobs can't starve the queue; the job itself is left to finish or fail.
+    """
+
+    def __init__(self, timeout: float, grace: float):
+        """
+        Args:
+            timeout: Seconds a job may run once it has a processing slot
+            grace: Seconds after the deadline before the slot is reclaimed
+        """
+        self.timeout = timeout
+        self.grace = grace
+        self._jobs: Dict[str, Job] = {}
+        self._watchdog: Optional[asyncio.Task] = None
+        self._stats = {'completed': 0, 'failed': 0, CANCELLED: 0, TIMED_OUT: 0, SUPERSEDED: 0, 'reclaimed': 0}
+
+    def register(self, document_id: str, subject_id: Optional[str], ticket: Ticket) -> Job:
+        """Track a newly admitted job (a job already in flight for the document is superseded)"""
+        previous = self._jobs.get(document_id)
+        if previous is not None and previous.cancel(SUPERSEDED):
+            logger.warning(f"🛑 [JOBS] Document {document_id} uploaded again: cancelling the previous run")
+
+        job = Job(document_id, subject_id, ticket.lane)
+        job.ticket = ticket
+        self._jobs[document_id] = job
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch())
+        return job
+
+    def get(self, document_id: str) -> Optional[Job]:
+        return self._jobs.get(document_id)
+
+    def cancel(self, document_id: str, reason: str = CANCELLED) -> Optional[bool]:
+        """
+        Returns:
+            None if no job is in flight for the document, False if it is
+            already committing, True once cancellation was requested
+        """
+        job = self._jobs.get(document_id)
+        if job is None:
+            return None
+        cancelled = job.cancel(reason)
+        if cancelled:
+            logger.warning(f"🛑 [JOBS] Cancelling document {document_id} ({job.state}): {reason}")
+        return cancelled
+
+    async def run(self, job: Job, work: Callable[[Job], Awaitable[T]]) -> T:
+        """
+        Wait for the job's slot, then run `work(job)` under its deadline
+
+        Raises:
+            JobCancelled: If the job was cancelled, superseded or timed out
+        """
+        job.task = asyncio.create_task(self._run(job, work))
+        try:
+            result = await job.task
+            self._stats['completed'] += 1
+            return result
+        except asyncio.CancelledError:
+            if job.cancelled is None:
+                # The caller itself was cancelled: take the job down with it
+                job.task.cancel()
+                raise
+            self._stats[job.cancelled] += 1
+            raise JobCancelled(job.document_id, job.cancelled) from None
+        except JobCancelled:
+            self._stats[job.cancelled] += 1
+            raise
+        except Exception:
+            self._stats['failed'] += 1
+            raise
+        finally:
+            job.state = 'done'
+            if self._jobs.get(job.document_id) is job:
+                del self._jobs[job.document_id]
+
+    async def _run(self, job: Job, work: Callable[[Job], Awaitable[T]]) -> T:
+        if job.cancelled is not None:
+            # Cancelled before it was picked up: give back its place in the queue
+            job.ticket.cancel()
+            job.check()
+        async with job.ticket:
+            job.check()  # Cancelled while waiting for a slot
+            job.start(self.timeout)
+            return await work(job)
+
+    async def _watch(self):
+        interval = min(max(self.timeout / 20, 0.5), 5.0)
+        while self._jobs:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for job in list(self._jobs.values()):
+                if job.state != 'running' or now < job.deadline:
+                    continue
+                if job.cancelled is None and job.cancel(TIMED_OUT):
+                    logger.warning(
+                        f"⏱️ [JOBS] Document {job.document_id} exceeded {self.timeout:.0f}s "
+                        f"(stage still running): cancelling"
+                    )
+                elif not job.reclaimed and now >= job.deadline + self.grace:
+                    job.reclaimed = True
+                    self._stats['reclaimed'] += 1
+                    job.ticket.cancel()
+                    logger.error(
+                        f"🧟 [JOBS] Document {job.document_id} ignored cancellation for {self.grace:.0f}s: "
+                        f"processing slot reclaimed"
+                    )
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            'timeout_seconds': self.timeout,
+            'in_flight': [job.info() for job in self._jobs.values()],
+        }
+
+
+_registry: Optional[JobRegistry] = None
+
+
+def get_job_registry() -> JobRegistry:
+    """Process-wide job registry, created on first use"""
+    global _registry
+    if _registry is None:
+        _registry = JobRegistry(
+            timeout=float(settings.PROCESSING_TIMEOUT),
+            grace=float(settings.PROCESSING_CANCEL_GRACE),
+        )
+    return _registry
@@ -0,0 +1,421 @@
+"""Re-embedding backfill: move stored chunks to another embedding model or size
+
+Usage:
+    python -m app.services.reembed run --model text-embedding-3-large --dimensions 1024 [--restart]
+    python -m app.services.reembed status [--model MODEL] [--dimensions N]
+    python -m app.services.reembed stop --model MODEL --dimensions N
+    python -m app.services.reembed promote [--model MODEL] [--dimensions N]
+    python -m app.services.reembed drop TAG
+    python -m app.services.reembed retag OLD_TAG NEW_TAG
+
+Vectors are tagged with their embedding space: the model, plus the size when
+it is below the model's native one (`text-embedding-3-large@1024`, see
+app.config.embedding_space). A backfill writes the target space's vectors to
+chunk_embeddings next to the current ones, so the service keeps searching the
+space it is configured for while the backfill runs. Switching over:
+
+    1. `run` until `status` shows the target space covers every chunk
+    2. set OPENAI_EMBEDDING_MODEL / OPENAI_EMBEDDING_DIMENSIONS to the target
+       and restart the workers: queries, new uploads and subject indexes
+       (rebuilt on first use) move to the new space together. Setting them
+       back is the rollback.
+    3. `run` again, for chunks uploaded under the old settings meanwhile
+    4. optionally `promote` (moves the vectors into chunks.embedding, keeping
+       the replaced ones under their own tag), then `drop` the old tag
+
+A run pages through chunks by primary key, embeds each page with up to
+EMBEDDING_BACKFILL_CONCURRENCY API calls in flight under its own rate budget
+(so live uploads keep theirs), and saves its cursor after every page. A
+stopped or crashed run resumes from the cursor; chunks that already have a
+vector in the target space are never embedded again.
+
+Rows stored before tags were meaningful all say `text-embedding-3-large`. A
+deployment that ran another model must `retag` them (then restart) first.
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from loguru import logger
+from app.chunking import vectors_json
+from app.config import embedding_space, parse_embedding_space, settings
+from app.database.client import get_database_client
+
+# Rows per transaction for promote, drop and retag
+MAINTENANCE_BATCH = 1000
+
+
+class BackfillRunning(Exception):
+    """A backfill to the same embedding space is already running"""
+
+
+class Backfill:
+    """
+    Re-embedding run toward one embedding space, with its progress on disk
+
+    Files in EMBEDDING_BACKFILL_DIR, named after the space:
+
+        <space>.json    progress: cursor (last chunk ID done), counts, state
+        <space>.lock    flock held by the process running the backfill
+        <space>.stop    asks that process to stop after its current page
+
+    Any process can read the progress or ask for a stop, so the API answers
+    from whichever worker gets the request.
+    """
+
+    def __init__(self, space: str, directory: Optional[str] = None):
+        """
+        Args:
+            space: Target embedding space tag
+            directory: Where progress is kept (default EMBEDDING_BACKFILL_DIR)
+
+        Raises:
+            ValueError: If the tag has no size and the model's native size is unknown
+        """
+        self.space = space
+        self.model, self.dimensions = parse_embedding_space(space)
+        if self.dimensions is None:
+            raise ValueError(f"Unknown native size of {self.model}: give the dimensions")
+        self.directory = directory or settings.EMBEDDING_BACKFILL_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.@-]', '_', space))
+        self._progress_path = base + '.json'
+        self._lock_path = base + '.lock'
+        self._stop_path = base + '.stop'
+        self._lock_fd: Optional[int] = None
+
+    def progress(self) -> Dict:
+        """Progress of the last run ('interrupted' if its process died)"""
+        try:
+            with open(self._progress_path) as f:
+                progress = json.load(f)
+        except FileNotFoundError:
+            progress = {'space': self.space, 'state': 'new', 'cursor': '', 'embedded': 0, 'pages': 0}
+        if progress['state'] == 'running' and self._lock_fd is None and not self.running():
+            progress['state'] = 'interrupted'
+        return progress
+
+    def running(self) -> bool:
+        """Whether a process (this one included) is running the backfill"""
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def acquire(self):
+        """
+        Claim the backfill for this process
+
+        Raises:
+            BackfillRunning: If another process is running it
+        """
+        if self._lock_fd is not None:
+            return
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise BackfillRunning(f"A backfill to {self.space} is already running")
+        self._lock_fd = fd
+
+    def release(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def request_stop(self) -> bool:
+        """
+        Ask the running backfill to stop after its current page
+
+        Returns:
+            False if no backfill to this space is running
+        """
+        if not self.running():
+            return False
+        with open(self._stop_path, 'w'):
+            pass
+        return True
+
+    async def run(self, restart: bool = False) -> Dict:
+        """
+        Embed every chunk that has no vector in the target space yet
+
+        Continues from the cursor of a stopped, failed or interrupted run; a
+        completed one is started over, which only costs a scan of the chunks.
+
+        Args:
+            restart: Start from the first chunk even if a cursor is saved
+
+        Returns:
+            Final progress
+
+        Raises:
+            BackfillRunning: If another process is running it
+        """
+        from app.embeddings import EmbeddingScheduler, OpenAIEmbedder
+
+        self.acquire()
+        _remove(self._stop_path)
+        progress = self.progress()
+        if restart or progress['state'] in ('new', 'completed'):
+            progress.update(cursor='', embedded=0, pages=0)
+        progress.update(state='running', error=None, started_at=time.time(), model=self.model, dimensions=self.dimensions)
+        self._save(progress)
+        logger.info(
+            f"🔁 [REEMBED] Backfilling {self.space} "
+            f"{'from chunk ' + progress['cursor'] if progress['cursor'] else 'from the start'}"
+        )
+
+        db = get_database_client()
+        page_size = max(settings.EMBEDDING_BACKFILL_PAGE_SIZE, 1)
+        embedder = None
+        started = time.monotonic()
+        embedded_this_run = 0
+        next_page = None
+        try:
+            embedder = OpenAIEmbedder(
+                model=self.model,
+                dimensions=self.dimensions,
+                scheduler=EmbeddingScheduler(
+                    requests_per_minute=settings.EMBEDDING_BACKFILL_REQUESTS_PER_MINUTE,
+                    tokens_per_minute=settings.EMBEDDING_BACKFILL_TOKENS_PER_MINUTE,
+                    max_concurrency=settings.EMBEDDING_BACKFILL_CONCURRENCY,
+                    min_concurrency=settings.EMBEDDING_MIN_CONCURRENCY,
+                    max_retries=settings.MAX_RETRIES,
+                    request_timeout=settings.EMBEDDING_REQUEST_TIMEOUT,
+                    base_delay=settings.EMBEDDING_RETRY_BASE_DELAY,
+                    max_delay=settings.EMBEDDING_RETRY_MAX_DELAY,
+                ),
+            )
+
+            # The next page is read while the current one is being embedded
+            next_page = asyncio.create_task(
+                asyncio.to_thread(db.scan_chunks_to_embed, self.space, progress['cursor'], page_size)
+            )
+            while True:
+                page = await next_page
+                next_page = None
+                if not page:
+                    progress['state'] = 'completed'
+                    break
+                next_page = asyncio.create_task(
+                    asyncio.to_thread(db.scan_chunks_to_embed, self.space, page[-1]['id'], page_size)
+                )
+
+                vectors = await self._embed(embedder, [row['content'] for row in page])
+                embeddings_json = vectors_json(vectors)
+                await asyncio.to_thread(db.save_chunk_embeddings, self.space, [
+                    {'chunk_id': row['id'], 'embedding': embeddings_json[i]} for i, row in enumerate(page)
+                ])
+
+                embedded_this_run += len(page)
+                elapsed = time.monotonic() - started
+                progress.update(
+                    cursor=page[-1]['id'],
+                    embedded=progress['embedded'] + len(page),
+                    pages=progress['pages'] + 1,
+                    chunks_per_minute=round(embedded_this_run / elapsed * 60, 1) if elapsed > 0 else None,
+                )
+                self._save(progress)
+
+                if os.path.exists(self._stop_path):
+                    progress['state'] = 'stopped'
+                    break
+        except asyncio.CancelledError:
+            progress['state'] = 'stopped'
+            raise
+        except Exception as e:
+            progress.update(state='failed', error=f"{type(e).__name__}: {e}")
+            logger.error(f"❌ [REEMBED] Backfill to {self.space} failed at chunk {progress['cursor'] or '(start)'}: {e}")
+            raise
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+            self._save(progress)
+            _remove(self._stop_path)
+            self.release()
+            if embedder is not None:
+                await embedder.client.close()
+
+        logger.info(
+            f"🔁 [REEMBED] Backfill to {self.space} {progress['state']}: "
+            f"{embedded_this_run} chunks embedded in {time.monotonic() - started:.0f}s"
+        )
+        return progress
+
+    async def _embed(self, embedder, texts: List[str]) -> np.ndarray:
+        """Vectors of a page, embedded in API-sized slices at once"""
+        size = max(settings.EMBEDDING_BATCH_SIZE, 1)
+        slices = await asyncio.gather(*(
+            embedder.embed_batch(texts[start:start + size]) for start in range(0, len(texts), size)
+        ))
+        vectors = np.vstack([vector for batch in slices for vector in batch]).astype(np.float32, copy=False)
+        if vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"{self.model} returned {vectors.shape[1]} dimensions instead of {self.dimensions}"
+            )
+        return vectors
+
+    def _save(self, progress: Dict):
+        progress['updated_at'] = time.time()
+        fd, staging = tempfile.mkstemp(prefix='.staging-', dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(progress, f)
+        os.replace(staging, self._progress_path)
+
+
+def target_space(model: Optional[str] = None, dimensions: Optional[int] = None) -> str:
+    """Space tag of a backfill target: the configured model by default, at its native size unless given"""
+    model = model or settings.OPENAI_EMBEDDING_MODEL
+    if not dimensions:
+        if model == settings.OPENAI_EMBEDDING_MODEL:
+            return embedding_space()
+        dimensions = parse_embedding_space(model)[1]
+        if dimensions is None:
+            raise ValueError(f"Unknown native size of {model}: give the dimensions")
+    return embedding_space(model, dimensions)
+
+
+def backfill_status(space: Optional[str] = None) -> Dict:
+    """
+    Progress of the backfill to a space and how much of the corpus it covers
+
+    Args:
+        space: Target embedding space (default: the configured one)
+    """
+    space = space or embedding_space()
+    coverage = get_database_client().embedding_coverage()
+    covered = coverage['stored'].get(space, 0) + coverage['backfilled'].get(space, 0)
+    return {
+        **Backfill(space).progress(),
+        'space': space,
+        'current_space': embedding_space(),
+        'covered': covered,
+        'chunks': coverage['chunks'],
+        'complete': covered >= coverage['chunks'],
+        'coverage': coverage,
+    }
+
+
+def promote(space: Optional[str] = None) -> int:
+    """
+    Move a space's backfilled vectors into chunks.embedding
+
+    Args:
+        space: Embedding space (default: the configured one)
+
+    Returns:
+        Number of chunks promoted
+    """
+    space = space or embedding_space()
+    db = get_database_client()
+    total = 0
+    while True:
+        promoted = db.promote_chunk_embeddings(space, MAINTENANCE_BATCH)
+        if not promoted:
+            break
+        total += promoted
+        logger.info(f"🔁 [REEMBED] Promoted {total} chunks to {space}")
+    return total
+
+
+def drop(space: str) -> int:
+    """
+    Delete a space's backfilled vectors
+
+    Raises:
+        ValueError: If it is the space the service is configured for
+    """
+    if space == embedding_space():
+        raise ValueError(f"{space} is the configured embedding space: search reads those vectors")
+    db = get_database_client()
+    total = 0
+    while True:
+        dropped = db.drop_chunk_embeddings(space, MAINTENANCE_BATCH)
+        if not dropped:
+            break
+        total += dropped
+    logger.info(f"🗑️ [REEMBED] Dropped {total} vectors of {space}")
+    return total
+
+
+def retag(old: str, new: str) -> int:
+    """Relabel chunks whose vectors were stored under the wrong tag (restart the workers afterwards)"""
+    db = get_database_client()
+    total = 0
+    while True:
+        changed = db.retag_chunk_embeddings(old, new, MAINTENANCE_BATCH)
+        if not changed:
+            break
+        total += changed
+    logger.info(f"🏷️ [REEMBED] Retagged {total} chunks from {old} to {new}")
+    return total
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_space(command_parser: argparse.ArgumentParser):
+        command_parser.add_argument('--model', help='Embedding model (default OPENAI_EMBEDDING_MODEL)')
+        command_parser.add_argument('--dimensions', type=int, help="Vector size (default: the model's native size)")
+
+    run_parser = commands.add_parser('run', help='Embed chunks missing from a space (resumes a stopped run)')
+    add_space(run_parser)
+    run_parser.add_argument('--restart', action='store_true', help='Start from the first chunk')
+    add_space(commands.add_parser('status', help='Progress and coverage of a space'))
+    add_space(commands.add_parser('stop', help='Stop the running backfill to a space'))
+    add_space(commands.add_parser('promote', help='Move backfilled vectors into chunks.embedding'))
+    drop_parser = commands.add_parser('drop', help="Delete a space's backfilled vectors")
+    drop_parser.add_argument('tag')
+    retag_parser = commands.add_parser('retag', help='Relabel vectors stored under the wrong tag')
+    retag_parser.add_argument('old')
+    retag_parser.add_argument('new')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command in ('drop', 'retag'):
+            space = None
+        else:
+            space = target_space(args.model, args.dimensions)
+        if args.command == 'run':
+            result = asyncio.run(Backfill(space).run(restart=args.restart))
+        elif args.command == 'status':
+            result = backfill_status(space)
+        elif args.command == 'stop':
+            result = {'space': space, 'stopping': Backfill(space).request_stop()}
+        elif args.command == 'promote':
+            result = {'space': space, 'promoted': promote(space)}
+        elif args.command == 'drop':
+            result = {'space': args.tag, 'dropped': drop(args.tag)}
+        else:
+            result = {'old': args.old, 'new': args.new, 'retagged': retag(args.old, args.new)}
+    except (ValueError, BackfillRunning) as e:
+        parser.exit(1, f"error: {e}\n")
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
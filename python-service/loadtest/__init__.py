@@ -0,0 +1 @@
+"""Load-testing harness: OpenAI stand-in, synthetic documents and the runner (see run.py)"""
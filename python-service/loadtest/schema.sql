@@ -0,0 +1,76 @@
+-- Minimal schema for load tests: the subjects/documents/chunks/chunk_embeddings
+-- columns the Python service reads and writes, as created by the backend's Prisma schema
+-- (backend/prisma/schema.prisma). Loaded by loadtest/docker-compose.yml.
+
+CREATE TABLE IF NOT EXISTS subjects (
+  id        VARCHAR(191) NOT NULL,
+  name      VARCHAR(191) NOT NULL,
+  grade     INT          NOT NULL,
+  createdAt DATETIME(3)  NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+  updatedAt DATETIME(3)  NOT NULL,
+  PRIMARY KEY (id),
+  UNIQUE KEY subjects_name_grade_key (name, grade)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS documents (
+  id               VARCHAR(191) NOT NULL,
+  subjectId        VARCHAR(191) NOT NULL,
+  type             ENUM('TEXTBOOK', 'TEACHER_MATERIAL') NOT NULL,
+  content          LONGTEXT     NULL,
+  embedding        JSON         NULL,
+  chunkIndex       INT          NULL,
+  originalFileName VARCHAR(191) NULL,
+  filePath         VARCHAR(191) NULL,
+  fileSize         INT          NULL,
+  mimeType         VARCHAR(191) NULL,
+  contentHash      VARCHAR(64)  NULL,
+  status           ENUM('PENDING', 'PROCESSING', 'COMPLETED', 'FAILED', 'PARTIALLY_COMPLETED') NULL DEFAULT 'PENDING',
+  processedAt      DATETIME(3)  NULL,
+  errorMessage     LONGTEXT     NULL,
+  uploadedBy       VARCHAR(191) NULL,
+  createdAt        DATETIME(3)  NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+  updatedAt        DATETIME(3)  NOT NULL,
+  PRIMARY KEY (id),
+  KEY documents_subjectId_idx (subjectId),
+  KEY documents_type_idx (type),
+  KEY documents_status_idx (status),
+  KEY documents_contentHash_idx (contentHash),
+  CONSTRAINT documents_subjectId_fkey FOREIGN KEY (subjectId) REFERENCES subjects (id)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS chunks (
+  id             VARCHAR(191) NOT NULL,
+  documentId     VARCHAR(191) NOT NULL,
+  chapterNumber  INT          NULL,
+  chapterTitle   VARCHAR(191) NULL,
+  pageStart      INT          NULL,
+  pageEnd        INT          NULL,
+  content        LONGTEXT     NOT NULL,
+  contentLength  INT          NOT NULL,
+  tokenCount     INT          NULL,
+  embedding      JSON         NULL,
+  embeddingModel VARCHAR(191) NULL,
+  chunkIndex     INT          NOT NULL,
+  chunkType      VARCHAR(191) NOT NULL DEFAULT 'TEXT',
+  createdAt      DATETIME(3)  NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+  updatedAt      DATETIME(3)  NOT NULL,
+  PRIMARY KEY (id),
+  KEY chunks_documentId_idx (documentId),
+  KEY chunks_documentId_chunkIndex_id_idx (documentId, chunkIndex, id),
+  CONSTRAINT chunks_documentId_fkey FOREIGN KEY (documentId) REFERENCES documents (id) ON DELETE CASCADE
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS chunk_embeddings (
+  id        VARCHAR(191) NOT NULL,
+  chunkId   VARCHAR(191) NOT NULL,
+  tag       VARCHAR(191) NOT NULL,
+  embedding JSON         NOT NULL,
+  createdAt DATETIME(3)  NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+  PRIMARY KEY (id),
+  UNIQUE KEY chunk_embeddings_tag_chunkId_key (tag, chunkId),
+  KEY chunk_embeddings_chunkId_idx (chunkId),
+  CONSTRAINT chunk_embeddings_chunkId_fkey FOREIGN KEY (chunkId) REFERENCES chunks (id) ON DELETE CASCADE
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT IGNORE INTO subjects (id, name, grade, updatedAt)
+VALUES ('loadtest-subject', 'Load test', 10, CURRENT_TIMESTAMP(3));
@@ -0,0 +1,156 @@
+"""
+Local stand-in for the OpenAI embeddings API
+
+Serves POST /v1/embeddings with deterministic unit vectors (same text, same
+vector), float or base64 encoded, after a configurable latency. Failures
+can be injected: plain 500s at --error-rate, and 429s either at
+--throttle-rate or whenever the request/token budgets per minute
+(--rpm, --tpm) are exceeded, with a retry-after-ms header like the real API.
+
+Usage (from python-service/):
+    python -m loadtest.stub_openai --port 8900 --latency-ms 150 --throttle-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python -m app.serve
+
+GET /stats reports request, input and injected-failure counts.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Union
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class StubConfig:
+    latency_ms: float = 100.0
+    latency_per_input_ms: float = 0.5
+    jitter: float = 0.2  # +/- share of the latency
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    rpm: int = 0  # 0 = unlimited
+    tpm: int = 0
+    retry_after_ms: int = 1000
+
+
+class EmbeddingRequest(BaseModel):
+    input: Union[str, List[str]]
+    model: str = 'text-embedding-3-large'
+    dimensions: Optional[int] = None
+    encoding_format: str = 'float'
+
+
+MODEL_DIMENSIONS = {
+    'text-embedding-3-large': 3072,
+    'text-embedding-3-small': 1536,
+    'text-embedding-ada-002': 1536,
+}
+
+config = StubConfig()
+app = FastAPI(title="OpenAI embeddings stub")
+stats: Dict[str, int] = {'requests': 0, 'inputs': 0, 'tokens': 0, 'errors_injected': 0, 'throttled': 0}
+_window: Deque[Tuple[float, int]] = deque()  # (time, tokens) of accepted requests in the last minute
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: EmbeddingRequest):
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    tokens = sum(len(text) // 4 + 1 for text in texts)
+    stats['requests'] += 1
+
+    if _over_budget(tokens) or random.random() < config.throttle_rate:
+        stats['throttled'] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={'retry-after-ms': str(config.retry_after_ms)},
+            content={'error': {
+                'message': 'Rate limit reached (stub)',
+                'type': 'requests',
+                'code': 'rate_limit_exceeded',
+            }},
+        )
+
+    latency = (config.latency_ms + config.latency_per_input_ms * len(texts)) / 1000.0
+    await asyncio.sleep(max(latency * random.uniform(1 - config.jitter, 1 + config.jitter), 0.0))
+
+    if random.random() < config.error_rate:
+        stats['errors_injected'] += 1
+        return JSONResponse(
+            status_code=500,
+            content={'error': {'message': 'Injected server error (stub)', 'type': 'server_error'}},
+        )
+
+    dims = request.dimensions or MODEL_DIMENSIONS.get(request.model, 3072)
+    data = []
+    for index, text in enumerate(texts):
+        vector = _vector(text, dims)
+        if request.encoding_format == 'base64':
+            embedding = base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii')
+        else:
+            embedding = vector.tolist()
+        data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+
+    stats['inputs'] += len(texts)
+    stats['tokens'] += tokens
+    return {
+        'object': 'list',
+        'data': data,
+        'model': request.model,
+        'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def _vector(text: str, dims: int) -> np.ndarray:
+    """Unit vector seeded by the text, so identical texts embed identically"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    vector = np.random.default_rng(seed).standard_normal(dims, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _over_budget(tokens: int) -> bool:
+    """Sliding one-minute request and token budgets (records the request if it fits)"""
+    if not config.rpm and not config.tpm:
+        return False
+    now = time.monotonic()
+    while _window and _window[0][0] <= now - 60:
+        _window.popleft()
+    if config.rpm and len(_window) + 1 > config.rpm:
+        return True
+    if config.tpm and sum(used for _, used in _window) + tokens > config.tpm:
+        return True
+    _window.append((now, tokens))
+    return False
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="OpenAI embeddings stub")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=config.latency_ms, help='Base latency per request')
+    parser.add_argument('--latency-per-input-ms', type=float, default=config.latency_per_input_ms)
+    parser.add_argument('--jitter', type=float, default=config.jitter, help='Latency jitter (share, +/-)')
+    parser.add_argument('--error-rate', type=float, default=config.error_rate, help='Share of requests failing with 500')
+    parser.add_argument('--throttle-rate', type=float, default=config.throttle_rate, help='Share of requests failing with 429')
+    parser.add_argument('--rpm', type=int, default=config.rpm, help='Requests per minute before 429s (0 = unlimited)')
+    parser.add_argument('--tpm', type=int, default=config.tpm, help='Tokens per minute before 429s (0 = unlimited)')
+    parser.add_argument('--retry-after-ms', type=int, default=config.retry_after_ms)
+    args = parser.parse_args(argv)
+
+    for name in ('latency_ms', 'latency_per_input_ms', 'jitter', 'error_rate', 'throttle_rate', 'rpm', 'tpm', 'retry_after_ms'):
+        setattr(config, name, getattr(args, name))
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Synthetic PDF, DOCX and XLSX documents for load tests
+
+Every file gets a random nonce in its text, so the processor's content-hash
+dedup never short-circuits a run by cloning an earlier document's chunks.
+Text is Vietnamese with "Chương N" headings (see make_pdf for PDFs), the
+shape the chapter detector and chunker see in production textbooks.
+"""
+import io
+import random
+import unicodedata
+from typing import List, Tuple
+
+WORDS = (
+    "học sinh giáo viên bài học kiến thức phương trình hàm số đồ thị tam giác "
+    "hình học lịch sử địa lý văn học ngữ pháp thí nghiệm năng lượng tế bào "
+    "môi trường dân số kinh tế văn hóa xã hội tính chất định nghĩa ví dụ bài tập "
+    "luyện tập vận dụng phân tích so sánh kết luận"
+).split()
+
+FILE_TYPES = ('pdf', 'docx', 'xlsx')
+
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _chapters(rng: random.Random, chapters: int, paragraphs: int, nonce: str) -> List[Tuple[str, List[str]]]:
+    return [
+        (
+            f"Chương {number}: {' '.join(rng.choice(WORDS) for _ in range(3)).capitalize()}",
+            [f"Mã tài liệu {nonce}."] + [_paragraph(rng, rng.randint(40, 90)) for _ in range(paragraphs)],
+        )
+        for number in range(1, chapters + 1)
+    ]
+
+
+def make_pdf(rng: random.Random, chapters: int, paragraphs: int, nonce: str) -> bytes:
+    """
+    Chapters start on a new page; paragraphs flow onto further pages
+
+    The built-in PDF fonts only cover Latin-1, so text is folded (ư -> u,
+    ố -> o, ...) and chapters are headed "Bài N", which still matches the
+    heading detector.
+    """
+    import fitz
+
+    document = fitz.open()
+    for heading, body in _chapters(rng, chapters, paragraphs, nonce):
+        heading = heading.replace('Chương', 'Bài', 1)
+        page, top = document.new_page(), 50.0
+        for index, text in enumerate([heading] + body):
+            text = _latin(text)
+            fontsize = 16 if index == 0 else 10
+            bottom = page.rect.height - 50
+            if bottom - top < 2 * fontsize:  # Page is full
+                page, top = document.new_page(), 50.0
+            left = page.insert_textbox(fitz.Rect(50, top, page.rect.width - 50, bottom), text, fontsize=fontsize)
+            if left < 0:  # Didn't fit (nothing was written): continue on a new page
+                page, top = document.new_page(), 50.0
+                left = page.insert_textbox(fitz.Rect(50, top, page.rect.width - 50, bottom), text, fontsize=fontsize)
+            top = bottom - max(left, 0) + 8
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def _latin(text: str) -> str:
+    """Drop the diacritics the built-in PDF fonts can't draw"""
+    folded = []
+    for char in text:
+        try:
+            char.encode('cp1252')
+        except UnicodeEncodeError:
+            char = {'đ': 'd', 'Đ': 'D'}.get(char) or ''.join(
+                part for part in unicodedata.normalize('NFD', char) if not unicodedata.combining(part)
+            )
+        folded.append(char)
+    return ''.join(folded)
+
+
+def make_docx(rng: random.Random, chapters: int, paragraphs: int, nonce: str) -> bytes:
+    from docx import Document
+
+    document = Document()
+    for heading, body in _chapters(rng, chapters, paragraphs, nonce):
+        document.add_heading(heading, level=1)
+        for paragraph in body:
+            document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_xlsx(rng: random.Random, chapters: int, paragraphs: int, nonce: str) -> bytes:
+    """One sheet per chapter, one row per paragraph"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for number, (heading, body) in enumerate(_chapters(rng, chapters, paragraphs, nonce), start=1):
+        sheet = workbook.create_sheet(title=f"Chuong {number}")
+        sheet.append(['STT', 'Nội dung', 'Ghi chú'])
+        for row, paragraph in enumerate(body, start=1):
+            sheet.append([row, paragraph, heading])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+MAKERS = {'pdf': make_pdf, 'docx': make_docx, 'xlsx': make_xlsx}
+
+
+def make_document(file_type: str, rng: random.Random, chapters: int = 5, paragraphs: int = 12) -> Tuple[str, bytes]:
+    """
+    Returns:
+        Tuple of (file name, file bytes) for a unique document
+    """
+    nonce = '%016x' % rng.getrandbits(64)
+    return f"loadtest-{nonce}.{file_type}", MAKERS[file_type](rng, chapters, paragraphs, nonce)